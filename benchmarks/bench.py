@@ -0,0 +1,357 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+# Files per package, i.e. per BUILD.py
+PACKAGE_SIZE = 100
+
+# Packages per group; the root build file includes each group, and each group
+# includes its packages
+GROUP_SIZE = 50
+
+# Regressions smaller than this are noise
+DEFAULT_THRESHOLD = 0.10
+
+# How much `wright` may add to the interpreter's own start up time, in seconds
+STARTUP_BUDGET = 0.05
+
+_ROOT_BUILD = '''from wright import task, include
+
+@task
+{includes}
+def build(ctx):
+    for name in {groups!r}:
+        ctx[name].build()
+'''
+
+_GROUP_BUILD = '''from wright import task, include
+from wright.proojekt import current_path
+
+@task
+{includes}
+def build(ctx):
+    for name in {packages!r}:
+        ctx[name].build()
+'''
+
+_PACKAGE_BUILD = '''from wright import task, sources, target
+
+@task
+@sources("**/*.go")
+@target("bin/{name}")
+def build(ctx):
+    return ctx.target
+'''
+
+
+class Monorepo:
+    """A synthetic repository of Go packages, each with its own BUILD.py,
+    included by a BUILD.py per group of packages, in turn included by a
+    BUILD.py at the root."""
+
+    def __init__(self, root: Path, files: int):
+        self.root = root
+        self.files = files
+
+    def generate(self):
+        groups: dict[str, list[str]] = {}
+
+        # Old enough that the fingerprint engine remembers their digests
+        past = time.time() - 3600
+
+        for index, start in enumerate(range(0, self.files, PACKAGE_SIZE)):
+            group = f"group{index // GROUP_SIZE:04d}"
+            name = f"pkg{index:06d}"
+            groups.setdefault(group, []).append(name)
+
+            directory = self.root / group / name
+            (directory / "internal").mkdir(parents=True)
+            (directory / "BUILD.py").write_text(_PACKAGE_BUILD.format(name=name))
+
+            for file in range(min(PACKAGE_SIZE, self.files - start)):
+                subdir = directory / "internal" if file % 4 == 0 else directory
+                path = subdir / f"file{file:03d}.go"
+                path.write_text(f"package {name}\n")
+                os.utime(path, (past, past))
+
+        for group, names in groups.items():
+            includes = "\n".join(f'@include(current_path(__file__) / "{name}")' for name in names)
+            (self.root / group / "BUILD.py").write_text(_GROUP_BUILD.format(includes=includes, packages=names))
+
+        includes = "\n".join(f'@include("{group}")' for group in groups)
+        (self.root / "BUILD.py").write_text(_ROOT_BUILD.format(includes=includes, groups=list(groups)))
+        (self.root / ".gitignore").write_text("bin/\n")
+
+
+class Results:
+    """Benchmark timings, by name, saved as JSON."""
+
+    def __init__(self):
+        self.meta = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "commit": _commit(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        self.timings: dict[str, dict] = {}
+
+    def add(self, name: str, samples: list[float], **extra):
+        self.timings[name] = {
+            "median": statistics.median(samples),
+            "min": min(samples),
+            "runs": len(samples),
+            **extra,
+        }
+        print(f"{name:<40} {_format(statistics.median(samples)):>10}  (min {_format(min(samples))})")
+
+    def save(self, path: Path):
+        path.write_text(json.dumps({"meta": self.meta, "timings": self.timings}, indent=2))
+
+
+def measure(func: Callable[[], object], repeat: int, setup: Callable[[], object] | None = None) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    return samples
+
+
+def bench_dependencies(repo: Monorepo, results: Results, repeat: int):
+    """The change checks:  the timestamp scan and the fingerprint, across the
+    whole repository."""
+    from wright.proojekt import fingerprint
+    from wright.proojekt.support import check_dependencies
+
+    os.chdir(repo.root)
+    reference = repo.root / "bin" / "all"
+    reference.parent.mkdir(exist_ok=True)
+    reference.touch()
+
+    samples = measure(lambda: check_dependencies(["**/*.go"], str(reference)), repeat)
+    results.add(f"check_dependencies/{repo.files}", samples)
+
+    state = fingerprint.StateStore(repo.root / ".wright" / "bench.db")
+    samples = measure(lambda: fingerprint.fingerprint(["**/*.go"], state=state), 1)
+    results.add(f"fingerprint_cold/{repo.files}", samples)
+
+    # Later runs find every file's digest in the state store
+    state = fingerprint.StateStore(repo.root / ".wright" / "bench.db")
+    samples = measure(lambda: fingerprint.fingerprint(["**/*.go"], state=state), repeat)
+    results.add(f"fingerprint_warm/{repo.files}", samples)
+    state.close()
+
+
+def bench_load(repo: Monorepo, results: Results, repeat: int):
+    """Loading the root build file and every build file it includes."""
+    from wright.proojekt import support
+
+    os.chdir(repo.root)
+
+    def reset():
+        support._loaded.clear()
+        support._included.clear()
+        for name in [name for name in sys.modules if name.startswith(("group", "pkg", "buildfile"))]:
+            del sys.modules[name]
+
+    samples = measure(lambda: support.load_file(repo.root / "BUILD.py", "build"), repeat, reset)
+    results.add(f"load_file/{repo.files}", samples)
+
+
+def bench_dispatch(results: Results, calls: int, repeat: int):
+    """The overhead the decorators add to each task call."""
+    from wright.proojekt import Proojekt, decorators, scheduler
+
+    def plain(ctx):
+        return ctx
+
+    @decorators.task
+    def single(ctx):
+        return ctx
+
+    @decorators.task
+    @decorators.depends(single)
+    def chained(ctx):
+        return ctx
+
+    ctx = Proojekt(Path.cwd())
+
+    def loop(func: Callable):
+        def run():
+            for _ in range(calls):
+                func(ctx=ctx)
+        return run
+
+    def loop_scheduled(func: Callable):
+        def run():
+            for _ in range(calls):
+                with scheduler.session(1):
+                    func(ctx=ctx)
+        return run
+
+    for name, func in (("plain", loop(plain)), ("task", loop(single)), ("depends", loop_scheduled(chained))):
+        samples = [sample / calls for sample in measure(func, repeat)]
+        results.add(f"dispatch_{name}", samples)
+
+    args, kwargs = (ctx,), {"ctx": ctx, "other": 1}
+    samples = [s / calls for s in measure(lambda: [decorators._get_ctx(args, kwargs) for _ in range(calls)], repeat)]
+    results.add("dispatch_get_ctx", samples)
+
+    samples = [s / calls for s in measure(
+        lambda: [decorators._may_include_kwargs(plain, kwargs) for _ in range(calls)], repeat)]
+    results.add("dispatch_may_include_kwargs", samples)
+
+
+def bench_startup(repo: Monorepo, results: Results, repeat: int):
+    """Starting a fresh process:  the bare interpreter, importing wright, and
+    the `wright` command doing nothing but listing the tasks."""
+    env = dict(os.environ, WRIGHT_DAEMON="0")
+
+    def run(*args: str):
+        return lambda: subprocess.run([sys.executable, *args], cwd=repo.root, env=env,
+                                      stdout=subprocess.DEVNULL, check=True)
+
+    baseline = measure(run("-c", "pass"), repeat)
+    results.add("startup_python", baseline)
+
+    samples = measure(run("-c", "import wright"), repeat)
+    results.add("startup_import", samples)
+
+    samples = measure(run("-m", "wright.main", "tasks"), repeat)
+    overhead = statistics.median(samples) - statistics.median(baseline)
+    results.add("startup_tasks", samples, overhead=overhead, budget=STARTUP_BUDGET)
+
+    if overhead > STARTUP_BUDGET:
+        print(f"  over budget: wright adds {_format(overhead)} to start up, "
+              f"more than {_format(STARTUP_BUDGET)}")
+
+
+def run(args: argparse.Namespace) -> int:
+    results = Results()
+    work = Path(args.workdir or tempfile.mkdtemp(prefix="wright-bench-"))
+    cwd = os.getcwd()
+
+    os.environ["WRIGHT_STATE_DIR"] = str(work / "state")
+
+    try:
+        bench_dispatch(results, args.calls, args.repeat)
+
+        for size in args.sizes:
+            repo = Monorepo(work / f"repo{size}", size)
+            if not repo.root.exists():
+                print(f"Generating {size} files in {repo.root}")
+                repo.generate()
+
+            bench_dependencies(repo, results, args.repeat)
+            bench_load(repo, results, args.repeat)
+            os.chdir(cwd)
+
+        smallest = Monorepo(work / f"repo{min(args.sizes)}", min(args.sizes))
+        bench_startup(smallest, results, args.repeat)
+    finally:
+        os.chdir(cwd)
+        if not args.workdir and not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    output = Path(args.output)
+    results.save(output)
+    print(f"Saved results to {output}")
+
+    if args.baseline:
+        return compare(Path(args.baseline), output, args.threshold)
+
+    return 0
+
+
+def compare(baseline: Path, current: Path, threshold: float = DEFAULT_THRESHOLD) -> int:
+    """Compare the medians of two runs.  Returns 1 if anything got slower by
+    more than the threshold, or went over the startup budget."""
+    before = json.loads(baseline.read_text())["timings"]
+    after = json.loads(current.read_text())["timings"]
+
+    failed = False
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name]["median"], after[name]["median"]
+        change = (new - old) / old if old else 0.0
+
+        flag = ""
+        if change > threshold:
+            flag = "REGRESSION"
+            failed = True
+        elif change < -threshold:
+            flag = "faster"
+
+        print(f"{name:<40} {_format(old):>10} {_format(new):>10} {change:+8.1%}  {flag}")
+
+    startup = after.get("startup_tasks")
+    if startup and startup.get("overhead", 0) > startup.get("budget", STARTUP_BUDGET):
+        print(f"startup overhead {_format(startup['overhead'])} is over the budget of {_format(startup['budget'])}")
+        failed = True
+
+    for name in sorted(before.keys() - after.keys()):
+        print(f"{name:<40} missing from {current}")
+
+    return 1 if failed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark wright on synthetic monorepos")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and save the results")
+    run_parser.add_argument("--sizes", default="1000,10000",
+                            type=lambda value: [int(size) for size in value.split(",")],
+                            help="Comma-separated repository sizes, in files (e.g. 1000,100000,1000000)")
+    run_parser.add_argument("--repeat", type=int, default=5, help="Times to run each benchmark")
+    run_parser.add_argument("--calls", type=int, default=10000, help="Task calls per dispatch benchmark")
+    run_parser.add_argument("--output", default="benchmarks.json", help="Where to save the results")
+    run_parser.add_argument("--baseline", help="Compare the results against this earlier run")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                            help="Slowdown, as a fraction, that counts as a regression")
+    run_parser.add_argument("--workdir", help="Generate the repositories here, and keep them for later runs")
+    run_parser.add_argument("--keep", action="store_true", help="Don't delete the generated repositories")
+
+    compare_parser = commands.add_parser("compare", help="Compare two saved runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="Slowdown, as a fraction, that counts as a regression")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        return compare(Path(args.baseline), Path(args.current), args.threshold)
+
+    return run(args)
+
+
+def _format(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.1f}ms"
+    return f"{seconds:.2f}s"
+
+
+def _commit() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).parent)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
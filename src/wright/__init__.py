@@ -1,3 +1,5 @@
+import importlib
+
 __all__ = [
     "task",
     "sources",
@@ -11,5 +13,30 @@ __all__ = [
     "bump_version",
 ]
 
-from .proojekt.decorators import task, sources, depends, target, include
-from .proojekt.support import load_file, check_dependencies, is_env, bump_version
+# The public API is imported on first use, so commands that never touch it,
+# like forwarding to the daemon, start quickly.
+_exports = {
+    "task": ".proojekt.decorators",
+    "sources": ".proojekt.decorators",
+    "depends": ".proojekt.decorators",
+    "target": ".proojekt.decorators",
+    "include": ".proojekt.decorators",
+
+    "load_file": ".proojekt.support",
+    "check_dependencies": ".proojekt.support",
+    "is_env": ".proojekt.support",
+    "bump_version": ".proojekt.support",
+}
+
+
+def __getattr__(name: str):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
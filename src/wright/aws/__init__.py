@@ -1,3 +1,5 @@
-__all__ = ["create_repository", "describe_images", "authenticate_ecr"]
+__all__ = ["ECRError", "CredentialsNotFoundError", "client", "create_repository", "describe_images",
+           "batch_get_image", "authenticate_ecr"]
 
-from .ecr import create_repository, describe_images, authenticate_ecr
+from .ecr import ECRError, client, create_repository, describe_images, batch_get_image, authenticate_ecr
+from .sigv4 import CredentialsNotFoundError
@@ -1,59 +1,360 @@
-import sh
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-# TODO: https://github.com/boto/boto3
+from wright.proojekt import process
+from wright.proojekt.support import state_dir
 
-def create_repository(region: str, repository_name: str):
+from . import sigv4
+
+# The ECR API's JSON protocol target prefix
+_TARGET = "AmazonEC2ContainerRegistry_V20150921"
+
+# Log in again when the cached token has less than this long left, in seconds
+TOKEN_MARGIN = 15 * 60
+
+# Requests in flight at once when querying many repositories
+MAX_CONCURRENT = 8
+
+_clients: dict[tuple[str, str | None, str | None], Client] = {}
+_clients_lock = threading.Lock()
+
+# Account IDs by access key, looked up with STS when the credentials don't say
+_accounts: dict[str, str] = {}
+
+
+class ECRError(Exception):
+    """Raised when ECR rejects a request.  The code is the AWS error type,
+    e.g. RepositoryNotFoundException."""
+
+    def __init__(self, code: str, message: str):
+        self.code = code
+        super().__init__(f"{code}: {message}")
+
+
+class Client:
+    """
+    Talks to the ECR API in a region directly over HTTPS, signing requests
+    with the AWS credentials, rather than starting the aws command for every
+    call.  Each thread keeps its connection open between requests.  The
+    endpoint may be overridden with AWS_ENDPOINT_URL_ECR or AWS_ENDPOINT_URL,
+    e.g. for a local fake.
+    """
+
+    def __init__(self, region: str, endpoint: str | None = None, profile: str | None = None):
+        self.region = region
+        endpoint = endpoint or os.getenv("AWS_ENDPOINT_URL_ECR") or os.getenv("AWS_ENDPOINT_URL") or (
+            f"https://api.ecr.{region}.amazonaws.com")
+
+        parsed = urllib.parse.urlsplit(endpoint)
+        self.scheme = parsed.scheme
+        self.host = parsed.netloc
+        self.profile = profile
+        self._local = threading.local()
+        self._tokens: dict[str, dict] = {}
+        self._token_lock = threading.Lock()
+
+    def call(self, operation: str, params: dict) -> dict:
+        """Call an ECR API operation, e.g. "DescribeImages", returning the
+        decoded response."""
+        import http.client
+
+        body = json.dumps(params).encode("utf-8")
+        headers = sigv4.sign("POST", self.host, "/", {
+            "Content-Type": "application/x-amz-json-1.1",
+            "X-Amz-Target": f"{_TARGET}.{operation}",
+        }, body, self.region, "ecr", sigv4.credentials(self.profile))
+
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request("POST", "/", body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (OSError, http.client.HTTPException) as err:
+                # The server may have closed an idle connection; reconnect once
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise ECRError("ConnectionError", f"Unable to reach {self.host}: {err}")
+
+        try:
+            result = json.loads(data) if data else {}
+        except ValueError:
+            result = {}
+
+        if response.status != 200:
+            code = result.get("__type", f"HTTP{response.status}").rpartition("#")[2]
+            raise ECRError(code, result.get("message") or result.get("Message") or data.decode("utf-8", "replace"))
+
+        return result
+
+    def create_repository(self, repository_name: str) -> bool:
+        """Create the repository, returning false if it already exists."""
+        try:
+            self.call("CreateRepository", {"repositoryName": repository_name})
+            return True
+        except ECRError as err:
+            if err.code == "RepositoryAlreadyExistsException":
+                return False
+            raise
+
+    def describe_images(self, repository_name: str, tags: list[str] | None = None) -> list[dict]:
+        """Every image in the repository, or just those with the tags,
+        following the pages of results."""
+        params: dict = {"repositoryName": repository_name}
+        if tags:
+            params["imageIds"] = [{"imageTag": tag} for tag in tags]
+
+        images = []
+        while True:
+            result = self.call("DescribeImages", params)
+            images.extend(result.get("imageDetails", []))
+            if not result.get("nextToken"):
+                return images
+            params["nextToken"] = result["nextToken"]
+
+    def describe_many(self, repositories: list[str]) -> dict[str, list[dict]]:
+        """Describe the images in many repositories at once, over several
+        connections.  Repositories that don't exist have no images."""
+        def describe(repository: str) -> list[dict]:
+            try:
+                return self.describe_images(repository)
+            except ECRError as err:
+                if err.code == "RepositoryNotFoundException":
+                    return []
+                raise
+
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT, len(repositories) or 1)) as pool:
+            return dict(zip(repositories, pool.map(describe, repositories)))
+
+    def batch_get_image(self, repository_name: str, tags: list[str]) -> tuple[list[dict], list[dict]]:
+        """Fetch the manifests of the tagged images, 100 at a time as ECR
+        allows.  Returns the images found and the failures, e.g. missing
+        tags."""
+        images, failures = [], []
+        for start in range(0, len(tags), 100):
+            result = self.call("BatchGetImage", {
+                "repositoryName": repository_name,
+                "imageIds": [{"imageTag": tag} for tag in tags[start:start + 100]],
+            })
+            images.extend(result.get("images", []))
+            failures.extend(result.get("failures", []))
+
+        return images, failures
+
+    def authorization(self) -> dict:
+        """The registry login:  username, password, registry host and expiry.
+        Cached, in memory and under .wright/, until shortly before it expires.
+        Tokens are kept per account and access key, so switching profiles or
+        accounts never reuses another's."""
+        creds = sigv4.credentials(self.profile)
+        key = "\0".join([self.region, self.host, self._account_id(creds) or "", creds.access_key])
+
+        with self._token_lock:
+            token = self._tokens.get(key)
+            if token and token["expires"] - time.time() > TOKEN_MARGIN:
+                return token
+
+            cached = _token_path(key)
+            try:
+                token = json.loads(cached.read_text(encoding="utf-8"))
+                if token["expires"] - time.time() > TOKEN_MARGIN:
+                    self._tokens[key] = token
+                    return token
+            except (OSError, ValueError, KeyError):
+                pass
+
+            data = self.call("GetAuthorizationToken", {})["authorizationData"][0]
+            username, _, password = base64.b64decode(data["authorizationToken"]).decode("utf-8").partition(":")
+            token = {
+                "username": username,
+                "password": password,
+                "host": urllib.parse.urlsplit(data["proxyEndpoint"]).netloc or data["proxyEndpoint"],
+                "expires": _timestamp(data["expiresAt"]),
+            }
+
+            _prune_tokens()
+            _write_private(cached, json.dumps(token))
+            self._tokens[key] = token
+            return token
+
+    def _account_id(self, creds: sigv4.Credentials) -> str | None:
+        """The account the credentials belong to, asking STS if they don't
+        say.  None if STS can't be reached; the access key still tells
+        accounts apart."""
+        if creds.account_id:
+            return creds.account_id
+        if creds.access_key in _accounts:
+            return _accounts[creds.access_key]
+
+        # An access key always belongs to the same account, so remember it
+        known = _token_path("account\0" + creds.access_key).with_suffix(".account")
+        try:
+            _accounts[creds.access_key] = known.read_text(encoding="utf-8")
+            return _accounts[creds.access_key]
+        except OSError:
+            pass
+
+        import http.client
+
+        endpoint = urllib.parse.urlsplit(os.getenv("AWS_ENDPOINT_URL_STS") or os.getenv("AWS_ENDPOINT_URL")
+                                         or f"https://sts.{self.region}.amazonaws.com")
+        body = b"Action=GetCallerIdentity&Version=2011-06-15"
+        headers = sigv4.sign("POST", endpoint.netloc, "/", {
+            "Content-Type": "application/x-www-form-urlencoded; charset=utf-8",
+        }, body, self.region, "sts", creds)
+
+        connection = http.client.HTTPSConnection if endpoint.scheme == "https" else http.client.HTTPConnection
+        conn = connection(endpoint.netloc, timeout=10)
+        try:
+            conn.request("POST", "/", body=body, headers=headers)
+            response = conn.getresponse()
+            match = re.search(rb"<Account>(\d+)</Account>", response.read())
+        except (OSError, http.client.HTTPException) as err:
+            logging.debug(f"Unable to look up the AWS account: {err}")
+            return None
+        finally:
+            conn.close()
+
+        if response.status != 200 or not match:
+            logging.debug(f"Unable to look up the AWS account: STS returned {response.status}")
+            return None
+
+        _accounts[creds.access_key] = match.group(1).decode("ascii")
+        _write_private(known, _accounts[creds.access_key])
+        return _accounts[creds.access_key]
+
+    def _connection(self):
+        import http.client
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.scheme == "https":
+                conn = http.client.HTTPSConnection(self.host, timeout=30)
+            else:
+                conn = http.client.HTTPConnection(self.host, timeout=30)
+            self._local.conn = conn
+
+        return conn
+
+
+def client(region: str) -> Client:
+    """The ECR client for the region, shared by everything in this process
+    that uses the same endpoint."""
+    key = (region, os.getenv("AWS_ENDPOINT_URL_ECR"), os.getenv("AWS_ENDPOINT_URL"))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = Client(region)
+
+        return _clients[key]
+
+
+def create_repository(region: str, repository_name: str) -> bool:
     """
     Create a repository in AWS Elastic Container Registry if it doesn't exist.
-    The repository name should not include the hostname bit of the repository.
-    For example, if your image tag is something like:
+    Returns false if it already did.  The repository name should not include
+    the hostname bit of the repository.  For example, if your image tag is
+    something like:
 
         97829rt74e748ew87.dkr.ecr.us-east-2.amazonaws.com/myapp/myservice:3.7.23
 
     Then the repository name should be `myapp/myservice`.
     """
+    return client(region).create_repository(repository_name)
+
+
+def describe_images(region: str, repository_name: str) -> list[dict]:
+    """
+    List the versions of the given image that are available, along with when
+    they were pushed, as ECR's imageDetails:  imageTags, imageDigest,
+    imagePushedAt, imageSizeInBytes and so on.  To check many repositories,
+    use client(region).describe_many.
+    """
+    return client(region).describe_images(repository_name)
+
+
+def batch_get_image(region: str, repository_name: str, tags: list[str]) -> tuple[list[dict], list[dict]]:
+    """The manifests of the tagged images, and the tags that failed."""
+    return client(region).batch_get_image(repository_name, tags)
+
+
+def authenticate_ecr(region: str, username: str | None = None, host: str | None = None):
+    """Log Docker in to the region's registry, unless it's already logged in
+    with a token that's still good.  The password goes to docker login on
+    stdin."""
+    token = client(region).authorization()
+    username = username or token["username"]
+    host = host or token["host"]
+
+    config = _docker_config()
+    marker = hashlib.sha256(f"{username}\0{host}\0{token['password']}".encode("utf-8")).hexdigest()
+    logged_in = _token_path(f"{host}\0{config}").with_suffix(".login")
+
+    # Only trust our note of the login while Docker still has it, e.g. not
+    # after a docker logout
     try:
-        sh.aws(["ecr", "create-repository", "--repository-name", repository_name, "--region", region])
+        if logged_in.read_text(encoding="utf-8") == marker and _docker_has_login(config, host):
+            return
+    except OSError:
+        pass
 
+    process.run("docker", "login", "--username", username, "--password-stdin", host, input=token["password"])
+    _write_private(logged_in, marker)
 
-        # TODO: add lifecycle policy
-    except sh.ErrorReturnCode as e:
-        if e.stdout.decode().strip() == "[]":
-            return False
 
+def _token_path(key: str) -> Path:
+    name = hashlib.blake2b(key.encode("utf-8"), digest_size=10).hexdigest()
+    return state_dir() / "aws" / f"ecr-{name}.json"
 
-# aws ecr put-lifecycle-policy \
-#     --repository-name division/blah/bob \
-#     --lifecycle-policy-text file://policy.json \
-#     --region us-east-1
 
+def _prune_tokens():
+    """Remove cached tokens that have expired, which pile up as temporary
+    credentials rotate."""
+    for path in (state_dir() / "aws").glob("ecr-*.json"):
+        try:
+            if json.loads(path.read_text(encoding="utf-8"))["expires"] < time.time():
+                path.unlink()
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
 
-def describe_images(region: str, repository_name: str):
-    """
-    List the versions of the given image that are available, along with when
-    they were pushed.
-    """
-    pass
-
-
-# aws ecr describe-images --repository-name conduit/flynn --region us-east-2
-# {
-#     "imageDetails": [
-#         {
-#             "registryId": "982534376887",
-#             "repositoryName": "conduit/flynn",
-#             "imageDigest": "sha256:aa293b8f2323c1bce61bd1060a92abc4472975f8d7e21cab5bf495fa62e546b8",
-#             "imageTags": [
-#                 "0.6.0"
-#             ],
-#             "imageSizeInBytes": 10983130,
-#             "imagePushedAt": "2026-02-20T15:13:33.998000-07:00",
-#             "imageManifestMediaType": "application/vnd.docker.distribution.manifest.v2+json",
-#             "artifactMediaType": "application/vnd.docker.container.image.v1+json"
-#         }
-#     ]
-# }
-
-
-def authenticate_ecr(region: str, username: str, host: str):
-    sh.Command(f"aws ecr get-login-password --region {region} | docker login --username {username} --password-stdin {host}")
+
+def _docker_config() -> Path:
+    """The Docker CLI's config file, where it records the registries it's
+    logged in to."""
+    return Path(os.getenv("DOCKER_CONFIG") or Path.home() / ".docker") / "config.json"
+
+
+def _docker_has_login(config: Path, host: str) -> bool:
+    try:
+        auths = json.loads(config.read_text(encoding="utf-8")).get("auths") or {}
+    except (OSError, ValueError, AttributeError):
+        return False
+
+    return any(registry == host or urllib.parse.urlsplit(registry).netloc == host for registry in auths)
+
+
+def _timestamp(value) -> float:
+    """ECR returns times as epoch seconds, though some fakes send ISO 8601."""
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    import datetime
+    return datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+def _write_private(path: Path, content: str):
+    """Write a file only the current user can read, since it holds a secret."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(content)
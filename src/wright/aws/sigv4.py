@@ -0,0 +1,124 @@
+import configparser
+import datetime
+import hashlib
+import hmac
+import os
+import threading
+from pathlib import Path
+
+# boto3's credentials, by the settings they were loaded with.  They refresh
+# themselves as they expire, so are kept rather than looked up every time.
+_boto3_credentials: dict[tuple[str | None, ...], object] = {}
+_boto3_lock = threading.Lock()
+
+
+class CredentialsNotFoundError(Exception):
+    """Raised when no AWS credentials can be found."""
+    pass
+
+
+class Credentials:
+    """An AWS access key, with the session token for temporary credentials,
+    and the account it belongs to, if known."""
+
+    def __init__(self, access_key: str, secret_key: str, token: str | None = None, account_id: str | None = None):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.token = token
+        self.account_id = account_id
+
+
+def credentials(profile: str | None = None) -> Credentials:
+    """
+    Find the AWS credentials to sign requests with:  from the environment,
+    then from boto3 if it's installed, which also knows about SSO, roles and
+    instance metadata, then from the shared credentials file.  Cheap enough
+    to call for every request, so rotated or refreshed credentials are
+    picked up as soon as they change.
+    """
+    if not profile and os.getenv("AWS_ACCESS_KEY_ID") and os.getenv("AWS_SECRET_ACCESS_KEY"):
+        return Credentials(os.environ["AWS_ACCESS_KEY_ID"], os.environ["AWS_SECRET_ACCESS_KEY"],
+                           os.getenv("AWS_SESSION_TOKEN"), os.getenv("AWS_ACCOUNT_ID"))
+
+    found = _boto3(profile)
+    if found is not None:
+        frozen = found.get_frozen_credentials()
+        return Credentials(frozen.access_key, frozen.secret_key, frozen.token, getattr(frozen, "account_id", None))
+
+    profile = profile or os.getenv("AWS_PROFILE", "default")
+    path = Path(os.getenv("AWS_SHARED_CREDENTIALS_FILE", Path.home() / ".aws" / "credentials"))
+
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    if parser.has_option(profile, "aws_access_key_id") and parser.has_option(profile, "aws_secret_access_key"):
+        return Credentials(parser.get(profile, "aws_access_key_id"), parser.get(profile, "aws_secret_access_key"),
+                           parser.get(profile, "aws_session_token", fallback=None),
+                           parser.get(profile, "aws_account_id", fallback=None))
+
+    raise CredentialsNotFoundError(f"No AWS credentials found for the {profile} profile")
+
+
+def _boto3(profile: str | None):
+    """boto3's credentials for the profile, or None if boto3 isn't installed
+    or has none."""
+    try:
+        import boto3
+    except ImportError:
+        return None
+
+    # Credentials read from the files don't refresh, so look again when the
+    # files change
+    files = [os.getenv("AWS_CONFIG_FILE", Path.home() / ".aws" / "config"),
+             os.getenv("AWS_SHARED_CREDENTIALS_FILE", Path.home() / ".aws" / "credentials")]
+    key = (profile, os.getenv("AWS_PROFILE"), *(f"{path}@{_mtime(path)}" for path in files))
+    with _boto3_lock:
+        if key not in _boto3_credentials:
+            _boto3_credentials[key] = boto3.Session(profile_name=profile).get_credentials()
+
+        return _boto3_credentials[key]
+
+
+def _mtime(path) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def sign(method: str, host: str, path: str, headers: dict[str, str], body: bytes,
+         region: str, service: str, creds: Credentials, now: datetime.datetime | None = None) -> dict[str, str]:
+    """Add the Signature Version 4 headers to a request's headers, returning
+    the headers to send."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    date = amz_date[:8]
+
+    headers = {**headers, "Host": host, "X-Amz-Date": amz_date}
+    if creds.token:
+        headers["X-Amz-Security-Token"] = creds.token
+
+    canonical_headers = {name.lower(): " ".join(str(value).split()) for name, value in headers.items()}
+    signed_headers = ";".join(sorted(canonical_headers))
+
+    canonical_request = "\n".join([
+        method,
+        path or "/",
+        "",
+        "".join(f"{name}:{canonical_headers[name]}\n" for name in sorted(canonical_headers)),
+        signed_headers,
+        hashlib.sha256(body).hexdigest(),
+    ])
+
+    scope = f"{date}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+    ])
+
+    key = f"AWS4{creds.secret_key}".encode("utf-8")
+    for part in (date, region, service, "aws4_request"):
+        key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+
+    signature = hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+    headers["Authorization"] = (f"AWS4-HMAC-SHA256 Credential={creds.access_key}/{scope}, "
+                                f"SignedHeaders={signed_headers}, Signature={signature}")
+    return headers
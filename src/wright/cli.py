@@ -0,0 +1,65 @@
+import logging
+import sys
+from pathlib import Path
+
+import click
+
+from wright import daemon, proojekt
+from wright.proojekt import process, scheduler, trace
+
+
+@click.command()
+@click.option('--script', default='./BUILD.py', help="Build file to use")
+@click.option('-j', '--jobs', default=None, type=int, help="Number of tasks to run at once")
+@click.option('--json', 'as_json', is_flag=True, help="Print `wright tasks` as JSON")
+@click.option('--trace', 'trace_file', default=None, help="Write a Chrome trace of the run to this file")
+@click.option('--profile', is_flag=True, help="Print how long each task took")
+@click.argument("command", default="build")
+@click.argument("task", required=False)
+def cli(script: Path, jobs: int | None, as_json: bool, trace_file: str | None, profile: bool,
+        command: str, task: str | None):
+    """Run a command in a build script.  Use `wright tasks` to list the tasks
+    without running the build script, `wright watch TASK` to run the task
+    again whenever the files it watches change, and `wright daemon
+    start|stop|status` to manage a background server that keeps build files
+    loaded between runs.  Use --trace to write a trace of where the time
+    went, for chrome://tracing or ui.perfetto.dev, and --profile to print a
+    summary per task."""
+    if trace_file or profile:
+        trace.start()
+
+    try:
+        logging.basicConfig(level=logging.WARNING)
+
+        if command == "tasks":
+            from wright.proojekt import discovery
+            discovery.print_tasks(script, as_json)
+            return
+
+        if command == "daemon":
+            sys.exit(daemon.control(task or "status"))
+
+        if command == "watch":
+            from wright.proojekt import watcher
+            watcher.watch(script, task or "build", jobs)
+            return
+
+        process.reset_logs()
+
+        with scheduler.session(jobs):
+            proojekt.load_file(script, command)
+    except AttributeError as e:
+        logging.error(e)
+    except process.ProcessError as e:
+        logging.error(e)
+        sys.exit(1)
+    finally:
+        tracer = trace.stop()
+        if tracer and trace_file:
+            tracer.write(trace_file)
+        if tracer and profile:
+            tracer.print_summary()
+
+
+if __name__ == '__main__':
+    cli()
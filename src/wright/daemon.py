@@ -0,0 +1,412 @@
+import json
+import os
+import socket
+import struct
+import sys
+import time
+from pathlib import Path
+
+# The daemon is also the thin client `wright` forwards commands through, so
+# only the standard library is imported up front.
+
+# Shut down after this long without a request
+IDLE_TIMEOUT = 30 * 60
+
+# How long to wait for output after a command finishes, in seconds.  Background
+# processes a build starts may hold its stdout open long after it's done.
+DRAIN_TIMEOUT = 2
+
+_FRAME = struct.Struct(">cI")
+_STDOUT = b"o"
+_STDERR = b"e"
+_EXIT = b"x"
+
+
+# Commands that manage the daemon or run indefinitely always run locally
+LOCAL_COMMANDS = ("daemon", "watch")
+
+
+def socket_path() -> Path:
+    """Where the daemon listens.  Lives in the state directory, like
+    support.state_dir, but without importing the rest of Wright."""
+    return Path(os.getenv("WRIGHT_STATE_DIR", ".wright")).absolute() / "daemon.sock"
+
+
+def forward(argv: list[str]) -> int | None:
+    """
+    Send the command line to a running daemon and copy its output to stdout
+    and stderr.  Returns the command's exit code, or None if there's no daemon
+    to talk to (or WRIGHT_DAEMON is "0"), in which case the caller should run
+    the command itself.
+    """
+    if os.getenv("WRIGHT_DAEMON") == "0" or any(arg in LOCAL_COMMANDS for arg in argv):
+        return None
+
+    path = socket_path()
+    if not path.exists():
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(path))
+    except OSError:
+        client.close()
+        return None
+
+    import signal
+
+    with client:
+        # Hand over stdin itself, so commands that prompt read from the terminal
+        try:
+            os.fstat(0)
+            fds = [0]
+        except OSError:
+            fds = []
+
+        request = {"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}
+        socket.send_fds(client, [b"\0"], fds)
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+        def interrupt(signum, frame):
+            # Ask the daemon to interrupt the command, and carry on reading
+            # its output until it exits.  A second Ctrl-C stops waiting.
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            try:
+                client.sendall(json.dumps({"interrupt": True}).encode("utf-8") + b"\n")
+            except OSError:
+                pass
+
+        signal.signal(signal.SIGINT, interrupt)
+        reader = client.makefile("rb")
+        try:
+            while True:
+                header = reader.read(_FRAME.size)
+                if len(header) < _FRAME.size:
+                    print("wright: lost connection to the daemon", file=sys.stderr)
+                    return 1
+
+                kind, length = _FRAME.unpack(header)
+                payload = reader.read(length)
+
+                if kind == _STDOUT:
+                    sys.stdout.buffer.write(payload)
+                    sys.stdout.buffer.flush()
+                elif kind == _STDERR:
+                    sys.stderr.buffer.write(payload)
+                    sys.stderr.buffer.flush()
+                elif kind == _EXIT:
+                    return int(payload.decode("ascii"))
+        except KeyboardInterrupt:
+            return 130
+
+
+def control(action: str) -> int:
+    """Handle `wright daemon start|stop|status`."""
+    path = socket_path()
+
+    match action:
+        case "start":
+            if _alive(path):
+                print(f"wright daemon already running at {path}")
+                return 0
+
+            import subprocess
+            import time
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            subprocess.Popen(
+                [sys.executable, "-m", "wright.daemon"],
+                cwd=os.getcwd(),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+
+            for _ in range(100):
+                if _alive(path):
+                    print(f"wright daemon listening at {path}")
+                    return 0
+                time.sleep(0.05)
+
+            print("wright daemon failed to start", file=sys.stderr)
+            return 1
+
+        case "stop":
+            if not _alive(path):
+                print("wright daemon is not running")
+                return 0
+
+            return _shutdown(path)
+
+        case "status":
+            if _alive(path):
+                print(f"wright daemon running at {path}")
+            else:
+                print("wright daemon is not running")
+            return 0
+
+        case _:
+            print(f"Unknown daemon action: {action} (use start, stop or status)", file=sys.stderr)
+            return 2
+
+
+def serve(path: Path | None = None, idle_timeout: float = IDLE_TIMEOUT):
+    """
+    Listen for commands on the socket and run them, one at a time, until told
+    to shut down or left idle for too long.  Build files, the fingerprint
+    state and anything else Wright caches in memory stay loaded between
+    commands, so a command that has nothing to do returns almost immediately.
+    """
+    from wright.proojekt import support
+
+    path = path or socket_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+
+    # Keep build modules loaded between requests
+    support.reuse_modules = True
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(path))
+    server.listen(16)
+    server.settimeout(idle_timeout)
+
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except TimeoutError:
+                break
+
+            with conn:
+                conn.settimeout(None)
+                try:
+                    if not _handle(conn):
+                        break
+                except KeyboardInterrupt:
+                    # Meant for a request that had already finished
+                    pass
+                except Exception as err:
+                    # Only that request fails; keep serving the rest
+                    print(f"wright daemon: request failed: {err}", file=sys.stderr)
+    finally:
+        server.close()
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _handle(conn: socket.socket) -> bool:
+    """Run a single request.  Returns false if the daemon should stop."""
+    # The client's stdin comes with the first byte, ahead of the request
+    _, fds, _, _ = socket.recv_fds(conn, 1, 1)
+    reader = conn.makefile("rb")
+    try:
+        request = json.loads(reader.readline())
+    except ValueError:
+        for fd in fds:
+            os.close(fd)
+        return True
+
+    try:
+        return _run_request(conn, reader, request, fds[0] if fds else None)
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def _run_request(conn: socket.socket, reader, request: dict, stdin: int | None) -> bool:
+    import signal
+    import threading
+
+    if request.get("shutdown"):
+        _send(conn, _EXIT, b"0")
+        return False
+
+    argv = request.get("argv", [])
+    if any(arg in LOCAL_COMMANDS for arg in argv):
+        _send(conn, _STDERR, b"wright: the daemon can't run this command\n")
+        _send(conn, _EXIT, b"2")
+        return True
+
+    os.chdir(request.get("cwd", os.getcwd()))
+    os.environ.clear()
+    os.environ.update(request.get("env", {}))
+
+    # Route everything written to stdout and stderr, including by child
+    # processes, through pipes we forward to the client, and read stdin from
+    # the client's.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(0), os.dup(1), os.dup(2)
+    if stdin is not None:
+        os.dup2(stdin, 0)
+
+    pumps = []
+    lock = threading.Lock()
+    running = threading.Event()
+    running.set()
+    threading.Thread(target=_listen, args=(reader, running, lock), daemon=True).start()
+
+    for fd, kind in ((1, _STDOUT), (2, _STDERR)):
+        read_end, write_end = os.pipe()
+        os.dup2(write_end, fd)
+        os.close(write_end)
+        pump = threading.Thread(target=_pump, args=(read_end, conn, kind, lock), daemon=True)
+        pump.start()
+        pumps.append(pump)
+
+    code = 130
+    try:
+        code = _execute(argv)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # The listener may have sent SIGINT just as the command finished.
+        # Ignoring it drops it if it's still pending, rather than letting it
+        # interrupt us restoring stdio and leave it on the dead pipes.
+        handler = _ignore_interrupts(signal)
+        try:
+            with lock:
+                running.clear()
+
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            except OSError:
+                pass
+
+            for fd, copy in enumerate(saved):
+                os.dup2(copy, fd)
+                os.close(copy)
+        finally:
+            signal.signal(signal.SIGINT, handler)
+
+        # Restoring the descriptors closed our ends of the pipes; the pumps
+        # finish once any processes the command left running close theirs.
+        # Don't wait on those forever, or every later request would hang too.
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        for pump in pumps:
+            pump.join(max(0.0, deadline - time.monotonic()))
+
+    try:
+        with lock:
+            _send(conn, _EXIT, str(code).encode("ascii"))
+    except OSError:
+        pass
+
+    return True
+
+
+def _execute(argv: list[str]) -> int:
+    from wright.cli import cli
+
+    try:
+        cli.main(args=argv, prog_name="wright", standalone_mode=True)
+    except KeyboardInterrupt:
+        return 130
+    except SystemExit as err:
+        if err.code is None:
+            return 0
+        if isinstance(err.code, int):
+            return err.code
+        print(err.code, file=sys.stderr)
+        return 1
+    except Exception as err:
+        print(f"wright: {err}", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+def _ignore_interrupts(signal):
+    """Ignore SIGINT, returning the handler it had.  Retries if a pending
+    SIGINT interrupts the attempt."""
+    while True:
+        try:
+            return signal.signal(signal.SIGINT, signal.SIG_IGN)
+        except KeyboardInterrupt:
+            pass
+
+
+def _listen(reader, running, lock):
+    """Interrupt the command when the client asks, i.e. on Ctrl-C, or goes
+    away without waiting for it to finish."""
+    import signal
+
+    try:
+        for line in iter(reader.readline, b""):
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+
+            if message.get("interrupt"):
+                with lock:
+                    if running.is_set():
+                        _interrupt(signal)
+    except OSError:
+        pass
+
+    with lock:
+        if running.is_set():
+            _interrupt(signal)
+
+
+def _interrupt(signal):
+    """Deliver SIGINT the way a terminal would:  to the whole process group,
+    so the commands the build is running stop too.  The daemon leads its own
+    group when started by `wright daemon start`."""
+    if os.getpgrp() == os.getpid():
+        os.killpg(os.getpgrp(), signal.SIGINT)
+    else:
+        os.kill(os.getpid(), signal.SIGINT)
+
+
+def _pump(fd: int, conn: socket.socket, kind: bytes, lock):
+    with os.fdopen(fd, "rb", buffering=0) as pipe:
+        while True:
+            data = pipe.read(64 * 1024)
+            if not data:
+                return
+            try:
+                with lock:
+                    _send(conn, kind, data)
+            except OSError:
+                # The client went away; keep draining so the build isn't blocked
+                pass
+
+
+def _send(conn: socket.socket, kind: bytes, payload: bytes):
+    conn.sendall(_FRAME.pack(kind, len(payload)) + payload)
+
+
+def _shutdown(path: Path) -> int:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(path))
+        client.sendall(b"\0" + json.dumps({"shutdown": True}).encode("utf-8") + b"\n")
+        client.recv(64)
+
+    print("wright daemon stopped")
+    return 0
+
+
+def _alive(path: Path) -> bool:
+    if not path.exists():
+        return False
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(path))
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+if __name__ == "__main__":
+    serve()
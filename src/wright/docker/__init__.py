@@ -1,5 +1,6 @@
-__all__ = ["compose", "build", "exists", "run", "stop", "running"]
+__all__ = ["compose", "engine", "build", "group", "exists", "run", "stop", "running", "snapshot"]
 
-from . import compose
-from .build import build, exists
-from .run import run, stop, running
\ No newline at end of file
+from . import compose, engine
+from .build import build, exists, group
+from .run import run, stop, running
+from .engine import snapshot
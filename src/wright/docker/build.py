@@ -1,8 +1,22 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from pathlib import Path
 from typing import Any
 
-import sh
+from wright.proojekt import Proojekt, process
+from wright.proojekt.support import parse_size, state_dir
 
-from wright.proojekt import Proojekt
+from . import cache, context, engine
+
+# The label recording the digest of everything an image was built from
+INPUTS_LABEL = "wright.inputs"
+
+# Build contexts bigger than this get a warning; WRIGHT_DOCKER_CONTEXT_LIMIT
+# overrides it
+DEFAULT_CONTEXT_LIMIT = 200 * 1024 ** 2
 
 
 class Builder:
@@ -17,8 +31,13 @@ class Builder:
         self.version: str = version
         self._build_args: dict[str, Any] = {}
         self._includes: dict[str, str] = {}
-
-        pass
+        self._inputs: str | None = None
+        self.platforms: list[str] = ["linux/amd64"]
+        self.layer_cache: cache.LocalCache | None = None
+        self.context_limit: int = _context_limit()
+        self.minimal: bool = False
+        self._files: list[tuple[str, Path]] | None = None
+        self._context_dir: Path | None = None
 
     def __enter__(self):
         return self
@@ -49,44 +68,306 @@ class Builder:
         project directory."""
         self._includes[name] = path
 
+    def local_cache(self, directory: str | None = None, branch: str | None = None,
+                    fallback: str = "main", max_size: str | int | None = None) -> cache.LocalCache:
+        """Export the layer cache to a local directory and import it on the
+        next build, so fresh CI runners that restore the directory start warm.
+        Defaults to WRIGHT_DOCKER_CACHE, or $XDG_CACHE_HOME/wright/buildkit.
+        See LocalCache."""
+        self.layer_cache = cache.LocalCache(directory, branch, fallback, max_size)
+        return self.layer_cache
+
+    def minimal_context(self, enabled: bool = True):
+        """Send BuildKit only the files the Dockerfile COPYs or ADDs, rather
+        than the whole working directory.  The image is also only rebuilt
+        when those files change.  Falls back to the whole context when the
+        Dockerfile's sources can't be worked out, e.g. `COPY . .`."""
+        self.minimal = enabled
+
+    def context_files(self) -> list[tuple[str, Path]]:
+        """The files sent as the build context, by their relative paths."""
+        if self._files is None:
+            working_dir = self.project.working_dir
+            dockerfile = working_dir / self.dockerfile
+            files = list(context.context_files(working_dir, context.DockerIgnore.load(working_dir, dockerfile)))
+
+            if self.minimal:
+                sources = context.copy_sources(dockerfile)
+                if sources is None:
+                    logging.info(f"Can't tell what {self.dockerfile} copies; sending the whole build context")
+                else:
+                    files = context.select(files, sources)
+                    self._context_dir = state_dir() / "contexts" / re.sub(r"[^A-Za-z0-9._-]+", "-", (
+                        f"{self.container_name}-{self.version}"))
+
+            self._files = files
+
+        return self._files
+
+    def report_context(self) -> context.Report:
+        """Print the size of the build context and what takes up the most
+        room, with a warning if it's over the context limit or holds Wright's
+        own state."""
+        report = context.Report(self.context_files())
+        print(f"[WRIGHT]: {self.container_name} build context: {report}")
+
+        for name in self._wright_dirs():
+            if any(relative.startswith(name) for relative, _ in self.context_files()):
+                logging.warning(f"The build context for {self.container_name} includes Wright's {name}, which "
+                                f"COPY . would put in the image; add {name} to .dockerignore")
+
+        if report.size > self.context_limit:
+            logging.warning(f"The build context for {self.container_name} is over "
+                            f"{context.format_size(self.context_limit)}; leave out what the image doesn't need "
+                            f"with .dockerignore, or use minimal_context()")
+
+        return report
+
     def should_build(self) -> bool:
-        """Does a Docker image exist for this container and version already?"""
+        """Has anything the image is built from changed?  Compares the digest
+        of the inputs with the one labelled on the existing image, so an
+        image without the label, or missing entirely, is built."""
+        self._inputs = self.inputs_digest()
         if self.project.force:
             return True
 
-        return not exists(self.container_name, self.version)
+        existing = labels(self.container_name, self.version)
+        return existing is None or existing.get(INPUTS_LABEL) != self._inputs
+
+    def inputs_digest(self) -> str:
+        """A digest of everything that goes into the image:  the files in the
+        build context, less those in .dockerignore, the Dockerfile, the build
+        args, the labels and the extra build contexts."""
+        working_dir = self.project.working_dir
+        dockerfile = working_dir / self.dockerfile
+
+        h = hashlib.blake2b(digest_size=20)
+        h.update(context.digest(working_dir, dockerfile, self.context_files()).encode("ascii"))
+
+        try:
+            h.update(dockerfile.read_bytes())
+        except OSError:
+            h.update(b"missing")
+
+        includes = {}
+        for name, path in self._includes.items():
+            # Extra contexts may also be images or URLs, identified by name
+            include = Path(path) if Path(path).is_absolute() else working_dir / path
+            includes[name] = context.digest(include) if include.is_dir() else path
+
+        h.update(json.dumps([
+            self.platforms,
+            self._build_args_list(),
+            {key: str(value) for key, value in self._labels.items()},
+            includes,
+        ], sort_keys=True).encode("utf-8"))
+
+        return h.hexdigest()
 
     def build(self):
         """Builds the Docker image using the docker binary and buildx."""
         if self.should_build():
-            args = [
-                "buildx",
-                "build",
-                "--platform", "linux/amd64",
-                "--tag", f"{self.container_name}:{self.version}",
-                "--file", self.dockerfile
-            ]
+            self._prepare_context()
+            process.run("docker", *self._buildx_args(), cwd=self.project.working_dir)
+            self._commit_cache()
+
+    async def build_async(self):
+        """Like build, but awaitable, so the image can build alongside other
+        steps, e.g. `await asyncio.gather(image.build_async(), ...)`."""
+        import asyncio
 
-            for arg, value in self._build_args.items():
-                args.append("--build-arg")
-                args.append(f"{arg}={value}")
+        if await asyncio.to_thread(self.should_build):
+            await asyncio.to_thread(self._prepare_context)
+            await process.run_async("docker", *self._buildx_args(), cwd=self.project.working_dir)
+            await asyncio.to_thread(self._commit_cache)
 
-            for key, value in self._labels.items():
-                args.append("--label")
-                args.append(f"{key}={value}")
+    def _buildx_args(self) -> list[str]:
+        args = [
+            "buildx",
+            "build",
+            "--platform", ",".join(self.platforms),
+            "--tag", f"{self.container_name}:{self.version}",
+            "--file", self._dockerfile_arg(),
+        ]
 
-            for name, path in self._includes.items():
-                args.append("--build-context")
-                args.append(f'{name}={path}')
+        for arg in self._build_args_list():
+            args.append("--build-arg")
+            args.append(arg)
 
-            if not self.cache:
-                args.append("--no-cache")
+        for key, value in self._labels.items():
+            args.append("--label")
+            args.append(f"{key}={value}")
 
-            args.append(".")
+        if self._inputs:
+            args.append("--label")
+            args.append(f"{INPUTS_LABEL}={self._inputs}")
 
-            process = sh.docker(*args, _iter="out", _err_to_out=True, _cwd=self.project.working_dir)
-            for line in process:
-                print(f"[DOCKER]: {line.strip()}")
+        for name, path in self._includes.items():
+            args.append("--build-context")
+            args.append(f'{name}={path}')
+
+        if self.layer_cache:
+            for source in self.layer_cache.sources(self.container_name) if self.cache else []:
+                args.append("--cache-from")
+                args.append(source)
+            args.append("--cache-to")
+            args.append(self.layer_cache.destination(self.container_name))
+            # The docker-container driver the local cache needs leaves the
+            # image in the build cache unless told to load it
+            args.append("--load")
+
+        if not self.cache:
+            args.append("--no-cache")
+
+        args.append(str(self._context_dir) if self._context_dir else ".")
+        return args
+
+    def _prepare_context(self):
+        """Report on the context, and build the minimal one if asked for."""
+        self.report_context()
+        if self._context_dir:
+            context.prepare(self.context_files(), self._context_dir)
+
+    def _wright_dirs(self) -> list[str]:
+        """The state and layer cache directories inside the working
+        directory, relative to it, with a trailing slash."""
+        directories = [state_dir()] + ([self.layer_cache.directory] if self.layer_cache else [])
+        relative = []
+        for directory in directories:
+            try:
+                relative.append(directory.relative_to(self.project.working_dir.absolute()).as_posix() + "/")
+            except ValueError:
+                continue
+
+        return relative
+
+    def _dockerfile_arg(self) -> str:
+        # A minimal context lives elsewhere, so point back at the Dockerfile
+        if self._context_dir:
+            return str(self.project.working_dir / self.dockerfile)
+        return self.dockerfile
+
+    def _commit_cache(self):
+        if self.layer_cache:
+            self.layer_cache.commit(self.container_name)
+
+    def _build_args_list(self) -> list[str]:
+        return [f"{arg}={value}" for arg, value in self._build_args.items()]
+
+    def _include_path(self, path: str) -> str:
+        """Make a local extra context absolute, since bake doesn't run from the
+        working directory.  Images and URLs are left alone."""
+        if "://" in path or Path(path).is_absolute():
+            return path
+
+        return str((self.project.working_dir / path).resolve())
+
+    def _bake_target(self) -> dict:
+        """The image as a target in a buildx bake file."""
+        labels = {key: str(value) for key, value in self._labels.items()}
+        if self._inputs:
+            labels[INPUTS_LABEL] = self._inputs
+
+        target = {
+            "context": str(self._context_dir or self.project.working_dir),
+            "dockerfile": self._dockerfile_arg(),
+            "tags": [f"{self.container_name}:{self.version}"],
+            "platforms": self.platforms,
+            "args": {arg: str(value) for arg, value in self._build_args.items()},
+            "labels": labels,
+            "contexts": {name: self._include_path(path) for name, path in self._includes.items()},
+        }
+
+        if self.layer_cache:
+            if self.cache:
+                target["cache-from"] = self.layer_cache.sources(self.container_name)
+            target["cache-to"] = [self.layer_cache.destination(self.container_name)]
+            target["output"] = ["type=docker"]
+
+        if not self.cache:
+            target["no-cache"] = True
+
+        return target
+
+
+class Group:
+    """
+    Builds several images with a single `docker buildx bake`, so BuildKit
+    schedules them together and builds the stages they share once.  Only the
+    images whose inputs have changed are built.
+
+        with docker.group() as images:
+            api = images.add(docker.build(ctx, "ghcr.io/my-org/api"))
+            api.build_arg("SERVICE", "api")
+            images.add(docker.build(ctx, "ghcr.io/my-org/worker"))
+    """
+
+    def __init__(self):
+        self.builders: list[Builder] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type:
+            print(f"There was a problem constructing the Docker builds: {exc_val}")
+            return False
+
+        try:
+            self.build()
+        except Exception as e:
+            print(f"Unable to build the Docker images: {e}")
+            return False
+
+        return True
+
+    def add(self, builder: Builder) -> Builder:
+        """Build the image with the rest of the group."""
+        self.builders.append(builder)
+        return builder
+
+    def build(self):
+        """Bake the images that need building."""
+        stale = [builder for builder in self.builders if builder.should_build()]
+        if stale:
+            for builder in stale:
+                builder._prepare_context()
+            process.run("docker", *self._bake_args(stale))
+            for builder in stale:
+                builder._commit_cache()
+
+    async def build_async(self):
+        """Like build, but awaitable."""
+        import asyncio
+
+        stale = [builder for builder, changed in zip(self.builders, await asyncio.gather(
+            *(asyncio.to_thread(builder.should_build) for builder in self.builders))) if changed]
+        if stale:
+            for builder in stale:
+                await asyncio.to_thread(builder._prepare_context)
+            await process.run_async("docker", *self._bake_args(stale))
+            for builder in stale:
+                await asyncio.to_thread(builder._commit_cache)
+
+    def bake_file(self, builders: list[Builder] | None = None) -> dict:
+        """The bake file, as JSON, for the builders, all of them by default."""
+        targets = {}
+        for builder in builders if builders is not None else self.builders:
+            name = re.sub(r"[^A-Za-z0-9_-]", "-", f"{builder.container_name}-{builder.version}")
+            while name in targets:
+                name += "_"
+            targets[name] = builder._bake_target()
+
+        return {"group": {"default": {"targets": list(targets)}}, "target": targets}
+
+    def _bake_args(self, builders: list[Builder]) -> list[str]:
+        """Write the bake file under .wright, named for its contents."""
+        content = json.dumps(self.bake_file(builders), indent=2, sort_keys=True)
+        path = state_dir() / "bake" / f"{hashlib.blake2b(content.encode('utf-8'), digest_size=10).hexdigest()}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+
+        return ["buildx", "bake", "--file", str(path), "default"]
 
 
 def build(project: Proojekt, container_name: str, version: str = "latest") -> Builder:
@@ -106,17 +387,59 @@ def build(project: Proojekt, container_name: str, version: str = "latest") -> Bu
     return Builder(project, container_name, version)
 
 
-def exists(container_name: str, version: str = "latest") -> bool:
+def _context_limit() -> int:
+    limit = os.getenv("WRIGHT_DOCKER_CONTEXT_LIMIT")
+    if not limit:
+        return DEFAULT_CONTEXT_LIMIT
+
+    try:
+        return parse_size(limit)
+    except ValueError:
+        logging.warning(f"Invalid WRIGHT_DOCKER_CONTEXT_LIMIT {limit}, using the default")
+        return DEFAULT_CONTEXT_LIMIT
+
+
+def group() -> Group:
+    """Collect several image builds to bake together.  Meant to be wrapped in
+    a "with" statement, like build."""
+    return Group()
+
+
+def labels(container_name: str, version: str = "latest") -> dict[str, str] | None:
+    """The labels on the image, or None if it doesn't exist."""
+    client = engine.client()
+    if client:
+        try:
+            return client.image_labels(f"{container_name}:{version}")
+        except engine.EngineError as err:
+            logging.debug(f"Falling back to the docker command: {err}")
+
+    result = process.run("docker", "image", "inspect", "--format", "{{json .Config.Labels}}",
+                         f"{container_name}:{version}", capture=True, check=False)
+    if not result.ok:
+        return None
+
+    try:
+        return json.loads(result.stdout) or {}
+    except ValueError:
+        return {}
+
+
+def exists(container_name: str, version: str = "latest", snapshot: engine.Snapshot | None = None) -> bool:
     """
     Does the image exist already?  Typically used to test if we need to rebuild
-    the image.
+    the image.  Asks the Docker Engine directly when it can, or checks the
+    snapshot if given, e.g. from docker.snapshot(), when checking many images.
     """
-    try:
-        output = sh.docker("inspect", f"{container_name}:{version}")
-        if output.strip() != "[]":
-            return True
-    except sh.ErrorReturnCode as e:
-        if e.stdout.decode().strip() == "[]":
-            return False
+    if snapshot is not None:
+        return snapshot.has_image(container_name, version)
+
+    client = engine.client()
+    if client:
+        try:
+            return client.image_exists(f"{container_name}:{version}")
+        except engine.EngineError as err:
+            logging.debug(f"Falling back to the docker command: {err}")
 
-    return False
+    result = process.run("docker", "inspect", f"{container_name}:{version}", capture=True, check=False)
+    return result.ok and result.stdout.strip() != "[]"
@@ -0,0 +1,148 @@
+import logging
+import os
+import re
+import shutil
+from pathlib import Path
+
+from wright.proojekt import process
+from wright.proojekt.support import parse_size
+
+# How much space the layer caches may take before the least recently used go
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+
+# Environment variables CI services set to the branch being built, in order
+_BRANCH_ENV = ("WRIGHT_BRANCH", "GITHUB_HEAD_REF", "GITHUB_REF_NAME", "CI_COMMIT_REF_NAME", "BUILDKITE_BRANCH",
+               "BRANCH_NAME", "GIT_BRANCH")
+
+
+class LocalCache:
+    """
+    Keeps BuildKit's layer cache in a local directory, with --cache-to and
+    --cache-from, so it can be saved and restored between CI runs, e.g. with
+    actions/cache.  It defaults to WRIGHT_DOCKER_CACHE, or wright/buildkit in
+    the user's cache directory, outside the project so it never ends up in a
+    build context.  Each image's cache is scoped by branch, at
+    <directory>/<image>/<branch>.  A branch without a cache of its own starts
+    from the fallback branch's.
+
+    The local cache exporter needs a BuildKit builder, such as one created with
+    `docker buildx create --driver docker-container --use`, rather than the
+    default docker driver.  Images built with the cache are loaded into the
+    local image store, with --load, since that builder otherwise keeps them
+    to itself.
+    """
+
+    def __init__(self, directory: Path | str | None = None, branch: str | None = None,
+                 fallback: str = "main", max_size: str | int | None = None):
+        self.directory = Path(directory or os.getenv("WRIGHT_DOCKER_CACHE") or default_directory()).absolute()
+        self.branch = _scope(branch or current_branch() or fallback)
+        self.fallback = _scope(fallback)
+
+        size = max_size or os.getenv("WRIGHT_DOCKER_CACHE_SIZE")
+        try:
+            self.max_bytes = parse_size(size) if size else DEFAULT_MAX_SIZE
+        except ValueError:
+            logging.warning(f"Invalid Docker cache size {size}, using the default")
+            self.max_bytes = DEFAULT_MAX_SIZE
+
+    def scope(self, image: str, branch: str | None = None) -> Path:
+        """The directory holding the image's cache for the branch."""
+        return self.directory / _scope(image) / (branch or self.branch)
+
+    def sources(self, image: str) -> list[str]:
+        """The --cache-from values:  the branch's cache, then the fallback's."""
+        sources = []
+        for branch in dict.fromkeys([self.branch, self.fallback]):
+            if (self.scope(image, branch) / "index.json").exists():
+                sources.append(f"type=local,src={self.scope(image, branch)}")
+
+        return sources
+
+    def destination(self, image: str) -> str:
+        """The --cache-to value.  The cache is exported next to the branch's
+        current one and swapped in by commit, because the local exporter
+        never removes the layers it no longer needs."""
+        return f"type=local,dest={self._staging(image)},mode=max"
+
+    def commit(self, image: str):
+        """Replace the branch's cache with the one just exported, then prune
+        the caches down to size."""
+        staging = self._staging(image)
+        if not (staging / "index.json").exists():
+            return
+
+        current = self.scope(image)
+        retired = current.with_name(current.name + ".old")
+
+        shutil.rmtree(retired, ignore_errors=True)
+        if current.exists():
+            os.replace(current, retired)
+        os.replace(staging, current)
+        shutil.rmtree(retired, ignore_errors=True)
+
+        self.prune()
+
+    def prune(self):
+        """Remove the least recently written caches until they fit in the
+        maximum size.  Fallback branch caches go last, since every other
+        branch starts from them."""
+        scopes = []
+        total = 0
+
+        for image in _subdirectories(self.directory):
+            for branch in _subdirectories(image):
+                size = _size(branch)
+                total += size
+                scopes.append((branch.name == self.fallback, branch.stat().st_mtime_ns, size, branch))
+
+        for _, _, size, branch in sorted(scopes):
+            if total <= self.max_bytes:
+                break
+
+            logging.info(f"Pruning the Docker layer cache in {branch}")
+            shutil.rmtree(branch, ignore_errors=True)
+            total -= size
+
+    def _staging(self, image: str) -> Path:
+        return self.scope(image).with_name(self.branch + ".new")
+
+
+def default_directory() -> Path:
+    """$XDG_CACHE_HOME/wright/buildkit, or ~/.cache/wright/buildkit."""
+    return Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "wright" / "buildkit"
+
+
+def current_branch() -> str | None:
+    """The branch being built, from the CI environment or git."""
+    for name in _BRANCH_ENV:
+        value = os.getenv(name)
+        if value:
+            return value.removeprefix("refs/heads/").removeprefix("origin/")
+
+    result = process.run("git", "rev-parse", "--abbrev-ref", "HEAD", capture=True, check=False)
+    branch = result.stdout.strip()
+    return branch if result.ok and branch != "HEAD" else None
+
+
+def _scope(name: str) -> str:
+    """Make a name safe to use as a directory name."""
+    return re.sub(r"[^A-Za-z0-9._-]+", "-", name).strip(".-") or "default"
+
+
+def _subdirectories(path: Path) -> list[Path]:
+    try:
+        return [entry for entry in path.iterdir() if entry.is_dir()]
+    except OSError:
+        return []
+
+
+def _size(path: Path) -> int:
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                pass
+
+    return total
@@ -1,4 +1,18 @@
-import sh
+import json
+import logging
+import os
+import re
+from pathlib import Path
+
+from wright.proojekt import process
+
+from . import engine
+
+# The files docker compose looks for, in order, when not told which to use
+_DEFAULT_FILES = ("compose.yaml", "compose.yml", "docker-compose.yaml", "docker-compose.yml")
+
+# Project names docker compose reported, by what it worked them out from
+_project_names: dict[tuple, str] = {}
 
 
 def up(composefile: str | None = None, detach: bool = True) -> bool:
@@ -17,7 +31,7 @@ def up(composefile: str | None = None, detach: bool = True) -> bool:
     if detach:
         args.append("-d")
 
-    sh.docker(*args)
+    process.run("docker", *args, interactive=not detach)
     return True
 
 
@@ -34,7 +48,7 @@ def down(composefile: str | None = None) -> bool:
 
     args.append("down")
 
-    sh.docker(*args)
+    process.run("docker", *args)
     return True
 
 
@@ -52,11 +66,25 @@ def logs(composefile: str | None = None, follow: bool = False):
         args.append("-f")
 
     print("Running logs {}".format(args))
-    sh.docker(*args, _out=True)
+    process.run("docker", *args, interactive=follow)
 
 
-def running(composefile: str | None = None) -> bool:
-    """Check if the Docker Compose instance is running."""
+def running(composefile: str | None = None, snapshot: engine.Snapshot | None = None) -> bool:
+    """Check if the Docker Compose instance is running.  Asks the Docker
+    Engine for the project's containers when it can, or checks the snapshot
+    if given, e.g. from docker.snapshot()."""
+    if snapshot is not None:
+        return any(container.get("State") == "running" and _in_project(container, composefile)
+                   for container in snapshot.containers)
+
+    client = engine.client()
+    if client:
+        label = f"com.docker.compose.project={_project_name(composefile)}"
+        try:
+            return len(client.containers({"label": [label]})) > 0
+        except engine.EngineError as err:
+            logging.debug(f"Falling back to the docker command: {err}")
+
     args = ["compose"]
 
     if composefile:
@@ -65,5 +93,164 @@ def running(composefile: str | None = None) -> bool:
 
     args.append("ps")
 
-    output = sh.docker(*args)
+    output = process.run("docker", *args, capture=True).stdout
     return len(output.split("\n")) > 2
+
+
+def wait_healthy(composefile: str | None = None, services: list[str] | None = None, timeout: float = 120):
+    """
+    Wait until the compose project's containers, or just the services', are
+    running and passing their health checks, so tests can start as soon as
+    the services are usable rather than after a fixed sleep:
+
+        compose.up()
+        compose.wait_healthy(timeout=60)
+
+    Raises an UnhealthyError if a container fails or stops, or when the
+    timeout, in seconds, runs out.
+    """
+    container_ids = _containers(composefile, services)
+    if not container_ids:
+        name = _project_name(composefile, ask=False) or composefile or "default"
+        raise engine.UnhealthyError(f"No containers found for the {name} compose project")
+
+    engine.wait_healthy(container_ids, timeout)
+
+
+def _containers(composefile: str | None, services: list[str] | None) -> list[str]:
+    """The IDs of the project's containers, stopped ones included."""
+    client = engine.client()
+    if client:
+        try:
+            containers = client.containers({"label": [f"com.docker.compose.project={_project_name(composefile)}"]},
+                                           all=True)
+            return [container["Id"] for container in containers if not services
+                    or (container.get("Labels") or {}).get("com.docker.compose.service") in services]
+        except engine.EngineError as err:
+            logging.debug(f"Falling back to the docker command: {err}")
+
+    args = ["compose"]
+
+    if composefile:
+        args.append("-f")
+        args.append(composefile)
+
+    args.extend(["ps", "--all", "-q", *(services or [])])
+    return process.run("docker", *args, capture=True).stdout.split()
+
+
+def _project_name(composefile: str | None, ask: bool = True) -> str | None:
+    """
+    The project name docker compose labels the containers with.  Uses
+    COMPOSE_PROJECT_NAME, from the environment or .env, or a plain name at
+    the top of the compose file when there is one.  Otherwise asks compose,
+    which also goes by the directory it finds the file in, and remembers the
+    answer until the compose files change.  Without ask, returns None rather
+    than start a process.
+    """
+    files = _compose_files(composefile)
+    project_dir = Path(files[0]).parent if files else Path.cwd()
+
+    name = os.getenv("COMPOSE_PROJECT_NAME") or _dotenv(project_dir / ".env", "COMPOSE_PROJECT_NAME")
+    if name:
+        return name
+
+    # Later files override the name in earlier ones
+    for file in reversed(files):
+        name = _top_level_name(file)
+        if name:
+            return name
+
+    key = (os.getcwd(), composefile, os.getenv("COMPOSE_FILE"),
+           tuple((file, _mtime(file)) for file in [*files, str(project_dir / ".env")]))
+    if key in _project_names or not ask:
+        return _project_names.get(key)
+
+    args = ["compose"]
+
+    if composefile:
+        args.append("-f")
+        args.append(composefile)
+
+    args.extend(["config", "--format", "json"])
+
+    output = process.run("docker", *args, capture=True).stdout
+    try:
+        name = json.loads(output)["name"]
+    except (ValueError, KeyError, TypeError):
+        raise process.ProcessError(process.Result(["docker", *args], 1, 0.0, output,
+                                                  ["docker compose config didn't report a project name"]))
+
+    _project_names[key] = name
+    return name
+
+
+def _in_project(container: dict, composefile: str | None) -> bool:
+    """Does the container belong to the compose project?  Goes by the project
+    name when it's known without asking compose, or else by the compose file
+    compose labelled the container with."""
+    labels = container.get("Labels") or {}
+
+    name = _project_name(composefile, ask=False)
+    if name is not None:
+        return labels.get("com.docker.compose.project") == name
+
+    files = _compose_files(composefile)
+    started = (labels.get("com.docker.compose.project.config_files") or "").split(",")
+    return bool(files) and started[0] == files[0]
+
+
+def _compose_files(composefile: str | None) -> list[str]:
+    """The compose files docker compose would use, as absolute paths:  the
+    one given, those in COMPOSE_FILE, or the first of the default names found
+    in the current directory or its parents."""
+    if composefile:
+        return [os.path.abspath(composefile)]
+
+    listed = os.getenv("COMPOSE_FILE")
+    if listed:
+        separator = os.getenv("COMPOSE_PATH_SEPARATOR", os.pathsep)
+        return [os.path.abspath(file) for file in listed.split(separator) if file]
+
+    directory = Path.cwd()
+    for directory in (directory, *directory.parents):
+        for name in _DEFAULT_FILES:
+            if (directory / name).is_file():
+                return [str(directory / name)]
+
+    return []
+
+
+def _top_level_name(path: str) -> str | None:
+    """The name at the top of the compose file, unless it's interpolated."""
+    try:
+        text = Path(path).read_text(encoding="utf-8")
+    except OSError:
+        return None
+
+    match = re.search(r"^name:[ \t]*[\"']?([^\"'\s#]+)[\"']?[ \t]*(?:#.*)?$", text, re.MULTILINE)
+    if match and "$" not in match.group(1):
+        return match.group(1)
+
+    return None
+
+
+def _dotenv(path: Path, variable: str) -> str | None:
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return None
+
+    for line in lines:
+        key, sep, value = line.strip().removeprefix("export ").partition("=")
+        if sep and key.strip() == variable:
+            return value.strip().strip("\"'") or None
+
+    return None
+
+
+def _mtime(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
@@ -0,0 +1,288 @@
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shlex
+import shutil
+from pathlib import Path
+from typing import Iterator
+
+from wright.proojekt import fingerprint
+from wright.proojekt.walker import DEFAULT_EXCLUDES, translate
+
+
+class DockerIgnore:
+    """
+    The patterns in a build context's .dockerignore.  Unlike .gitignore,
+    every pattern is relative to the root of the context, a pattern matching
+    a directory excludes everything in it, and the last matching pattern
+    wins, so "!" patterns can bring files back.
+    """
+
+    def __init__(self, patterns: list[str]):
+        self.rules: list[tuple[bool, re.Pattern]] = []
+
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+
+            negate = pattern.startswith("!")
+            if negate:
+                pattern = pattern[1:].strip()
+
+            pattern = posixpath.normpath(pattern.replace(os.sep, "/")).lstrip("/")
+            if pattern in ("", "."):
+                continue
+
+            self.rules.append((negate, re.compile(translate(pattern))))
+
+        self.negations = any(negate for negate, _ in self.rules)
+
+    @classmethod
+    def load(cls, context: Path, dockerfile: Path | None = None) -> DockerIgnore:
+        """Read the ignore file BuildKit would use:  <Dockerfile>.dockerignore
+        next to the Dockerfile if there is one, otherwise the .dockerignore at
+        the root of the context."""
+        candidates = [context / ".dockerignore"]
+        if dockerfile is not None:
+            candidates.insert(0, dockerfile.parent / f"{dockerfile.name}.dockerignore")
+
+        for candidate in candidates:
+            try:
+                return cls(candidate.read_text(encoding="utf-8").splitlines())
+            except OSError:
+                continue
+
+        return cls([])
+
+    def ignored(self, path: str) -> bool:
+        """Is the slash-separated path, relative to the context, left out?"""
+        parents = [path]
+        while "/" in parents[-1]:
+            parents.append(parents[-1].rsplit("/", 1)[0])
+
+        result = False
+        for negate, regex in self.rules:
+            if any(regex.fullmatch(parent) for parent in parents):
+                result = not negate
+
+        return result
+
+
+def context_files(context: Path, ignore: DockerIgnore | None = None) -> Iterator[tuple[str, Path]]:
+    """Yield the relative path and full path of every file Docker would send
+    as the build context, leaving out what the .dockerignore excludes."""
+    ignore = ignore if ignore is not None else DockerIgnore.load(context)
+    stack = [("", context)]
+
+    while stack:
+        prefix, directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name, reverse=True)
+        except OSError:
+            continue
+
+        for entry in entries:
+            relative = f"{prefix}{entry.name}"
+            ignored = ignore.ignored(relative)
+
+            if entry.is_dir(follow_symlinks=False):
+                # A "!" pattern may bring back files inside an ignored directory
+                if not ignored or ignore.negations:
+                    stack.append((relative + "/", Path(entry.path)))
+            elif not ignored:
+                yield relative, Path(entry.path)
+
+
+class Report:
+    """The size of a build context, and what takes up the most room."""
+
+    def __init__(self, files: list[tuple[str, Path]], top: int = 5):
+        self.count = 0
+        self.size = 0
+        contributors: dict[str, int] = {}
+
+        for relative, path in files:
+            try:
+                size = path.lstat().st_size
+            except OSError:
+                continue
+
+            self.count += 1
+            self.size += size
+            name = relative.split("/", 1)[0] + ("/" if "/" in relative else "")
+            contributors[name] = contributors.get(name, 0) + size
+
+        self.largest = sorted(contributors.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    def __str__(self) -> str:
+        largest = ", ".join(f"{name} {format_size(size)}" for name, size in self.largest)
+        return f"{format_size(self.size)} in {self.count} files" + (f"; largest: {largest}" if largest else "")
+
+
+def digest(context: Path, dockerfile: Path | None = None, files: list[tuple[str, Path]] | None = None) -> str:
+    """A digest of the names and contents of the files in the build context,
+    or of the given files from it.  Wright's own state and .git are left out,
+    as they change with every run and commit whether or not the image would."""
+    if files is None:
+        files = list(context_files(context, DockerIgnore.load(context, dockerfile)))
+
+    files = [(relative, path) for relative, path in files if relative.split("/", 1)[0] not in DEFAULT_EXCLUDES]
+    hashed = fingerprint.hash_files([path for _, path in files])
+
+    h = hashlib.blake2b(digest_size=20)
+    for relative, path in sorted(files):
+        h.update(relative.encode("utf-8"))
+        h.update(b"\0")
+        if path.is_symlink():
+            h.update(b"-> " + os.fsencode(os.readlink(path)))
+        else:
+            h.update(hashed.get(str(path), "missing").encode("ascii"))
+        h.update(b"\n")
+
+    return h.hexdigest()
+
+
+def copy_sources(dockerfile: Path) -> list[str] | None:
+    """
+    The paths and patterns the Dockerfile's COPY and ADD instructions take
+    from the build context.  COPY --from takes from another stage or image,
+    and ADD from a URL, so those are skipped.  Returns None when the sources
+    can't be worked out for certain, e.g. when they use variables or copy the
+    whole context, or a RUN bind mounts from the context.
+    """
+    try:
+        text = dockerfile.read_text(encoding="utf-8")
+    except OSError:
+        return None
+
+    sources: list[str] = []
+    for instruction in _instructions(text):
+        parts = instruction.split(None, 1)
+        if len(parts) == 2 and parts[0].upper() == "RUN" and _binds_context(parts[1]):
+            return None
+        if len(parts) < 2 or parts[0].upper() not in ("COPY", "ADD"):
+            continue
+
+        rest = parts[1].strip()
+        if "<<" in rest:
+            # Heredocs inline their content rather than copying from the context
+            continue
+
+        args = []
+        while rest.startswith("--"):
+            flag, _, rest = rest.partition(" ")
+            args.append(flag)
+            rest = rest.lstrip()
+
+        if any(flag.startswith("--from") for flag in args):
+            continue
+
+        if rest.startswith("["):
+            try:
+                paths = json.loads(rest)
+            except ValueError:
+                return None
+        else:
+            paths = shlex.split(rest)
+
+        for source in paths[:-1]:
+            if "://" in source or source.startswith("git@"):
+                continue
+            if "$" in source:
+                return None
+
+            source = posixpath.normpath(source).lstrip("/")
+            if source in ("", "."):
+                return None
+            sources.append(source)
+
+    return sources
+
+
+def select(files: list[tuple[str, Path]], sources: list[str]) -> list[tuple[str, Path]]:
+    """The files the sources match, either directly or as the contents of a
+    matching directory."""
+    patterns = [re.compile(translate(source)) for source in sources]
+
+    selected = []
+    for relative, path in files:
+        parents = [relative]
+        while "/" in parents[-1]:
+            parents.append(parents[-1].rsplit("/", 1)[0])
+
+        if any(pattern.fullmatch(parent) for pattern in patterns for parent in parents):
+            selected.append((relative, path))
+
+    return selected
+
+
+def prepare(files: list[tuple[str, Path]], destination: Path) -> Path:
+    """Build a context holding only the files, linked rather than copied
+    where possible, replacing whatever was there before."""
+    shutil.rmtree(destination, ignore_errors=True)
+
+    for relative, path in files:
+        target = destination / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        if path.is_symlink():
+            os.symlink(os.readlink(path), target)
+            continue
+
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+
+    destination.mkdir(parents=True, exist_ok=True)
+    return destination
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+    return f"{size:.1f}TB"
+
+
+def _binds_context(run: str) -> bool:
+    """Does the RUN instruction bind mount files from the build context, e.g.
+    --mount=type=bind,target=. or --mount=source=go.sum,target=go.sum?"""
+    for token in run.split():
+        if not token.startswith("--"):
+            break
+        if not token.startswith("--mount="):
+            continue
+
+        options = dict(option.partition("=")[::2] for option in token[len("--mount="):].strip("'\"").split(","))
+        if options.get("type", "bind") == "bind" and "from" not in options:
+            return True
+
+    return False
+
+
+def _instructions(text: str) -> Iterator[str]:
+    """The Dockerfile's instructions, with continuation lines joined and
+    comments dropped."""
+    current = ""
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not current and (not stripped or stripped.startswith("#")):
+            continue
+        if current and stripped.startswith("#"):
+            continue
+
+        if stripped.endswith("\\"):
+            current += stripped[:-1] + " "
+            continue
+
+        yield current + stripped
+        current = ""
+
+    if current:
+        yield current
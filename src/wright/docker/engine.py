@@ -0,0 +1,509 @@
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import urllib.parse
+from typing import Any, Iterator
+
+from wright.proojekt import process
+from wright.proojekt.support import is_env
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+_client: Engine | None = None
+_client_lock = threading.Lock()
+# The settings the client was looked up with, so the daemon notices when a
+# request comes in with a different DOCKER_HOST
+_checked: tuple[str | None, str | None] | None = None
+
+
+class EngineError(Exception):
+    """Raised when the Docker Engine can't be reached or reports an error."""
+
+    def __init__(self, message: str, status: int = 0):
+        self.status = status
+        super().__init__(message)
+
+
+class UnhealthyError(Exception):
+    """Raised when containers don't become healthy in time, or stop while
+    starting."""
+    pass
+
+
+class Engine:
+    """
+    Talks to the Docker Engine API over its Unix socket, rather than running
+    the docker command for every question.  Each thread keeps its connection
+    open between requests.
+    """
+
+    def __init__(self, path: str = DEFAULT_SOCKET, timeout: float = 30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, query: dict | None = None,
+                body: Any = None) -> tuple[int, bytes]:
+        """Send a request, returning the status and body.  Reconnects once if
+        the engine closed an idle connection."""
+        import http.client
+
+        if query:
+            path += "?" + urllib.parse.urlencode(query)
+
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                response = conn.getresponse()
+                return response.status, response.read()
+            except (OSError, http.client.HTTPException) as err:
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise EngineError(f"Docker Engine unavailable at {self.path}: {err}")
+
+        raise EngineError(f"Docker Engine unavailable at {self.path}")
+
+    def get(self, path: str, **query: Any) -> Any:
+        """GET the path and decode the JSON response."""
+        status, body = self.request("GET", path, query)
+        if status != 200:
+            raise EngineError(_message(body) or f"GET {path} returned {status}", status)
+
+        return json.loads(body)
+
+    def ping(self) -> bool:
+        try:
+            return self.request("GET", "/_ping")[0] == 200
+        except EngineError:
+            return False
+
+    def image_exists(self, reference: str) -> bool:
+        status, body = self.request("GET", f"/images/{urllib.parse.quote(reference, safe=':/@')}/json")
+        if status == 404:
+            return False
+        if status != 200:
+            raise EngineError(_message(body) or f"Inspecting {reference} returned {status}", status)
+
+        return True
+
+    def image_labels(self, reference: str) -> dict[str, str] | None:
+        """The labels on the image, or None if there's no such image."""
+        status, body = self.request("GET", f"/images/{urllib.parse.quote(reference, safe=':/@')}/json")
+        if status == 404:
+            return None
+        if status != 200:
+            raise EngineError(_message(body) or f"Inspecting {reference} returned {status}", status)
+
+        return (json.loads(body).get("Config") or {}).get("Labels") or {}
+
+    def images(self) -> list[dict]:
+        return self.get("/images/json")
+
+    def containers(self, filters: dict[str, list[str]] | None = None, all: bool = False) -> list[dict]:
+        """List the containers, running ones only unless all is true.  Filters
+        work like `docker ps --filter`, e.g. {"label": ["app=web"]}."""
+        query: dict[str, str] = {}
+        if filters:
+            query["filters"] = json.dumps(filters)
+        if all:
+            query["all"] = "1"
+
+        return self.get("/containers/json", **query)
+
+    def inspect(self, container_id: str) -> dict | None:
+        """The container's details, or None if there's no such container."""
+        status, body = self.request("GET", f"/containers/{container_id}/json")
+        if status == 404:
+            return None
+        if status != 200:
+            raise EngineError(_message(body) or f"Inspecting {container_id} returned {status}", status)
+
+        return json.loads(body)
+
+    def events(self, filters: dict[str, list[str]], deadline: float, since: float | None = None) -> Events:
+        """Stream events as they happen, like `docker events`, until the
+        deadline, a time.monotonic() value.  Subscribes before returning, so
+        nothing that happens after the call is missed.  With since, a
+        time.time() value, the engine first replays the events since then.
+        Uses a connection of its own, since the stream ties it up."""
+        import http.client
+
+        query = {"filters": json.dumps(filters)}
+        if since is not None:
+            query["since"] = _timestamp(since)
+
+        conn = _unix_connection()(self.path, max(0.1, deadline - time.monotonic()))
+        try:
+            conn.request("GET", "/events?" + urllib.parse.urlencode(query))
+            response = conn.getresponse()
+        except (OSError, http.client.HTTPException) as err:
+            conn.close()
+            raise EngineError(f"Docker Engine unavailable at {self.path}: {err}")
+
+        if response.status != 200:
+            conn.close()
+            raise EngineError(_message(response.read()) or f"Events returned {response.status}", response.status)
+
+        return Events(self.path, conn, response, deadline)
+
+    def stop(self, container_id: str):
+        status, body = self.request("POST", f"/containers/{container_id}/stop")
+        # 304 means it had already stopped
+        if status not in (204, 304, 404):
+            raise EngineError(_message(body) or f"Stopping {container_id} returned {status}", status)
+
+    def snapshot(self) -> Snapshot:
+        """List every image and container once, to answer many questions."""
+        return Snapshot(self.images(), self.containers(all=True))
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _unix_connection()(self.path, self.timeout)
+            self._local.conn = conn
+
+        return conn
+
+
+class Events:
+    """A stream of engine events, read one at a time until the deadline.
+    Closes its connection when used in a "with" statement."""
+
+    def __init__(self, path: str, conn, response, deadline: float):
+        self.path = path
+        self.deadline = deadline
+        self._conn = conn
+        self._response = response
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def __iter__(self) -> Iterator[dict]:
+        import http.client
+
+        try:
+            while (remaining := self.deadline - time.monotonic()) > 0:
+                self._conn.sock.settimeout(remaining)
+                try:
+                    line = self._response.readline()
+                except TimeoutError:
+                    return
+                if not line:
+                    return
+                if line.strip():
+                    yield json.loads(line)
+        except (OSError, http.client.HTTPException) as err:
+            raise EngineError(f"Docker Engine unavailable at {self.path}: {err}")
+
+    def close(self):
+        self._conn.close()
+
+
+class Snapshot:
+    """
+    The images and containers at one moment, from the Engine API or the
+    docker command, so checks across dozens of images and containers don't
+    each ask Docker again:
+
+        snapshot = docker.snapshot()
+        stale = [name for name in names if not docker.exists(name, snapshot=snapshot)]
+    """
+
+    def __init__(self, images: list[dict], containers: list[dict]):
+        self.images = images
+        self.containers = containers
+
+        self._tags: dict[str, str] = {}
+        for image in images:
+            for tag in image.get("RepoTags") or []:
+                self._tags[tag] = image.get("Id", "")
+
+    def has_image(self, container_name: str, version: str = "latest") -> bool:
+        return f"{container_name}:{version}" in self._tags
+
+    def running(self, coupling: str | None = None, container_name: str | None = None,
+                version: str | None = None) -> list[str]:
+        """The IDs of the running containers with the coupling label, or
+        started from the image.  Matches what `docker ps --filter` would,
+        except that containers started from images built on top of the image
+        aren't included."""
+        found = []
+        for container in self.containers:
+            if container.get("State") != "running":
+                continue
+
+            if coupling:
+                if (container.get("Labels") or {}).get("com.wsp.conduit.coupling") == coupling:
+                    found.append(container["Id"])
+            elif container_name:
+                if self._started_from(container, container_name, version):
+                    found.append(container["Id"])
+            else:
+                found.append(container["Id"])
+
+        return found
+
+    def _started_from(self, container: dict, name: str, version: str | None) -> bool:
+        image = container.get("Image", "")
+        if version:
+            reference = f"{name}:{version}"
+            return image == reference or (reference in self._tags and container.get("ImageID") == self._tags[reference])
+
+        if image == name or image.startswith(f"{name}:"):
+            return True
+
+        ids = {image_id for tag, image_id in self._tags.items() if tag.rpartition(":")[0] == name}
+        return container.get("ImageID") in ids
+
+
+def client() -> Engine | None:
+    """The engine client for this process, or None if the Docker socket
+    isn't reachable and the docker command should be used instead.  Set
+    WRIGHT_DOCKER_API=false to always use the docker command."""
+    global _client, _checked
+
+    settings = (os.getenv("DOCKER_HOST"), os.getenv("WRIGHT_DOCKER_API"))
+
+    with _client_lock:
+        if _checked != settings:
+            _checked = settings
+            _client = None
+            path = _socket_path()
+            if path and os.path.exists(path) and not is_env("WRIGHT_DOCKER_API", "false"):
+                engine = Engine(path)
+                if engine.ping():
+                    _client = engine
+                else:
+                    logging.debug(f"Docker Engine not answering at {path}; using the docker command")
+
+        return _client
+
+
+def snapshot() -> Snapshot:
+    """List every image and container once.  Uses the Engine API when it can,
+    otherwise the docker command."""
+    engine = client()
+    if engine:
+        try:
+            return engine.snapshot()
+        except EngineError as err:
+            logging.debug(f"Falling back to the docker command: {err}")
+
+    images = []
+    for line in process.run("docker", "image", "ls", "--no-trunc", "--format", "{{json .}}",
+                            capture=True).stdout.splitlines():
+        image = json.loads(line)
+        tags = [] if image.get("Tag") == "<none>" else [f"{image['Repository']}:{image['Tag']}"]
+        images.append({"Id": image.get("ID", ""), "RepoTags": tags})
+
+    containers = []
+    for line in process.run("docker", "ps", "--no-trunc", "--format", "{{json .}}",
+                            capture=True).stdout.splitlines():
+        container = json.loads(line)
+        labels = dict(label.partition("=")[::2] for label in container.get("Labels", "").split(",") if label)
+        containers.append({"Id": container.get("ID", ""), "Image": container.get("Image", ""),
+                           "State": "running", "Labels": labels})
+
+    return Snapshot(images, containers)
+
+
+def wait_healthy(container_ids: list[str], timeout: float = 120, since: float | None = None):
+    """
+    Wait until every container is ready:  running and, if it has a health
+    check, reporting healthy.  Containers that exit successfully, like
+    one-off migrations, count as ready.  Follows the Docker events stream, so
+    it returns as soon as the last one is ready, rather than polling.  Raises
+    an UnhealthyError if a container fails its health check or stops, or when
+    the timeout, in seconds, runs out.
+
+    Pass since, the time.time() the containers were started, when they're
+    removed on exit (docker run --rm), so their exit status can still be
+    found from the events since then once they're gone.
+    """
+    deadline = time.monotonic() + timeout
+    pending = set(container_ids)
+
+    engine = client()
+    if engine:
+        try:
+            _wait_events(engine, pending, deadline, since)
+            return
+        except EngineError as err:
+            logging.debug(f"Falling back to the docker command: {err}")
+
+    _wait_polling(pending, deadline, since)
+
+
+def _wait_events(engine: Engine, pending: set[str], deadline: float, since: float | None):
+    # Subscribe before looking, so a change in between isn't missed
+    filters = {"type": ["container"], "container": sorted(pending),
+               "event": ["health_status", "die", "start", "oom", "destroy"]}
+    exits: dict[str, int] = {}
+
+    with engine.events(filters, deadline, since) as stream:
+        for container_id in list(pending):
+            container = engine.inspect(container_id)
+            # A container that's already gone exits in the replayed events
+            if container is None and since is not None:
+                continue
+            if _ready(container_id, container):
+                pending.discard(container_id)
+
+        for event in stream if pending else ():
+            actor = event.get("Actor") or {}
+            container_id = event.get("id") or actor.get("ID", "")
+            action = event.get("Action") or event.get("status", "")
+
+            for waiting in [waiting for waiting in pending if container_id.startswith(waiting)
+                            or waiting.startswith(container_id)]:
+                if action == "die" and "exitCode" in (actor.get("Attributes") or {}):
+                    exits[waiting] = int(actor["Attributes"]["exitCode"])
+
+                container = engine.inspect(waiting)
+                if container is None and waiting not in exits and action != "destroy":
+                    # Replaying what happened before it was removed
+                    continue
+
+                if _ready(waiting, container, exits.get(waiting)):
+                    pending.discard(waiting)
+
+            if not pending:
+                break
+
+    if pending:
+        raise UnhealthyError(f"Timed out waiting for {', '.join(sorted(pending))} to become healthy")
+
+
+def _wait_polling(pending: set[str], deadline: float, since: float | None):
+    """Check the containers with docker inspect, more slowly the longer they
+    take, up to once a second."""
+    delay = 0.1
+    while pending:
+        result = process.run("docker", "inspect", *sorted(pending), capture=True, check=False)
+        try:
+            details = {container["Id"]: container for container in json.loads(result.stdout or "[]")}
+        except ValueError:
+            details = {}
+
+        for container_id in list(pending):
+            found = next((container for full_id, container in details.items()
+                          if full_id.startswith(container_id)), None)
+            exit_code = _exit_code(container_id, since) if found is None and since is not None else None
+            if _ready(container_id, found, exit_code):
+                pending.discard(container_id)
+
+        if pending:
+            if time.monotonic() + delay > deadline:
+                raise UnhealthyError(f"Timed out waiting for {', '.join(sorted(pending))} to become healthy")
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+
+def _exit_code(container_id: str, since: float) -> int | None:
+    """How a removed container exited, from docker events."""
+    result = process.run("docker", "events", "--since", _timestamp(since), "--until", _timestamp(time.time()),
+                         "--filter", f"container={container_id}", "--filter", "event=die",
+                         "--format", "{{json .}}", capture=True, check=False)
+    for line in reversed(result.stdout.splitlines()):
+        try:
+            return int(json.loads(line)["Actor"]["Attributes"]["exitCode"])
+        except (ValueError, KeyError, TypeError):
+            continue
+
+    return None
+
+
+def _ready(container_id: str, container: dict | None, exit_code: int | None = None) -> bool:
+    """Is the container up and healthy?  Raises an UnhealthyError if it never
+    will be.  A container that's been removed is judged by its exit code, if
+    known."""
+    if container is None:
+        if exit_code == 0:
+            return True
+        if exit_code is not None:
+            raise UnhealthyError(f"Container {container_id} exited with status {exit_code}")
+        raise UnhealthyError(f"Container {container_id} no longer exists")
+
+    name = container.get("Name", "").lstrip("/") or container_id
+    state = container.get("State") or {}
+    status = state.get("Status")
+
+    if status in ("exited", "dead"):
+        if state.get("ExitCode") == 0:
+            return True
+        raise UnhealthyError(f"Container {name} exited with status {state.get('ExitCode')}")
+
+    if status != "running":
+        return False
+
+    health = (state.get("Health") or {}).get("Status")
+    if health == "unhealthy":
+        log = (state.get("Health") or {}).get("Log") or [{}]
+        raise UnhealthyError(f"Container {name} is unhealthy: {(log[-1].get('Output') or '').strip()}")
+
+    return health in (None, "none", "healthy")
+
+
+def _timestamp(value: float) -> str:
+    """A time.time() value as Docker's seconds.nanoseconds timestamps, a
+    second early to allow for the clocks disagreeing."""
+    return f"{value - 1:.9f}"
+
+
+def _socket_path() -> str | None:
+    """The engine's Unix socket, from DOCKER_HOST or the default.  None if
+    DOCKER_HOST points somewhere else, like a TCP address."""
+    host = os.getenv("DOCKER_HOST")
+    if not host:
+        return DEFAULT_SOCKET
+    if host.startswith("unix://"):
+        return host[len("unix://"):]
+
+    return None
+
+
+@functools.cache
+def _unix_connection():
+    """An HTTPConnection that connects to a Unix socket, created on first use
+    so http.client is only imported when needed."""
+    import http.client
+
+    class UnixConnection(http.client.HTTPConnection):
+        def __init__(self, path: str, timeout: float):
+            super().__init__("localhost", timeout=timeout)
+            self.path = path
+
+        def connect(self):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self.sock = sock
+
+    return UnixConnection
+
+
+def _message(body: bytes) -> str | None:
+    try:
+        return json.loads(body).get("message")
+    except (ValueError, AttributeError):
+        return None
@@ -1,6 +1,9 @@
-import sh
+import logging
+import time
 
-from wright.proojekt import Proojekt
+from wright.proojekt import Proojekt, process
+
+from . import engine
 
 
 class Runner:
@@ -20,6 +23,8 @@ class Runner:
         self.env: dict[str, str] = {}
         self.ports: list[str] = []
         self._network: str | None = None
+        self.container_id: str | None = None
+        self._started: float | None = None
 
     def __enter__(self):
         return self
@@ -76,9 +81,27 @@ class Runner:
 
         args.append(f"{self.container_name}:{self.version}")
 
-        process = sh.docker(*args, _iter="out", _err_to_out=True, _cwd=self.project.working_dir)
-        for line in process:
-            print(line.strip())
+        if self.follow:
+            process.run("docker", *args, cwd=self.project.working_dir, interactive=True)
+        else:
+            self._started = time.time()
+            result = process.run("docker", *args, cwd=self.project.working_dir, capture=True)
+            self.container_id = result.stdout.strip() or None
+
+    def wait_healthy(self, timeout: float = 120):
+        """Wait until the container is running and passing its health check,
+        if it has one, or has exited successfully.  Raises an UnhealthyError
+        if it fails or stops, or isn't healthy within the timeout, in
+        seconds."""
+        container_ids = [self.container_id] if self.container_id else _containers(
+            _filter(None, self.container_name, self.version))
+        if not container_ids:
+            raise engine.UnhealthyError(f"No container running for {self.container_name}:{self.version}")
+
+        # With --rm, a one-off container may be gone before we look, so ask
+        # about what happened since it started
+        since = self._started if self.rm and self.container_id else None
+        engine.wait_healthy(container_ids, timeout, since)
 
 
 def run(project: Proojekt, container_name: str, version: str = "latest", rm: bool = True, follow: bool = False):
@@ -86,33 +109,60 @@ def run(project: Proojekt, container_name: str, version: str = "latest", rm: boo
     return Runner(project, container_name, version, rm=rm, follow=follow)
 
 
-def running(coupling: str = None, container_name: str = None, version: str = None):
-    """Returns true if the coupling or container is running."""
-    if coupling:
-        filter_str = f"label=com.wsp.conduit.coupling={coupling}"
-    elif container_name:
-        tag = f":{version}" if version else ""
-        filter_str = f"ancestor={container_name}{tag}"
-    else:
-        filter_str = None
-
-    container_ids = sh.docker.ps("-q", "--filter", filter_str).strip().split()
+def running(coupling: str = None, container_name: str = None, version: str = None,
+            snapshot: engine.Snapshot | None = None):
+    """Returns true if the coupling or container is running.  Checks the
+    snapshot if given, e.g. from docker.snapshot(), when checking many."""
+    if snapshot is not None:
+        return len(snapshot.running(coupling, container_name, version)) > 0
 
-    return len(container_ids) > 0
+    return len(_containers(_filter(coupling, container_name, version))) > 0
 
 
 def stop(coupling: str = None, container_name: str = None, version: str = None):
     """Stop a Docker image by the coupling type or container tag."""
+    filter_str = _filter(coupling, container_name, version)
+
+    if filter_str:
+        container_ids = _containers(filter_str)
+        if not container_ids:
+            return
+
+        client = engine.client()
+        if client:
+            try:
+                for container_id in container_ids:
+                    client.stop(container_id)
+                return
+            except engine.EngineError as err:
+                logging.debug(f"Falling back to the docker command: {err}")
+
+        process.run("docker", "stop", *container_ids)
+
+
+def _filter(coupling: str | None, container_name: str | None, version: str | None) -> str | None:
     if coupling:
-        filter_str = f"label=com.wsp.conduit.coupling={coupling}"
-    elif container_name:
+        return f"label=com.wsp.conduit.coupling={coupling}"
+    if container_name:
         tag = f":{version}" if version else ""
-        filter_str = f"ancestor={container_name}{tag}"
-    else:
-        filter_str = None
+        return f"ancestor={container_name}{tag}"
 
-    if filter_str:
-        container_ids = sh.docker.ps("-q", "--filter", filter_str).strip().split()
+    return None
+
+
+def _containers(filter_str: str | None) -> list[str]:
+    """The IDs of the running containers matching the `docker ps` filter."""
+    client = engine.client()
+    if client:
+        filters = {}
+        if filter_str:
+            name, _, value = filter_str.partition("=")
+            filters[name] = [value]
+
+        try:
+            return [container["Id"] for container in client.containers(filters)]
+        except engine.EngineError as err:
+            logging.debug(f"Falling back to the docker command: {err}")
 
-        if container_ids:
-            sh.docker.stop(*container_ids)
+    args = ["--filter", filter_str] if filter_str else []
+    return process.run("docker", "ps", "-q", *args, capture=True).stdout.split()
@@ -1,10 +1,18 @@
+import os
 import sys
 import logging
 from pathlib import Path
 
-import sh
+from wright.proojekt import Proojekt, actions, fingerprint, process, trace
+from wright.proojekt.support import check_dependencies
 
-from wright.proojekt import Proojekt
+from . import packages
+
+# Environment variables that change what `go build` produces
+_BUILD_ENV = (
+    "GOOS", "GOARCH", "GOARM", "GOAMD64", "GOARM64", "GO386", "GOEXPERIMENT", "GOFLAGS",
+    "CGO_ENABLED", "CC", "CXX", "CGO_CFLAGS", "CGO_CPPFLAGS", "CGO_CXXFLAGS", "CGO_LDFLAGS",
+)
 
 
 class GolangModuleNotFoundError(Exception):
@@ -23,11 +31,15 @@ class App:
             raise GolangModuleNotFoundError()
 
         self.proojekt = project
-        self.proojekt.watch("**/*.go")
+        self._watching = False
         self.proojekt.target = project.target or project.working_dir / _get_target_name(self.module)
 
         self.vars: dict[str, str] = {}
         self.ldflags: list[str] = []
+        self.matrix: list[tuple[str, str]] = []
+        self.matrix_jobs: int | None = None
+        self.mains: list[str] = []
+        self.output_dir: Path | None = None
 
     def sources(self, glob: str):
         """Add a file or pattern of files to watch for changes before compiling."""
@@ -53,8 +65,49 @@ class App:
             self.ldflags.append("-w")
             self.ldflags.append("-s")
 
+    def platforms(self, *platforms: str, jobs: int | None = None) -> App:
+        """Build for each of the platforms, given as "goos/goarch", e.g.
+        "linux/arm64", rather than for the host.  The platforms build side by
+        side, up to jobs at a time, each to the target with "-goos-goarch"
+        appended, and each is only rebuilt when its own binary is out of
+        date."""
+        for platform in platforms:
+            goos, _, goarch = platform.partition("/")
+            if not goos or not goarch:
+                raise ValueError(f"Expected a platform like linux/amd64, not {platform!r}")
+            self.matrix.append((goos, goarch))
+
+        self.matrix_jobs = jobs
+        return self
+
+    def binaries(self, *packages: str, output: str = "bin") -> App:
+        """Build several main packages from the module, e.g. "./cmd/api" and
+        "./cmd/worker", rather than the one in the working directory.  Each
+        binary is named after its package and goes in the output directory.
+        Every out-of-date binary is built by a single go build, so the
+        packages they share are loaded and compiled once."""
+        self.mains.extend(packages)
+        self.output_dir = Path(output) if Path(output).is_absolute() else self.proojekt.working_dir / output
+        return self
+
+    def binary_target(self, package: str) -> str:
+        """Where the main package's binary is built to."""
+        name = Path(package.rstrip("/")).name
+        # Like go build, skip a major version suffix, e.g. example.com/tool/v2
+        if name[:1] == "v" and name[1:].isdigit() and "/" in package.rstrip("/"):
+            name = Path(package.rstrip("/")).parent.name
+
+        suffix = ".exe" if (os.getenv("GOOS") or sys.platform) in ("windows", "win32") else ""
+        return str(self.output_dir / f"{name}{suffix}")
+
+    def platform_target(self, goos: str, goarch: str) -> str:
+        """The binary built for the platform."""
+        suffix = ".exe" if goos == "windows" else ""
+        return f"{self.proojekt.target}-{goos}-{goarch}{suffix}"
+
     def changed(self) -> bool:
         """Have any of the watched files changed?"""
+        self._watch_packages()
         return self.proojekt.force or self.proojekt.should_run()
 
     def exists(self) -> bool:
@@ -63,35 +116,75 @@ class App:
     def compile(self) -> App:
         """Compile a Go application using `golang build` if any of the watched
         files have changed."""
+        if self.mains:
+            return self._compile_binaries()
+        if self.matrix:
+            return self._compile_matrix()
+
         if self.changed():
-            args: list[str] = ["build"]
+            args = self._build_args()
 
-            if self.vars:
-                for key, value in self.vars.items():
-                    self.ldflags.append("-X")
-                    self.ldflags.append("'{}/{}={}'".format(self.module, key, value))
+            def go_build():
+                try:
+                    process.run("go", *args, *self._output_args(), cwd=self.proojekt.working_dir)
+                except process.ProcessError as err:
+                    logging.error(f"Error compiling: {err}")
+                    sys.exit(1)
 
-            if self.ldflags:
-                args.append("-ldflags")
-                args.append(" ".join(self.ldflags))
+            if self.proojekt.target:
+                actions.run(self._action_key(args), [self.proojekt.target], go_build, root=self.proojekt.working_dir)
+            else:
+                go_build()
+
+            self.proojekt.built()
+
+        return self
+
+    async def compile_async(self) -> App:
+        """Like compile, but awaitable, so a task can compile while it does
+        other things, e.g. `await asyncio.gather(app.compile_async(), ...)`."""
+        import asyncio
+
+        if self.mains:
+            return await asyncio.to_thread(self._compile_binaries)
+        if self.matrix:
+            return await asyncio.to_thread(self._compile_matrix)
+
+        if await asyncio.to_thread(self.changed):
+            args = self._build_args()
+
+            async def go_build():
+                try:
+                    await process.run_async("go", *args, *self._output_args(), cwd=self.proojekt.working_dir)
+                except process.ProcessError as err:
+                    logging.error(f"Error compiling: {err}")
+                    sys.exit(1)
 
             if self.proojekt.target:
-                args.append("-o")
-                args.append(self.proojekt.target)
+                key = await asyncio.to_thread(self._action_key, args)
+                await actions.run_async(key, [self.proojekt.target], go_build, root=self.proojekt.working_dir)
+            else:
+                await go_build()
 
-            try:
-                sh.go(*args, _out=True, _cwd=self.proojekt.working_dir)
-            except Exception as err:
-                logging.error(f"Error compiling: {err}")
-                sys.exit(1)
+            self.proojekt.built()
 
         return self
 
-    def test(self) -> App:
-        """Run go test ./... to test all the packages in the Go project."""
+    def test(self, incremental: bool = False, flags: list[str] | None = None) -> App:
+        """Run go test ./... to test all the packages in the Go project.
+
+        With incremental, only the packages affected by what changed since
+        they last passed are tested:  each package's digest covers its files,
+        its tests and everything it imports, and a package whose digest
+        matches its last pass is skipped.  Flags are passed on to go test."""
+        flags = flags or []
+
+        if incremental:
+            return self._test_incremental(flags)
+
         try:
-            sh.go("test", "./...")
-        except Exception as err:
+            process.run("go", "test", *flags, "./...", cwd=self.proojekt.working_dir)
+        except process.ProcessError as err:
             logging.error(f"Error running test: {err}")
             sys.exit(1)
 
@@ -99,17 +192,227 @@ class App:
 
     def run(self, *args):
         """Run the Go binary, i.e. the target."""
-        cmd = sh.Command(self.proojekt.target, search_paths=[self.proojekt.working_dir])
+        target = Path(self.proojekt.target)
+        if not target.is_absolute():
+            target = self.proojekt.working_dir / target
+
+        result = process.run(target, *args, cwd=self.proojekt.working_dir, check=False, interactive=True)
+        if result.exit_code == 127 and result.tail:
+            logging.error(f"Error running binary: {result.tail[-1]}")
+            sys.exit(1)
+
+        sys.exit(result.exit_code)
+
+    def _build_args(self) -> list[str]:
+        args: list[str] = ["build"]
+
+        ldflags = list(self.ldflags)
+        for key, value in self.vars.items():
+            ldflags.append("-X")
+            ldflags.append("'{}/{}={}'".format(self.module, key, value))
+
+        if ldflags:
+            args.append("-ldflags")
+            args.append(" ".join(ldflags))
+
+        return args
+
+    def _output_args(self) -> list[str]:
+        return ["-o", self.proojekt.target] if self.proojekt.target else []
+
+    def _watch_packages(self):
+        """Watch the files the binary is actually built from, according to
+        go list, or every Go file if Go can't tell us."""
+        if self._watching:
+            return
+        self._watching = True
+
+        files = packages.watch_set(self.proojekt.working_dir)
+        for file in files if files is not None else ["**/*.go"]:
+            self.proojekt.watch(file)
+
+    def _action_key(self, args: list[str], env: dict[str, str] | None = None) -> str:
+        """Identify the build for the action cache."""
+        env = env or {}
+        return actions.action_key(
+            "go build", args, self.proojekt.digest("go.mod", "go.sum"),
+            {name: env.get(name, os.getenv(name)) for name in _BUILD_ENV},
+            actions.tool_version("go", "version"),
+        )
+
+    def _compile_matrix(self) -> App:
+        """Build the platforms whose binaries are out of date, several at once.
+        The change check walks and hashes the sources once for them all."""
+        import contextvars
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._watch_packages()
+
+        digest = None
+        if self.proojekt.fingerprints:
+            with trace.span("fingerprint", "check", target=str(self.proojekt.target)):
+                digest = fingerprint.fingerprint(self.proojekt.sources, root=self.proojekt.working_dir,
+                                                 excludes=self.proojekt.excludes)
+
+        stale = [(goos, goarch) for goos, goarch in self.matrix
+                 if self.proojekt.force or self._target_changed(self.platform_target(goos, goarch), digest)]
+        if not stale:
+            return self
+
+        args = self._build_args()
+
+        # One build cache for every platform, so packages that don't depend on
+        # GOOS or GOARCH, like generated code, are only compiled once
+        cache = os.getenv("GOCACHE") or process.run(
+            "go", "env", "GOCACHE", cwd=self.proojekt.working_dir, capture=True).stdout.strip()
+
+        def go_build(goos: str, goarch: str) -> str | None:
+            target = self.platform_target(goos, goarch)
+            env = {**os.environ, "GOOS": goos, "GOARCH": goarch, "GOCACHE": cache}
+
+            def build():
+                process.run("go", *args, "-o", target, cwd=self.proojekt.working_dir, env=env)
+
+            try:
+                actions.run(self._action_key(args, env), [target], build, root=self.proojekt.working_dir)
+            except process.ProcessError as err:
+                return f"{goos}/{goarch}: {err}"
+
+            if digest:
+                fingerprint.record(target, digest)
+            return None
+
+        jobs = self.matrix_jobs or min(len(stale), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="wright-go") as pool:
+            futures = [pool.submit(contextvars.copy_context().run, go_build, goos, goarch) for goos, goarch in stale]
+            errors = [error for future in futures if (error := future.result())]
+
+        if errors:
+            for error in errors:
+                logging.error(f"Error compiling for {error}")
+            sys.exit(1)
+
+        return self
+
+    def _compile_binaries(self) -> App:
+        """Build the binaries that are out of date with one go build.  Each
+        binary is checked against the files its own package is built from."""
+        if self.matrix:
+            raise ValueError("A build matrix can't be combined with several binaries")
+
+        globs: dict[str, list[str]] = {}
+        digests: dict[str, str | None] = {}
+
+        with trace.span("fingerprint", "check", target=str(self.output_dir)):
+            for package in self.mains:
+                files = packages.watch_set(self.proojekt.working_dir, package)
+                globs[package] = self.proojekt.sources + (files if files is not None else ["**/*.go"])
+                digests[package] = fingerprint.fingerprint(
+                    globs[package], root=self.proojekt.working_dir,
+                    excludes=self.proojekt.excludes) if self.proojekt.fingerprints else None
+
+        # Watch mode reruns the task when any of the binaries' files change
+        for package in self.mains:
+            for glob in globs[package]:
+                if glob not in self.proojekt.sources:
+                    self.proojekt.watch(glob)
+
+        stale = [package for package in self.mains if self.proojekt.force or self._target_changed(
+            self.binary_target(package), digests[package], globs[package])]
+        if not stale:
+            return self
+
+        args = self._build_args()
+        targets = [self.binary_target(package) for package in stale]
+
+        def go_build():
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                # With several packages, -o must name a directory, ending in a slash
+                process.run("go", *args, "-o", f"{self.output_dir}{os.sep}", *stale, cwd=self.proojekt.working_dir)
+            except process.ProcessError as err:
+                logging.error(f"Error compiling: {err}")
+                sys.exit(1)
+
+        key = actions.action_key(
+            "go build", args, stale, [digests[package] for package in stale],
+            {name: os.getenv(name) for name in _BUILD_ENV},
+            actions.tool_version("go", "version"),
+        )
+        actions.run(key, targets, go_build, root=self.proojekt.working_dir)
+
+        for package, target in zip(stale, targets):
+            if digests[package]:
+                fingerprint.record(target, digests[package])
+
+        return self
+
+    def _target_changed(self, target: str, digest: str | None, globs: list[str] | None = None) -> bool:
+        """Is the target missing, or built from something other than the
+        files matching the globs, whose fingerprint is the digest?"""
+        globs = globs if globs is not None else self.proojekt.sources
+        if not Path(target).exists():
+            return True
+        if digest is None:
+            return check_dependencies(globs, target, self.proojekt.excludes)
+
+        previous = fingerprint.store().target(str(Path(target).absolute()))
+        if previous is None and not check_dependencies(globs, target, self.proojekt.excludes):
+            fingerprint.record(target, digest)
+            return False
+
+        return previous != digest
+
+    def _test_incremental(self, flags: list[str]) -> App:
+        working_dir = self.proojekt.working_dir
+        state = fingerprint.store()
+
         try:
-            output = cmd(*args, _iter="out", _err_to_out=True, _cwd=self.proojekt.working_dir)
-            for line in output:
-                print(line.strip())
+            listed = packages.list_packages(working_dir)
+        except process.ProcessError as err:
+            logging.error(f"Error listing packages: {err}")
+            sys.exit(1)
 
-            sys.exit(output.exit_code)
-        except Exception as err:
-            logging.error(f"Error running binary: {err}")
+        # Everything else a test run depends on:  the flags, the module's
+        # requirements, the environment and the Go toolchain
+        modules = fingerprint.fingerprint([str(working_dir / "go.mod"), str(working_dir / "go.sum")],
+                                          root=working_dir, state=state)
+        context = actions.action_key(
+            "go test", flags, modules,
+            {name: os.getenv(name) for name in _BUILD_ENV},
+            actions.tool_version("go", "version"),
+        )
+
+        keys = {
+            path: actions.action_key(context, digest)
+            for path, digest in packages.digests(listed, working_dir, tests=True, state=state).items()
+            if listed[path].main and listed[path].has_tests
+        }
+
+        stale = sorted(path for path, key in keys.items() if state.target(self._test_name(path)) != key)
+        if not stale:
+            print(f"[WRIGHT]: {len(keys)} packages unchanged since they passed")
+            return self
+
+        print(f"[WRIGHT]: testing {len(stale)} of {len(keys)} packages")
+        result = process.run("go", "test", "-json", *flags, *stale, cwd=working_dir, capture=True, check=False)
+
+        verbose = any(flag in ("-v", "-v=true", "-test.v", "-test.v=true") for flag in flags)
+        passed, failed = _test_results(result.stdout, verbose)
+        for path in passed:
+            if path in keys:
+                state.set_target(self._test_name(path), keys[path])
+
+        if failed or not result.ok:
+            logging.error(f"Tests failed in {', '.join(failed) or ' '.join(result.argv)}")
             sys.exit(1)
 
+        return self
+
+    def _test_name(self, package: str) -> str:
+        """Where a package's last pass is recorded in the state store."""
+        return f"go test {self.proojekt.working_dir}:{package}"
+
     def rm(self) -> App:
         """Removes the target binary, i.e. performs a clean.  If the target does
         not exist, the request is quietly ignored."""
@@ -122,6 +425,44 @@ class App:
         return self
 
 
+def _test_results(output: str, verbose: bool = False) -> tuple[list[str], list[str]]:
+    """Print the results of `go test -json` much as go test would, returning
+    the packages that passed and those that failed.  With verbose, as for
+    go test -v, prints every package's output, including t.Log output."""
+    import json
+
+    passed: list[str] = []
+    failed: list[str] = []
+    output_by_package: dict[str, list[str]] = {}
+
+    for line in output.splitlines():
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # Not every line is an event, e.g. build errors on older versions
+            print(line)
+            continue
+
+        package = event.get("Package") or event.get("ImportPath")
+        action = event.get("Action")
+
+        if action in ("output", "build-output"):
+            if verbose:
+                sys.stdout.write(event.get("Output", ""))
+            else:
+                output_by_package.setdefault(package, []).append(event.get("Output", ""))
+        elif action in ("pass", "fail", "skip") and "Test" not in event and package:
+            if action == "fail":
+                failed.append(package)
+                sys.stdout.write("".join(output_by_package.get(package, [])))
+            else:
+                passed.append(package)
+                if action == "pass" and not verbose:
+                    print(f"ok  \t{package}\t{event.get('Elapsed', 0):.3f}s")
+
+    return passed, failed
+
+
 def _get_module_name(file_path: Path) -> str | None:
     """Get the module name out of a golang.mod file.  Returns None if the module is
     undefined."""
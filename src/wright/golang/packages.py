@@ -0,0 +1,321 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from pathlib import Path
+
+from wright.proojekt import fingerprint, process
+from wright.proojekt.support import state_dir
+
+# Bump when the shape of the cached watch sets changes
+_WATCH_VERSION = "3"
+
+# How closely _watch_key looks at a directory, least to most
+_WATCH_KINDS = ("source", "all", "tree")
+
+_WILDCARDS = re.compile(r"[*?\[\\]")
+
+# Files go build compiles or links in a package directory
+_SOURCE_SUFFIXES = (
+    ".go", ".c", ".cc", ".cpp", ".cxx", ".h", ".hh", ".hpp", ".hxx",
+    ".m", ".s", ".S", ".sx", ".f", ".F", ".for", ".f90", ".swig", ".swigcxx", ".syso",
+)
+
+
+class Package:
+    """A Go package, as described by `go list -json`."""
+
+    def __init__(self, data: dict):
+        self.import_path: str = data["ImportPath"]
+        self.name: str = data.get("Name", "")
+        self.dir = Path(data.get("Dir", ""))
+        self.standard: bool = data.get("Standard", False)
+
+        module = data.get("Module") or {}
+        replace = module.get("Replace") or {}
+        self.module: str | None = module.get("Path")
+        self.main: bool = module.get("Main", False)
+        # Modules replaced by a local directory have no version to go by
+        self.version: str | None = replace.get("Version") if replace else module.get("Version")
+        self.module_dir: str | None = replace.get("Dir") if replace else module.get("Dir")
+
+        self.embeds: list[str] = data.get("EmbedFiles", [])
+        self.embed_patterns: list[str] = data.get("EmbedPatterns", [])
+        self.files: list[str] = [
+            *data.get("GoFiles", []), *data.get("CgoFiles", []), *data.get("CFiles", []),
+            *data.get("CXXFiles", []), *data.get("MFiles", []), *data.get("HFiles", []),
+            *data.get("FFiles", []), *data.get("SFiles", []), *data.get("SwigFiles", []),
+            *data.get("SwigCXXFiles", []), *data.get("SysoFiles", []), *self.embeds,
+        ]
+        self.test_files: list[str] = [
+            *data.get("TestGoFiles", []), *data.get("XTestGoFiles", []),
+            *data.get("TestEmbedFiles", []), *data.get("XTestEmbedFiles", []),
+        ]
+
+        self.imports: list[str] = data.get("Imports", [])
+        self.test_imports: list[str] = sorted({*data.get("TestImports", []), *data.get("XTestImports", [])})
+        self.error: str | None = (data.get("Error") or {}).get("Err")
+
+    @property
+    def local(self) -> bool:
+        """Is the package's source part of this checkout, i.e. in the main
+        module or a module replaced by a local directory?"""
+        return not self.standard and (self.main or (self.module is not None and self.version is None))
+
+    @property
+    def has_tests(self) -> bool:
+        return any(file.endswith(".go") for file in self.test_files)
+
+    def embed_dirs(self) -> dict[str, str]:
+        """
+        The directories the package's //go:embed patterns pick files up from,
+        and how to watch them.  A pattern naming a directory embeds everything
+        below it, so that's watched as a tree from the pattern's leading
+        directory; a wildcard at the top of the package only needs the
+        package directory's listing.  The directories holding the files
+        embedded now are watched too, for wildcards matching directories.
+        """
+        dirs = {str((self.dir / file).parent): "all" for file in self.embeds}
+
+        for pattern in self.embed_patterns:
+            parts = pattern.removeprefix("all:").split("/")
+            literal = []
+            for part in parts:
+                if _WILDCARDS.search(part):
+                    break
+                literal.append(part)
+
+            root = self.dir.joinpath(*literal)
+            if len(literal) == len(parts) and not root.is_dir():
+                _watch(dirs, str(root.parent), "all")
+            elif not literal:
+                _watch(dirs, str(root), "all")
+            else:
+                _watch(dirs, str(root), "tree")
+
+        return dirs
+
+    def sources(self, tests: bool = False) -> list[Path]:
+        """The files the package is built from, with its test files and any
+        testdata if tests is true."""
+        files = [self.dir / file for file in self.files]
+        if tests:
+            files.extend(self.dir / file for file in self.test_files)
+            testdata = self.dir / "testdata"
+            if testdata.is_dir():
+                files.extend(path for path in sorted(testdata.rglob("*")) if path.is_file())
+
+        return files
+
+
+def list_packages(working_dir: Path, patterns: tuple[str, ...] = ("./...",),
+                  tests: bool = True) -> dict[str, Package]:
+    """
+    Run `go list -deps -json` over the patterns and return every package they
+    import, directly or not, by import path.  With tests, the packages only
+    the tests import are included too.  The test variants `go list -test`
+    adds are left out; a package's test files are listed with the package.
+    """
+    args = ["go", "list", "-deps", "-json", "-e"]
+    if tests:
+        args.append("-test")
+
+    result = process.run(*args, *patterns, cwd=working_dir, capture=True)
+
+    packages: dict[str, Package] = {}
+    decoder = json.JSONDecoder()
+    text, position = result.stdout, 0
+
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position >= len(text):
+            break
+
+        data, position = decoder.raw_decode(text, position)
+        if data.get("ForTest") or " " in data["ImportPath"] or data["ImportPath"].endswith(".test"):
+            continue
+
+        packages[data["ImportPath"]] = Package(data)
+
+    return packages
+
+
+def watch_set(working_dir: Path, pattern: str = ".") -> list[str] | None:
+    """
+    The files that feed the binary built from the package:  the non-test
+    sources and embedded files of every local package it imports, go.mod and
+    go.sum, and the go.mod of any module replaced by a local directory.
+    Returns None if Go can't list the packages.
+
+    The result is cached under .wright/cache/go, keyed by go.mod, go.sum and
+    the listings of the packages' directories, so go list only runs again
+    when a source file is added, removed or edited in one of them.  Edits
+    count because they may change what a package imports.
+    """
+    working_dir = Path(working_dir).absolute()
+    name = hashlib.blake2b(f"{working_dir}\0{pattern}".encode("utf-8"), digest_size=20).hexdigest()
+    cached = state_dir() / "cache" / "go" / f"{name}.json"
+
+    try:
+        entry = json.loads(cached.read_text(encoding="utf-8"))
+        if entry["version"] == _WATCH_VERSION and entry["key"] == _watch_key(working_dir, entry["dirs"]):
+            return entry["files"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    try:
+        listed = list_packages(working_dir, (pattern,), tests=False)
+    except process.ProcessError as err:
+        logging.info(f"Unable to list the Go packages in {working_dir}: {err}")
+        return None
+
+    files = {str(working_dir / "go.mod"), str(working_dir / "go.sum")}
+    dirs = {}
+    for package in listed.values():
+        if not package.local:
+            continue
+
+        for file in package.sources():
+            files.add(str(file))
+        for directory, kind in package.embed_dirs().items():
+            _watch(dirs, directory, kind)
+        _watch(dirs, str(package.dir), "source")
+
+        if package.module_dir and not package.main:
+            files.add(str(Path(package.module_dir) / "go.mod"))
+
+    entry = {"version": _WATCH_VERSION, "files": sorted(files), "dirs": dict(sorted(dirs.items()))}
+    entry["key"] = _watch_key(working_dir, entry["dirs"])
+
+    try:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        cached.write_text(json.dumps(entry), encoding="utf-8")
+    except OSError as err:
+        logging.debug(f"Unable to cache the Go watch set: {err}")
+
+    return entry["files"]
+
+
+def digests(packages: dict[str, Package], root: Path, tests: bool = False,
+            state: fingerprint.StateStore | None = None) -> dict[str, str]:
+    """
+    Compute a digest of everything each local package is built from:  its own
+    files, and the digests of the packages it imports, transitively.  Changing
+    a file changes the digest of its package and of every package depending
+    on it.  Standard library packages are covered by the Go version and
+    third-party ones by their module versions, so only local files are read.
+
+    With tests, each digest also covers the package's test files, testdata and
+    the packages its tests import.
+    """
+    local = [package for package in packages.values() if package.local]
+    hashed = fingerprint.hash_files([file for package in local for file in package.sources(tests)], state)
+
+    def files_digest(files: list[Path]) -> str:
+        h = hashlib.blake2b(digest_size=20)
+        for file in files:
+            h.update(_relative(file, root).encode("utf-8"))
+            h.update(b"\0")
+            h.update(hashed.get(str(file), "missing").encode("ascii"))
+            h.update(b"\n")
+        return h.hexdigest()
+
+    memo: dict[str, str] = {}
+
+    def identity(path: str) -> str:
+        """The package's transitive digest, leaving out its tests."""
+        if path not in memo:
+            package = packages.get(path)
+            if package is None or package.standard:
+                memo[path] = path
+            elif not package.local:
+                memo[path] = f"{package.module}@{package.version}"
+            else:
+                # Go forbids import cycles, so this always bottoms out
+                memo[path] = _combine(path, files_digest(package.sources()), package.imports, identity)
+
+        return memo[path]
+
+    if not tests:
+        return {package.import_path: identity(package.import_path) for package in local}
+
+    return {
+        package.import_path: _combine(
+            package.import_path,
+            files_digest(package.sources(tests=True)),
+            sorted({*package.imports, *package.test_imports} - {package.import_path}),
+            identity,
+        )
+        for package in local
+    }
+
+
+def _combine(path: str, own: str, imports: list[str], identity) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{path}\0{own}\n".encode("utf-8"))
+    for imported in sorted(imports):
+        h.update(f"{imported}\0{identity(imported)}\n".encode("utf-8"))
+
+    return h.hexdigest()
+
+
+def _watch(dirs: dict[str, str], directory: str, kind: str):
+    """Watch the directory at least as closely as the kind asks."""
+    current = dirs.get(directory)
+    if current is None or _WATCH_KINDS.index(kind) > _WATCH_KINDS.index(current):
+        dirs[directory] = kind
+
+
+def _watch_key(working_dir: Path, dirs: dict[str, str]) -> str:
+    """Digest go.mod, go.sum and the names and timestamps of the files in the
+    directories:  the source files in package directories, every file in the
+    directories holding embedded files, and every file below the directories
+    embedded whole."""
+    h = hashlib.blake2b(digest_size=20)
+    for name in ("go.mod", "go.sum"):
+        try:
+            h.update((working_dir / name).read_bytes())
+        except OSError:
+            pass
+        h.update(b"\0")
+
+    for directory, kind in dirs.items():
+        h.update(directory.encode("utf-8"))
+        h.update(b"\0")
+
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            try:
+                entries = sorted(os.scandir(current), key=lambda entry: entry.name)
+            except OSError:
+                h.update(b"missing\n")
+                continue
+
+            prefix = os.path.relpath(current, directory) + "/" if current != directory else ""
+            subdirs = []
+            for entry in entries:
+                if entry.name.startswith(".") or (kind == "source" and (
+                        not entry.name.endswith(_SOURCE_SUFFIXES) or entry.name.endswith("_test.go"))):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                h.update(f"{prefix}{entry.name}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+
+                if kind == "tree" and entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+
+            pending.extend(reversed(subdirs))
+
+    return h.hexdigest()
+
+
+def _relative(path: Path, root: Path) -> str:
+    try:
+        return path.relative_to(root).as_posix()
+    except ValueError:
+        return os.fspath(path)
@@ -1,23 +1,17 @@
-import logging
-from pathlib import Path
+import sys
 
-import click
+from wright import daemon
 
-from wright import proojekt
 
+def run():
+    """Run wright, handing the command to the daemon if one is running.  Only
+    imports click and the build machinery when running the command here."""
+    code = daemon.forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
 
-# TODO:  I need a "wright tasks" to list the available tasks
-
-@click.command()
-@click.option('--script', default='./BUILD.py', help="Build file to use")
-@click.argument("command", default="build")
-def run(script: Path, command: str):
-    """Run a command in a build script"""
-    try:
-        logging.basicConfig(level=logging.WARNING)
-        proojekt.load_file(script, command)
-    except AttributeError as e:
-        logging.error(e)
+    from wright.cli import cli
+    cli()
 
 
 if __name__ == '__main__':
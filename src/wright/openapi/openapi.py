@@ -1,6 +1,9 @@
-import sh
+from pathlib import Path
 
-from wright.proojekt import Proojekt
+from wright.proojekt import Proojekt, actions, process
+
+# The files swag generates in the output directory
+_SWAG_OUTPUTS = ("docs.go", "swagger.json", "swagger.yaml")
 
 
 class OpenAPI:
@@ -52,6 +55,27 @@ class OpenAPI:
 
     def swag(self):
         """Runs swag to generate OpenAPI documentation.  Requires the swag v2 binary."""
+        args = self._swag_args()
+
+        def generate():
+            process.run("swag", *args, cwd=self.project.working_dir)
+
+        actions.run(self._action_key(args), self._swag_outputs(), generate, root=self.project.working_dir)
+
+    async def swag_async(self):
+        """Like swag, but awaitable, so the docs can generate alongside other
+        steps with asyncio.gather."""
+        import asyncio
+
+        args = self._swag_args()
+
+        async def generate():
+            await process.run_async("swag", *args, cwd=self.project.working_dir)
+
+        key = await asyncio.to_thread(self._action_key, args)
+        await actions.run_async(key, self._swag_outputs(), generate, root=self.project.working_dir)
+
+    def _swag_args(self) -> list[str]:
         args = ["init"]
 
         if self.general is not None:
@@ -68,9 +92,18 @@ class OpenAPI:
         if self._parseDependencies:
             args.append("--parseDependency")
 
-        process = sh.swag(*args, _iter="out", _err_to_out=True, _cwd=self.project.working_dir)
-        for line in process:
-            print(line.strip())
+        return args
+
+    def _swag_outputs(self) -> list[Path]:
+        output = Path(self.output or "docs")
+        return [output / name for name in _SWAG_OUTPUTS]
+
+    def _action_key(self, args: list[str]) -> str:
+        """Identify the generated docs for the action cache.  Leaves out the
+        docs.go swag writes, or every run would change its own key."""
+        outputs = [str(path) for path in self._swag_outputs()]
+        return actions.action_key("swag", args, self.project.digest("**/*.go", excludes=outputs),
+                                  actions.tool_version("swag", "--version"))
 
 
 def swag(project: Proojekt):
@@ -1,6 +1,4 @@
-import sh
-
-from wright.proojekt import Proojekt
+from wright.proojekt import Proojekt, actions, process
 
 
 class Output:
@@ -88,6 +86,36 @@ class PanDoc:
 
     def generate(self):
         """Runs pandoc to generate documentation.  Requires the pandoc binary."""
+        for output, local_args in self._commands():
+            def pandoc(local_args=local_args):
+                process.run("pandoc", *local_args, cwd=self.project.working_dir)
+
+            actions.run(self._action_key(output, local_args), [output.filename], pandoc,
+                        root=self.project.working_dir)
+
+    async def generate_async(self):
+        """Like generate, but awaitable.  Renders every output at once, and
+        can run alongside other steps with asyncio.gather."""
+        import asyncio
+
+        async def render(output: Output, local_args: list[str]):
+            async def pandoc():
+                await process.run_async("pandoc", *local_args, cwd=self.project.working_dir)
+
+            key = await asyncio.to_thread(self._action_key, output, local_args)
+            await actions.run_async(key, [output.filename], pandoc, root=self.project.working_dir)
+
+        await asyncio.gather(*(render(output, local_args) for output, local_args in self._commands()))
+
+    def _action_key(self, output: Output, local_args: list[str]) -> str:
+        """Identify an output's render for the action cache."""
+        inputs = self._documents + ([output.stylesheet] if output.stylesheet else [])
+        return actions.action_key("pandoc", local_args, self.project.digest(*inputs),
+                                  actions.tool_version("pandoc", "--version"))
+
+    def _commands(self) -> list[tuple[Output, list[str]]]:
+        """The pandoc arguments for each output."""
+        commands = []
         args = [
             "-f", "gfm-hard_line_breaks"
         ]
@@ -128,9 +156,9 @@ class PanDoc:
 
             # print(" ".join(local_args))
 
-            process = sh.pandoc(*local_args, _iter="out", _err_to_out=True, _cwd=self.project.working_dir)
-            for line in process:
-                print(line.strip())
+            commands.append((output, local_args))
+
+        return commands
 
 
 def generate(project: Proojekt):
@@ -1,3 +1,5 @@
+import importlib
+
 __all__ = [
     "task",
     "sources",
@@ -15,6 +17,33 @@ __all__ = [
     "Version",
 ]
 
-from .decorators import task, sources, depends, target, include
-from .proojekt import Proojekt
-from .support import load_file, check_dependencies, is_env, bump_version, current_path, Version
+# Imported on first use; see wright/__init__.py
+_exports = {
+    "task": ".decorators",
+    "sources": ".decorators",
+    "depends": ".decorators",
+    "target": ".decorators",
+    "include": ".decorators",
+
+    "Proojekt": ".proojekt",
+
+    "load_file": ".support",
+    "check_dependencies": ".support",
+    "is_env": ".support",
+    "bump_version": ".support",
+    "current_path": ".support",
+    "Version": ".support",
+}
+
+
+def __getattr__(name: str):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
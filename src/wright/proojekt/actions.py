@@ -0,0 +1,519 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import urllib.parse
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from .support import parse_size, state_dir
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+# Default size limit for the local cache, when WRIGHT_CACHE_SIZE isn't set
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+
+# Linux ioctl to clone a file's extents (a "reflink") on btrfs, XFS and friends
+_FICLONE = 0x40049409
+
+# The configured cache, along with the settings it was configured from
+_cache: tuple[tuple[str, str, str], ActionCache | bool] | None = None
+_cache_lock = threading.Lock()
+
+
+class Backend(ABC):
+    """
+    Where the action cache keeps things:  small JSON manifests, keyed by the
+    fingerprint of an action's inputs, that list the action's outputs by
+    content digest; and the output contents themselves, keyed by digest.
+    """
+
+    @abstractmethod
+    def get_manifest(self, key: str) -> dict | None:
+        ...
+
+    @abstractmethod
+    def put_manifest(self, key: str, manifest: dict):
+        ...
+
+    @abstractmethod
+    def has_blob(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    def restore_blob(self, digest: str, dest: Path, mode: int) -> bool:
+        """Write the blob to dest, which doesn't exist, with the given
+        permissions.  Returns false if the blob isn't in the cache."""
+        ...
+
+    @abstractmethod
+    def put_blob(self, digest: str, source: Path):
+        ...
+
+
+class LocalBackend(Backend):
+    """
+    Keeps the cache in a local directory, which may be shared by several
+    checkouts or worktrees.  Outputs are stored as read-only files and
+    restored by reflink where the filesystem supports it, otherwise copied,
+    so a tool writing over a restored output in place can't change the
+    cache.  With compress, outputs are stored with zstd instead and
+    decompressed on restore.  The least recently used outputs and manifests
+    are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_BYTES, compress: bool = False):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.compress = compress and zstd is not None
+
+    def get_manifest(self, key: str) -> dict | None:
+        path = self._manifest(key)
+        try:
+            manifest = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+        _touch(path)
+        return manifest
+
+    def put_manifest(self, key: str, manifest: dict):
+        _write_atomic(self._manifest(key), json.dumps(manifest).encode("utf-8"))
+        self.evict()
+
+    def has_blob(self, digest: str) -> bool:
+        return self._blob(digest).exists() or self._blob(digest, compressed=True).exists()
+
+    def restore_blob(self, digest: str, dest: Path, mode: int) -> bool:
+        compressed = self._blob(digest, compressed=True)
+        if compressed.exists() and zstd is not None:
+            with open(compressed, "rb") as f:
+                dest.write_bytes(zstd.decompress(f.read()))
+            os.chmod(dest, mode)
+            _touch(compressed)
+            return True
+
+        blob = self._blob(digest)
+        if not blob.exists():
+            return False
+
+        _clone_or_copy(blob, dest)
+        os.chmod(dest, mode)
+        _touch(blob)
+        return True
+
+    def put_blob(self, digest: str, source: Path):
+        if self.has_blob(digest):
+            return
+
+        if self.compress:
+            _write_atomic(self._blob(digest, compressed=True), zstd.compress(source.read_bytes()))
+        else:
+            blob = self._blob(digest)
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            partial = blob.with_name(f"{blob.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            shutil.copyfile(source, partial)
+            # Read-only, so nothing writes through a reflink by accident
+            os.chmod(partial, os.stat(source).st_mode & 0o555)
+            os.replace(partial, blob)
+
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used outputs and manifests until the
+        cache fits.  Sizes are the space the files take on disk, so a great
+        many small manifests count for what they really cost."""
+        entries = []
+        total = 0
+        for directory, _, files in [*os.walk(self.root / "cas"), *os.walk(self.root / "ac")]:
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                size = st.st_blocks * 512
+                entries.append((st.st_mtime_ns, size, path))
+                total += size
+
+        if total <= self.max_bytes:
+            return
+
+        # Make some headroom, so we don't evict on every store
+        goal = self.max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if total <= goal:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+    def _manifest(self, key: str) -> Path:
+        return self.root / "ac" / key[:2] / f"{key}.json"
+
+    def _blob(self, digest: str, compressed: bool = False) -> Path:
+        return self.root / "cas" / digest[:2] / (f"{digest}.zst" if compressed else digest)
+
+
+class HttpBackend(Backend):
+    """
+    Keeps the cache on an HTTP server:  manifests at {url}/ac/{key} and
+    outputs at {url}/cas/{digest}, fetched with GET and stored with PUT.
+    Outputs are sent zstd-compressed when compression is available.  Each
+    thread keeps its connection open between requests.
+    """
+
+    def __init__(self, url: str, timeout: float = 30):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.host = parsed.netloc
+        self.prefix = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get_manifest(self, key: str) -> dict | None:
+        status, body, _ = self._request("GET", f"/ac/{key}")
+        if status != 200:
+            return None
+
+        try:
+            return json.loads(body)
+        except ValueError:
+            return None
+
+    def put_manifest(self, key: str, manifest: dict):
+        self._request("PUT", f"/ac/{key}", json.dumps(manifest).encode("utf-8"),
+                      {"Content-Type": "application/json"})
+
+    def has_blob(self, digest: str) -> bool:
+        status, _, _ = self._request("HEAD", f"/cas/{digest}")
+        return status == 200
+
+    def restore_blob(self, digest: str, dest: Path, mode: int) -> bool:
+        status, body, headers = self._request("GET", f"/cas/{digest}")
+        if status != 200:
+            return False
+
+        if headers.get("content-encoding") == "zstd":
+            if zstd is None:
+                return False
+            body = zstd.decompress(body)
+
+        if _digest_bytes(body) != digest:
+            logging.warning(f"Discarding corrupt cache entry {digest}")
+            return False
+
+        dest.write_bytes(body)
+        os.chmod(dest, mode)
+        return True
+
+    def put_blob(self, digest: str, source: Path):
+        if self.has_blob(digest):
+            return
+
+        body = source.read_bytes()
+        headers = {"Content-Type": "application/octet-stream"}
+        if zstd is not None:
+            body = zstd.compress(body)
+            headers["Content-Encoding"] = "zstd"
+
+        self._request("PUT", f"/cas/{digest}", body, headers)
+
+    def _request(self, method: str, path: str, body: bytes | None = None,
+                 headers: dict | None = None) -> tuple[int, bytes, dict]:
+        import http.client
+
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+                return response.status, data, {k.lower(): v for k, v in response.getheaders()}
+            except (OSError, http.client.HTTPException) as err:
+                # The server may have closed an idle connection; reconnect once
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    logging.warning(f"Action cache unavailable at {self.host}: {err}")
+
+        return 0, b"", {}
+
+    def _connection(self):
+        import http.client
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.scheme == "https":
+                conn = http.client.HTTPSConnection(self.host, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(self.host, timeout=self.timeout)
+            self._local.conn = conn
+
+        return conn
+
+
+class ActionCache:
+    """
+    Remembers the outputs of build actions, like a compiled Go binary or a
+    generated document, by a key computed from everything that goes into the
+    action.  When an action with the same key has run before, anywhere that
+    shares the cache, its outputs are restored instead of running it again.
+    """
+
+    def __init__(self, backend: Backend):
+        self.backend = backend
+
+    def run(self, key: str, outputs: list[Path | str], action: Callable[[], Any], root: Path | None = None) -> bool:
+        """
+        Restore the outputs cached for the key, or run the action and cache
+        the outputs it produces.  Outputs are recorded relative to the root,
+        the current directory by default, so a checkout elsewhere can reuse
+        them.  Returns true if the outputs were restored from the cache.
+        """
+        root = Path(root or os.getcwd()).absolute()
+        outputs = [(root / output) for output in outputs]
+
+        if self.restore(key, outputs, root):
+            return True
+
+        # Remove the old outputs first, in case they're hard links into the
+        # cache, restored by an older Wright, and the tool writes over them.
+        for output in outputs:
+            _unlink(output)
+
+        action()
+        self.store(key, outputs, root)
+        return False
+
+    async def run_async(self, key: str, outputs: list[Path | str], action: Callable[[], Awaitable[Any]],
+                        root: Path | None = None) -> bool:
+        """Like run, for an async action.  Restoring and storing the outputs
+        happens on a worker thread, so other tasks keep running."""
+        import asyncio
+
+        root = Path(root or os.getcwd()).absolute()
+        outputs = [(root / output) for output in outputs]
+
+        if await asyncio.to_thread(self.restore, key, outputs, root):
+            return True
+
+        for output in outputs:
+            _unlink(output)
+
+        await action()
+        await asyncio.to_thread(self.store, key, outputs, root)
+        return False
+
+    def restore(self, key: str, outputs: list[Path], root: Path) -> bool:
+        manifest = self.backend.get_manifest(key)
+        if not manifest:
+            return False
+
+        entries = {entry["path"]: entry for entry in manifest.get("outputs", [])}
+        if set(entries) != {_relative(output, root) for output in outputs}:
+            return False
+
+        for output in outputs:
+            entry = entries[_relative(output, root)]
+            output.parent.mkdir(parents=True, exist_ok=True)
+            _unlink(output)
+
+            if not self.backend.restore_blob(entry["digest"], output, entry.get("mode", 0o644)):
+                return False
+
+        logging.info(f"Restored {', '.join(str(o) for o in outputs)} from the action cache")
+        return True
+
+    def store(self, key: str, outputs: list[Path], root: Path):
+        entries = []
+        for output in outputs:
+            if not output.is_file():
+                logging.debug(f"Not caching {key}: {output} wasn't produced")
+                return
+
+            digest = _digest_file(output)
+            self.backend.put_blob(digest, output)
+            entries.append({
+                "path": _relative(output, root),
+                "digest": digest,
+                "mode": os.stat(output).st_mode & 0o777,
+            })
+
+        self.backend.put_manifest(key, {"outputs": entries})
+
+
+def cache() -> ActionCache | None:
+    """
+    The action cache configured for this process, if any.  Set WRIGHT_CACHE
+    to "local" (or "1") to use .wright/cache/actions, to a directory to use
+    or share that directory, or to an http(s):// URL.  WRIGHT_CACHE_SIZE caps
+    a local cache, e.g. "10G"; WRIGHT_CACHE_COMPRESS=true stores it with zstd.
+    """
+    global _cache
+
+    # The daemon's environment changes between commands
+    settings = _settings()
+
+    with _cache_lock:
+        if _cache is None or _cache[0] != settings:
+            _cache = (settings, _configure(*settings))
+
+        return _cache[1] or None
+
+
+def set_cache(action_cache: ActionCache | None):
+    """Use the given cache, or none at all, instead of the configured one."""
+    global _cache
+
+    with _cache_lock:
+        _cache = (_settings(), action_cache or False)
+
+
+def run(key: str, outputs: list[Path | str], action: Callable[[], Any], root: Path | None = None) -> bool:
+    """Run the action through the action cache, if one is configured.  Returns
+    true if the outputs were restored instead."""
+    action_cache = cache()
+    if action_cache is None:
+        action()
+        return False
+
+    return action_cache.run(key, outputs, action, root)
+
+
+async def run_async(key: str, outputs: list[Path | str], action: Callable[[], Awaitable[Any]],
+                    root: Path | None = None) -> bool:
+    """Like run, for an async action."""
+    action_cache = cache()
+    if action_cache is None:
+        await action()
+        return False
+
+    return await action_cache.run_async(key, outputs, action, root)
+
+
+def action_key(*parts: Any) -> str:
+    """Combine everything that goes into an action into a single key."""
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        h.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\0")
+
+    return h.hexdigest()
+
+
+def tool_version(*command: str) -> str:
+    """Ask a tool for its version, to make it part of the keys for the actions
+    it runs.  Asks once per process, unless the tool on the PATH changes."""
+    executable = shutil.which(command[0])
+    if executable is None:
+        return ""
+
+    try:
+        mtime = os.stat(executable).st_mtime_ns
+    except OSError:
+        mtime = 0
+
+    return _probe((executable, *command[1:]), mtime)
+
+
+@lru_cache(maxsize=None)
+def _probe(command: tuple[str, ...], mtime: int) -> str:
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=30)
+        return (result.stdout or result.stderr).strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def _settings() -> tuple[str, str, str]:
+    return tuple(os.getenv(name, "") for name in ("WRIGHT_CACHE", "WRIGHT_CACHE_SIZE", "WRIGHT_CACHE_COMPRESS"))
+
+
+def _configure(setting: str, size: str, compress: str) -> ActionCache | bool:
+    setting = setting.strip()
+    if setting.casefold() in ("", "0", "off", "false", "no"):
+        return False
+
+    if setting.startswith(("http://", "https://")):
+        return ActionCache(HttpBackend(setting))
+
+    if setting.casefold() in ("1", "on", "true", "yes", "local"):
+        root = state_dir() / "cache" / "actions"
+    else:
+        root = Path(setting).expanduser().absolute()
+
+    return ActionCache(LocalBackend(root, _parse_size(size), compress.casefold() == "true"))
+
+
+def _parse_size(value: str | None) -> int:
+    if not value:
+        return DEFAULT_MAX_BYTES
+
+    try:
+        return parse_size(value)
+    except ValueError:
+        logging.warning(f"Invalid WRIGHT_CACHE_SIZE {value}, using the default")
+        return DEFAULT_MAX_BYTES
+
+
+def _clone_or_copy(source: Path, dest: Path):
+    """Reflink the file, which copies on write, or if that isn't supported
+    copy it."""
+    try:
+        with open(source, "rb") as src, open(dest, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        return
+    except OSError:
+        _unlink(dest)
+
+    shutil.copyfile(source, dest)
+
+
+def _digest_file(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=20)).hexdigest()
+
+
+def _digest_bytes(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def _relative(path: Path, root: Path) -> str:
+    try:
+        return path.relative_to(root).as_posix()
+    except ValueError:
+        return str(path)
+
+
+def _write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    partial.write_bytes(data)
+    os.replace(partial, path)
+
+
+def _touch(path: Path):
+    """Mark the entry as recently used, for eviction."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _unlink(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
@@ -1,41 +1,84 @@
 import inspect
 import logging
 import os
+import sys
 from functools import wraps
 from pathlib import Path
 from typing import Callable
 
+from . import process, scheduler, trace
 from .proojekt import Proojekt
-from .support import load_file, current_path
+from .support import IncludedModule, current_path
 
 
 def task(func):
-    """Mark a function as a build task and inject the context."""
-    caller_frame = inspect.stack()[1]
-    caller_filename = caller_frame.filename
+    """
+    Mark a function as a build task and inject the context.
+
+    Tasks may be `async def`.  Called from synchronous code, like the
+    scheduler, an async task runs to completion with asyncio.run; called from
+    a running event loop, it returns a coroutine for the caller to await.
+    """
+    # inspect.stack() would read the source of every frame on the stack
+    caller_filename = sys._getframe(1).f_code.co_filename
     working_dir = Path(os.path.abspath(caller_filename)).parent
+    name = _task_name(func)
 
-    @wraps(func)
-    def wrapper(*args, **kwargs):
+    def enter(args, kwargs):
         ctx = _get_ctx(args, kwargs)
         current_dir = None
 
         if _accepts_ctx_param(func):
             if not ctx:
-                kwargs["ctx"] = Proojekt(working_dir)
+                ctx = kwargs["ctx"] = Proojekt(working_dir)
             else:
                 # "Push" the working dir of this task, so we call commands from
                 # the right place.
                 current_dir = ctx.working_dir
                 ctx.working_dir = working_dir
 
-        results = func(*args, **kwargs)
+        return ctx, current_dir, process.current_task.set(name)
+
+    def leave(ctx, current_dir, token):
+        process.current_task.reset(token)
 
         # Reset the context's working dir
         if ctx and current_dir:
             ctx.working_dir = current_dir
 
-        return results
+        tasks = scheduler.current()
+        if ctx and tasks:
+            tasks.watched(wrapper, ctx.sources, ctx.excludes)
+
+    if inspect.iscoroutinefunction(func):
+        async def run_async(*args, **kwargs):
+            state = enter(args, kwargs)
+            try:
+                with trace.task(name):
+                    result = await func(*args, **kwargs)
+                if state[0]:
+                    state[0].finished()
+                return result
+            finally:
+                leave(*state)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return _run_coroutine(run_async(*args, **kwargs))
+
+        return wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        state = enter(args, kwargs)
+        try:
+            with trace.task(name):
+                result = func(*args, **kwargs)
+            if state[0]:
+                state[0].finished()
+            return result
+        finally:
+            leave(*state)
 
     return wrapper
 
@@ -44,8 +87,7 @@ def sources(glob: str):
     """Mark a function as a build source."""
 
     def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
+        def before(args, kwargs):
             if _accepts_ctx_param(func):
                 ctx = _get_ctx(args, kwargs)
                 if ctx is None:
@@ -56,24 +98,53 @@ def sources(glob: str):
                 else:
                     ctx.watch(str(Path(ctx.working_dir / glob).absolute()))
 
-            return func(*args, **kwargs)
-
-        return wrapper
+        return _wrap(func, before)
 
     return decorator
 
 
 def depends(task_func: Callable):
-    """Indicate the task depends on the given task, so run this task first."""
-
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            task_func_kwargs = _may_include_kwargs(task_func, kwargs)
-            task_func(*args, **task_func_kwargs)
+    """
+    Indicate the task depends on the given task, so run this task first.
 
-            return func(*args, **kwargs)
+    Dependencies are run through the scheduler:  each task runs at most once
+    per invocation, however many tasks depend on it, and with `wright -j N`
+    independent dependencies run at the same time.  Each dependency gets its
+    own context, sharing the included modules, so tasks running side by side
+    don't overwrite each other's sources or target.
+    """
 
+    def decorator(func):
+        def run_dependencies(args, kwargs):
+            def invoke(dependency: Callable):
+                dep_args = [arg.fork() if type(arg) is Proojekt else arg for arg in args]
+                dep_kwargs = {
+                    k: v.fork() if type(v) is Proojekt else v
+                    for k, v in _may_include_kwargs(dependency, kwargs).items()
+                }
+                return dependency(*dep_args, **dep_kwargs)
+
+            with trace.span(f"depends {func.__name__}", "depends"), scheduler.session() as tasks:
+                tasks.run(wrapper.__wright_depends__, invoke)
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                import asyncio
+
+                # Leave the event loop free while the dependencies run
+                await asyncio.to_thread(run_dependencies, args, kwargs)
+                return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                run_dependencies(args, kwargs)
+                return func(*args, **kwargs)
+
+        # Stacked @depends accumulate, outermost first, so the outermost
+        # wrapper schedules all of them together.  functools.wraps copies this
+        # to any decorators applied on top, including @task.
+        wrapper.__wright_depends__ = [task_func, *scheduler.dependencies(func)]
         return wrapper
 
     return decorator
@@ -83,17 +154,14 @@ def target(name: str):
     """Set the target output for the build process."""
 
     def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
+        def before(args, kwargs):
             ctx = _get_ctx(args, kwargs)
             if ctx is None:
                 raise Exception("Please declare a task before setting the target")
 
             ctx.target = name
 
-            return func(*args, **kwargs)
-
-        return wrapper
+        return _wrap(func, before)
 
     return decorator
 
@@ -104,13 +172,12 @@ def include(path: Path | str, name: str = None):
     default uses the name of the path containing the build file as the name of
     the module in the Project, but that can be overridden using the name.
 
-    If you provide a module name, it will attach the build to sys.modules with
-    the given name."
+    The build file is loaded the first time the task uses the module, and
+    only once per run, however many tasks include it.
     """
 
     def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
+        def before(args, kwargs):
             ctx = _get_ctx(args, kwargs)
             if ctx is None:
                 raise Exception("Please declare a task before including other projects")
@@ -118,21 +185,60 @@ def include(path: Path | str, name: str = None):
             p = Path(path)
             if p.is_dir():
                 module_name = name or p.name
-                module, _ = load_file(p / "BUILD.py", module_name=module_name, skip_sys_modules=True)
+                build_file = p / "BUILD.py"
             else:
                 module_name = name or p.parent.name
-                module, _ = load_file(p, module_name=module_name, skip_sys_modules=True)
+                build_file = p
 
             if module_name in ctx:
-                logging.warning(f"You are replacing {module_name} in the build context")
+                existing = ctx[module_name]
+                if not (isinstance(existing, IncludedModule) and existing._build_file == build_file):
+                    logging.warning(f"You are replacing {module_name} in the build context")
+
+            ctx[module_name] = IncludedModule(build_file, module_name)
+
+        return _wrap(func, before)
+
+    return decorator
 
-            ctx[module_name] = module
 
+def _task_name(func: Callable) -> str:
+    """Name the task for traces, with the included module it comes from."""
+    module = getattr(func, "__module__", None)
+    if module in (None, "buildfile"):
+        return func.__name__
+
+    return f"{module}.{func.__name__}"
+
+
+def _wrap(func: Callable, before: Callable[[tuple, dict], None]) -> Callable:
+    """Wrap the function to call `before` with its arguments first.  The
+    wrapper is async if the function is, so @task knows to await it."""
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            before(args, kwargs)
+            return await func(*args, **kwargs)
+    else:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            before(args, kwargs)
             return func(*args, **kwargs)
 
-        return wrapper
+    return wrapper
 
-    return decorator
+
+def _run_coroutine(coro):
+    """Run an async task to completion, unless called from a running event
+    loop, in which case the caller awaits it."""
+    import asyncio
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    return coro
 
 
 def _accepts_ctx_param(func: Callable):
@@ -0,0 +1,251 @@
+import ast
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from .support import state_dir
+
+# Bump when the shape of the cached results changes
+_CACHE_VERSION = b"2"
+
+
+class TaskInfo:
+    """What a build file says about one of its tasks, without running it."""
+
+    def __init__(self, name: str, doc: str | None = None):
+        self.name = name
+        self.doc = doc
+        self.depends: list[str] = []
+        self.sources: list[str] = []
+        self.target: str | None = None
+        self.includes: list[tuple[str, str | None]] = []
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "doc": self.doc,
+            "depends": self.depends,
+            "sources": self.sources,
+            "target": self.target,
+            "includes": [list(include) for include in self.includes],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> TaskInfo:
+        info = cls(data["name"], data.get("doc"))
+        info.depends = data.get("depends", [])
+        info.sources = data.get("sources", [])
+        info.target = data.get("target")
+        info.includes = [tuple(include) for include in data.get("includes", [])]
+        return info
+
+
+def discover(path: Path | str, module_name: str | None = None, _seen: set[str] | None = None) -> dict:
+    """
+    Find the tasks in a build file, and the build files it includes, by
+    parsing them rather than running them.  Returns a dictionary with the
+    file's path, its module name, its tasks and the results for each included
+    build file, suitable for printing or dumping as JSON.
+
+    Only includes given as string literals, or as `current_path(__file__)`
+    joined with a literal, can be followed.
+    """
+    path = Path(path).absolute()
+    _seen = _seen if _seen is not None else set()
+    _seen.add(str(path))
+
+    result = {"path": str(path), "module": module_name, "tasks": [], "includes": []}
+
+    tasks = _parse_cached(path)
+    if tasks is None:
+        return result
+
+    result["tasks"] = [task.to_dict() for task in tasks]
+
+    for task in tasks:
+        for include_path, name in task.includes:
+            p = Path(include_path)
+            build_file = p / "BUILD.py" if p.is_dir() else p
+            module = name or (p.name if p.is_dir() else p.parent.name)
+
+            if str(build_file.absolute()) in _seen:
+                continue
+
+            result["includes"].append(discover(build_file, module, _seen))
+
+    return result
+
+
+def format_tasks(result: dict, indent: str = "") -> str:
+    """Format the discovered tasks as text, one task per line followed by its
+    dependencies, sources and target, then the included build files."""
+    lines = []
+
+    if result["module"]:
+        lines.append(f"{indent}[{result['module']}] {result['path']}")
+        indent += "  "
+
+    width = max((len(task["name"]) for task in result["tasks"]), default=0)
+    for task in result["tasks"]:
+        doc = (task["doc"] or "").strip().splitlines()
+        lines.append(f"{indent}{task['name'].ljust(width)}  {doc[0] if doc else ''}".rstrip())
+
+        if task["depends"]:
+            lines.append(f"{indent}  depends: {', '.join(task['depends'])}")
+        if task["sources"]:
+            lines.append(f"{indent}  sources: {', '.join(task['sources'])}")
+        if task["target"]:
+            lines.append(f"{indent}  target:  {task['target']}")
+
+    for include in result["includes"]:
+        lines.append(format_tasks(include, indent))
+
+    return "\n".join(lines)
+
+
+def print_tasks(path: Path | str, as_json: bool = False):
+    """Handle `wright tasks`."""
+    result = discover(path)
+    if as_json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(format_tasks(result))
+
+
+def parse(source: str, path: Path) -> list[TaskInfo]:
+    """Find the functions decorated with @task in the source of a build file."""
+    tree = ast.parse(source, filename=str(path))
+    tasks = []
+
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+
+        if not any(_decorator_name(d) == "task" for d in node.decorator_list):
+            continue
+
+        info = TaskInfo(node.name, ast.get_docstring(node))
+
+        for decorator in node.decorator_list:
+            if not isinstance(decorator, ast.Call):
+                continue
+
+            args = decorator.args
+            match _decorator_name(decorator):
+                case "depends" if args:
+                    info.depends.append(ast.unparse(args[0]))
+                case "sources" if args:
+                    info.sources.append(_literal(args[0]) or ast.unparse(args[0]))
+                case "target" if args:
+                    info.target = _literal(args[0]) or ast.unparse(args[0])
+                case "include" if args:
+                    include = _include_path(args[0], path)
+                    if include is None:
+                        logging.info(f"Can't follow the include {ast.unparse(args[0])} in {path}")
+                        continue
+
+                    name = args[1] if len(args) > 1 else next(
+                        (kw.value for kw in decorator.keywords if kw.arg == "name"), None)
+                    info.includes.append((include, _literal(name) if name is not None else None))
+
+        tasks.append(info)
+
+    return tasks
+
+
+def _parse_cached(path: Path) -> list[TaskInfo] | None:
+    """Parse the build file, reusing the results cached for the same contents.
+    Each build file has one cache entry, named for its path and holding a
+    hash of the contents it was parsed from, so an edited build file
+    replaces its old entry."""
+    try:
+        source = path.read_bytes()
+    except OSError:
+        logging.warning(f"No build file found at {path}")
+        return None
+
+    name = hashlib.blake2b(_CACHE_VERSION + os.fsencode(path), digest_size=20).hexdigest()
+    digest = hashlib.blake2b(_CACHE_VERSION + os.fsencode(path) + b"\0" + source, digest_size=20).hexdigest()
+    cached = state_dir() / "cache" / "tasks" / f"{name}.json"
+
+    try:
+        entry = json.loads(cached.read_text(encoding="utf-8"))
+        if entry["digest"] == digest:
+            return [TaskInfo.from_dict(task) for task in entry["tasks"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    try:
+        tasks = parse(source.decode("utf-8"), path)
+    except (SyntaxError, UnicodeDecodeError) as err:
+        logging.warning(f"Unable to parse {path}: {err}")
+        return None
+
+    try:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        partial = cached.with_suffix(f".{os.getpid()}.tmp")
+        partial.write_text(json.dumps({"digest": digest, "tasks": [task.to_dict() for task in tasks]}),
+                           encoding="utf-8")
+        os.replace(partial, cached)
+    except OSError as err:
+        logging.debug(f"Unable to cache the tasks in {path}: {err}")
+
+    return tasks
+
+
+def _decorator_name(node: ast.expr) -> str | None:
+    """The name of the decorator, whether written `task`, `wright.task` or
+    called like `depends(...)`."""
+    if isinstance(node, ast.Call):
+        node = node.func
+
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+
+    return None
+
+
+def _literal(node: ast.expr) -> str | None:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+
+    return None
+
+
+def _include_path(node: ast.expr, build_file: Path) -> str | None:
+    """Work out the path an @include refers to, for the simple cases:  a
+    string, or current_path(__file__) / Path(__file__).parent joined with
+    strings.  Relative strings are relative to the current directory, just as
+    when the include runs."""
+    literal = _literal(node)
+    if literal is not None:
+        return literal
+
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div):
+        left = _include_path(node.left, build_file)
+        right = _literal(node.right)
+        if left is not None and right is not None:
+            return str(Path(left) / right)
+        return None
+
+    if _is_file_dir(node):
+        return str(build_file.parent)
+
+    return None
+
+
+def _is_file_dir(node: ast.expr) -> bool:
+    """Is this `current_path(__file__)` or `Path(__file__).parent`?"""
+    def is_file_arg(call: ast.expr) -> bool:
+        return (isinstance(call, ast.Call) and len(call.args) == 1
+                and isinstance(call.args[0], ast.Name) and call.args[0].id == "__file__")
+
+    if is_file_arg(node) and _decorator_name(node) == "current_path":
+        return True
+
+    return (isinstance(node, ast.Attribute) and node.attr == "parent"
+            and is_file_arg(node.value) and _decorator_name(node.value) == "Path")
@@ -0,0 +1,267 @@
+import hashlib
+import os
+import sqlite3
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .support import check_dependencies, state_dir
+from .walker import match_files
+
+# Files at least this large are hashed on the thread pool; hashlib releases the
+# GIL while it works, so big binaries and assets hash in parallel.
+LARGE_FILE = 1024 * 1024
+
+# Files modified this recently may still be changing within the resolution of
+# the filesystem's timestamps, so their hashes aren't remembered.
+RACY_SECONDS = 2
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class StateStore:
+    """
+    Persists what Wright knows about the files it watches in a small SQLite
+    database under .wright/.  For each file it remembers the size, modification
+    time and content hash, so a file is only re-hashed when its size or mtime
+    change.  For each target it remembers the combined digest of the inputs the
+    target was last built from.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        # Rows already read, so a long-running process (the daemon, or watch
+        # mode) doesn't go back to the database for files it has seen.
+        self._memo: dict[str, tuple[int, int, str]] = {}
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS targets (name TEXT PRIMARY KEY, digest TEXT)"
+        )
+
+    def files(self, paths: list[str]) -> dict[str, tuple[int, int, str]]:
+        """Look up the remembered (size, mtime_ns, digest) of the given files."""
+        found = {}
+        with self._lock:
+            missing = []
+            for path in paths:
+                if path in self._memo:
+                    found[path] = self._memo[path]
+                else:
+                    missing.append(path)
+
+            # Stay well under SQLite's limit on bound parameters
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT path, size, mtime_ns, digest FROM files WHERE path IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for path, size, mtime_ns, digest in rows:
+                    found[path] = self._memo[path] = (size, mtime_ns, digest)
+
+        return found
+
+    def put_files(self, rows: list[tuple[str, int, int, str]]):
+        """Remember the (path, size, mtime_ns, digest) of freshly hashed files."""
+        if not rows:
+            return
+
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", rows)
+            for path, size, mtime_ns, digest in rows:
+                self._memo[path] = (size, mtime_ns, digest)
+
+    def target(self, name: str) -> str | None:
+        """The digest of the inputs the target was last built from, if known."""
+        with self._lock:
+            row = self._db.execute("SELECT digest FROM targets WHERE name = ?", (name,)).fetchone()
+
+        return row[0] if row else None
+
+    def set_target(self, name: str, digest: str):
+        """Record the digest of the inputs the target was just built from."""
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO targets VALUES (?, ?)", (name, digest))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def store() -> StateStore:
+    """Return the state store for this process, opening it on first use, or
+    again if the state directory has changed, e.g. for a daemon request from
+    another project."""
+    global _store
+
+    path = state_dir() / "state.db"
+    with _store_lock:
+        if _store is None or _store.path != path:
+            if _store is not None:
+                _store.close()
+            _store = StateStore(path)
+
+        return _store
+
+
+def hash_file(path: str | Path) -> str:
+    """Hash the contents of a single file."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, _hasher).hexdigest()
+
+
+def hash_files(files: list[Path], state: StateStore | None = None) -> dict[str, str]:
+    """
+    Hash the contents of the files, returning a digest for each path.  Files
+    whose size and mtime match what the state store remembers aren't read at
+    all.  Files that vanish while we work are left out.
+    """
+    state = state or store()
+    paths = [str(file) for file in files]
+    known = state.files(paths)
+
+    digests: dict[str, str] = {}
+    pending: list[tuple[str, os.stat_result]] = []
+
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+
+        if not _is_file(st):
+            continue
+
+        remembered = known.get(path)
+        if remembered and remembered[0] == st.st_size and remembered[1] == st.st_mtime_ns:
+            digests[path] = remembered[2]
+        else:
+            pending.append((path, st))
+
+    small = [(path, st) for path, st in pending if st.st_size < LARGE_FILE]
+    large = [(path, st) for path, st in pending if st.st_size >= LARGE_FILE]
+
+    hashed: list[tuple[str, os.stat_result, str]] = []
+
+    if large:
+        with ThreadPoolExecutor(max_workers=min(len(large), os.cpu_count() or 1)) as pool:
+            futures = [(path, st, pool.submit(_try_hash, path)) for path, st in large]
+            for path, st in small:
+                hashed.append((path, st, _try_hash(path)))
+            for path, st, future in futures:
+                hashed.append((path, st, future.result()))
+    else:
+        for path, st in small:
+            hashed.append((path, st, _try_hash(path)))
+
+    racy = time.time_ns() - RACY_SECONDS * 1_000_000_000
+    rows = []
+    for path, st, digest in hashed:
+        if digest is None:
+            continue
+
+        digests[path] = digest
+        if st.st_mtime_ns < racy:
+            rows.append((path, st.st_size, st.st_mtime_ns, digest))
+
+    state.put_files(rows)
+    return digests
+
+
+def fingerprint(globs: list[str],
+                root: Path | None = None,
+                state: StateStore | None = None,
+                excludes: list[str] | None = None) -> str:
+    """
+    Compute a single digest over the contents of every file matching the
+    globs.  Paths under the root (the current directory by default) are
+    hashed relative to it, so the same sources checked out somewhere else
+    produce the same fingerprint.
+    """
+    root = Path(root or os.getcwd()).absolute()
+
+    files = sorted(file.absolute() for file in match_files(globs, excludes))
+    digests = hash_files(files, state)
+
+    h = _hasher()
+    for path in sorted(digests):
+        h.update(_relative(path, root).encode("utf-8"))
+        h.update(b"\0")
+        h.update(digests[path].encode("ascii"))
+        h.update(b"\n")
+
+    return h.hexdigest()
+
+
+def changed(globs: list[str],
+            target: str | Path | None,
+            state: StateStore | None = None,
+            excludes: list[str] | None = None) -> tuple[bool, str | None]:
+    """
+    Have the contents of the files matching the globs changed since the target
+    was last built?  Returns whether the target should be rebuilt, along with
+    the fingerprint to record once it has been.
+
+    Targets Wright hasn't fingerprinted yet fall back to comparing timestamps;
+    if those say the target is current, the fingerprint is recorded right away
+    so the next check compares contents.
+    """
+    if target is None:
+        return True, None
+
+    if not Path(target).exists():
+        return True, fingerprint(globs, state=state, excludes=excludes)
+
+    state = state or store()
+    name = str(Path(target).absolute())
+    digest = fingerprint(globs, state=state, excludes=excludes)
+    previous = state.target(name)
+
+    if previous is None:
+        if check_dependencies(globs, target, excludes):
+            return True, digest
+
+        state.set_target(name, digest)
+        return False, digest
+
+    return previous != digest, digest
+
+
+def record(target: str | Path, digest: str, state: StateStore | None = None):
+    """Remember the fingerprint the target was built from."""
+    state = state or store()
+    state.set_target(str(Path(target).absolute()), digest)
+
+
+def _hasher():
+    return hashlib.blake2b(digest_size=20)
+
+
+def _try_hash(path: str) -> str | None:
+    try:
+        return hash_file(path)
+    except (FileNotFoundError, IsADirectoryError, PermissionError):
+        return None
+
+
+def _is_file(st: os.stat_result) -> bool:
+    return stat.S_ISREG(st.st_mode)
+
+
+def _relative(path: str, root: Path) -> str:
+    try:
+        return Path(path).relative_to(root).as_posix()
+    except ValueError:
+        return path
@@ -0,0 +1,346 @@
+import collections
+import contextvars
+import os
+import selectors
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from . import scheduler, trace
+from .support import state_dir
+
+# Lines of output kept for the error when a command fails
+TAIL_LINES = 50
+
+# The most recent commands run, for reporting
+HISTORY_SIZE = 1000
+
+# The task running in this context, whose name prefixes its commands' output
+current_task: contextvars.ContextVar[str | None] = contextvars.ContextVar("wright_task", default=None)
+
+# Every command run, most recent last
+history: collections.deque[Result] = collections.deque(maxlen=HISTORY_SIZE)
+
+_terminal = threading.Lock()
+_logs_lock = threading.Lock()
+_logs: set[str] = set()
+
+
+class Result:
+    """What happened when a command ran."""
+
+    def __init__(self, argv: list[str], exit_code: int, duration: float, stdout: str = "",
+                 tail: list[str] | None = None, log: Path | None = None, task: str | None = None):
+        self.argv = argv
+        self.exit_code = exit_code
+        self.duration = duration
+        self.stdout = stdout
+        self.tail = tail or []
+        self.log = log
+        self.task = task
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_code == 0
+
+    def __str__(self) -> str:
+        return self.stdout
+
+
+class ProcessError(Exception):
+    """Raised when a command exits with a non-zero status.  The message ends
+    with the last lines the command printed."""
+
+    def __init__(self, result: Result):
+        self.result = result
+
+        message = f"{' '.join(result.argv)} exited with status {result.exit_code}"
+        if result.tail:
+            message += ":\n" + "\n".join(result.tail)
+        if result.log:
+            message += f"\n(full output in {result.log})"
+
+        super().__init__(message)
+
+
+class _Output:
+    """
+    Sends a command's output to the terminal, a bounded buffer of the most
+    recent lines, and the task's log file.  Output is handled in chunks as
+    it's read rather than line by line.  How it's shown depends on the mode:
+    "prefix" writes each chunk as it arrives with the task's name before each
+    line, "group" holds everything until the command finishes so commands
+    running side by side don't interleave, and "quiet" shows nothing; the
+    last lines are still reported if the command fails.
+    """
+
+    def __init__(self, argv: list[str], task: str | None, mode: str):
+        self.task = task
+        self.mode = mode
+        self.tail: collections.deque[str] = collections.deque(maxlen=TAIL_LINES)
+        self.prefix = f"[{task}]: " if task else ""
+        self._partial = b""
+        self._group: list[str] = []
+        self.log_path, self._log = _open_log(task, argv)
+
+    def feed(self, data: bytes):
+        if self._log:
+            self._log.write(data)
+
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        self._lines([line.decode("utf-8", errors="replace").rstrip("\r") for line in lines])
+
+    def close(self, result: Result):
+        if self._partial:
+            self._lines([self._partial.decode("utf-8", errors="replace").rstrip("\r")])
+            self._partial = b""
+
+        if self._group:
+            _write("".join(self._group))
+            self._group = []
+
+        if self._log:
+            self._log.write(f"# exit {result.exit_code} after {result.duration:.3f}s\n".encode("utf-8"))
+            self._log.close()
+
+    def _lines(self, lines: list[str]):
+        if not lines:
+            return
+
+        self.tail.extend(lines)
+        if self.mode == "quiet":
+            return
+
+        text = "".join(self.prefix + line + "\n" for line in lines)
+        if self.mode == "group":
+            self._group.append(text)
+        else:
+            _write(text)
+
+
+def run(*argv: str | Path,
+        cwd: Path | str | None = None,
+        env: dict[str, str] | None = None,
+        input: str | bytes | None = None,
+        capture: bool = False,
+        check: bool = True,
+        interactive: bool = False) -> Result:
+    """
+    Run a command and wait for it to finish.  Its output is shown as it runs,
+    labelled with the task running it, and saved in .wright/logs/<task>.log.
+
+    With capture, the command's stdout is returned in the result rather than
+    shown, and only its stderr is shown.  With interactive, the command
+    shares the terminal, for programs like the app being built.  Raises a
+    ProcessError if the command fails, unless check is false.
+    """
+    argv = [str(arg) for arg in argv]
+    task = current_task.get()
+
+    with trace.span(" ".join([os.path.basename(argv[0]), *argv[1:2]]), "process", argv=argv):
+        if interactive:
+            result = _run_interactive(argv, cwd, env, task)
+        else:
+            result = _run_piped(argv, cwd, env, input, capture, task)
+
+    history.append(result)
+
+    if check and not result.ok:
+        raise ProcessError(result)
+
+    return result
+
+
+async def run_async(*argv: str | Path,
+                    cwd: Path | str | None = None,
+                    env: dict[str, str] | None = None,
+                    input: str | bytes | None = None,
+                    capture: bool = False,
+                    check: bool = True) -> Result:
+    """
+    Like run, but awaitable, using asyncio's subprocesses so several commands
+    can run at once from a single task, e.g. with asyncio.gather.  Output is
+    handled the same way.
+    """
+    import asyncio
+
+    argv = [str(arg) for arg in argv]
+    task = current_task.get()
+    start = time.perf_counter()
+
+    with trace.span(" ".join([os.path.basename(argv[0]), *argv[1:2]]), "process", argv=argv):
+        output = _Output(argv, task, output_mode(concurrent=True))
+        stdout: list[bytes] = []
+
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *argv,
+                cwd=cwd,
+                env=env,
+                stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE if capture else asyncio.subprocess.STDOUT,
+            )
+        except OSError as err:
+            result = Result(argv, 127, 0.0, tail=[str(err)], log=output.log_path, task=task)
+            output.close(result)
+        else:
+            async def pump(stream, sink):
+                while data := await stream.read(64 * 1024):
+                    sink(data)
+
+            async def feed():
+                data = input.encode("utf-8") if isinstance(input, str) else input
+                try:
+                    proc.stdin.write(data)
+                    await proc.stdin.drain()
+                    proc.stdin.close()
+                except OSError:
+                    pass
+
+            pumps = [pump(proc.stdout, stdout.append if capture else output.feed)]
+            if capture:
+                pumps.append(pump(proc.stderr, output.feed))
+            if input is not None:
+                pumps.append(feed())
+
+            try:
+                await asyncio.gather(*pumps)
+                exit_code = await proc.wait()
+            except BaseException:
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+                raise
+
+            result = Result(argv, exit_code, time.perf_counter() - start,
+                            b"".join(stdout).decode("utf-8", errors="replace"), list(output.tail), output.log_path, task)
+            output.close(result)
+
+    history.append(result)
+
+    if check and not result.ok:
+        raise ProcessError(result)
+
+    return result
+
+
+def output_mode(concurrent: bool = False) -> str:
+    """How command output is shown:  WRIGHT_OUTPUT may be "prefix", "group" or
+    "quiet".  Defaults to grouping when tasks run in parallel, or for commands
+    run with run_async, which likely run alongside others."""
+    mode = os.getenv("WRIGHT_OUTPUT", "").casefold()
+    if mode in ("prefix", "group", "quiet"):
+        return mode
+
+    tasks = scheduler.current()
+    return "group" if concurrent or (tasks and tasks.jobs > 1) else "prefix"
+
+
+def reset_logs():
+    """Start new log files for the next run's tasks, rather than adding to
+    the ones already written in this process."""
+    with _logs_lock:
+        _logs.clear()
+
+
+def _run_piped(argv: list[str], cwd, env, input, capture: bool, task: str | None) -> Result:
+    start = time.perf_counter()
+    output = _Output(argv, task, output_mode())
+    stdout: list[bytes] = []
+
+    try:
+        proc = subprocess.Popen(
+            argv,
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE if capture else subprocess.STDOUT,
+        )
+    except OSError as err:
+        result = Result(argv, 127, 0.0, tail=[str(err)], log=output.log_path, task=task)
+        output.close(result)
+        return result
+
+    if input is not None:
+        data = input.encode("utf-8") if isinstance(input, str) else input
+        writer = threading.Thread(target=_feed, args=(proc.stdin, data), daemon=True)
+        writer.start()
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(proc.stdout, selectors.EVENT_READ, stdout.append if capture else output.feed)
+        if capture:
+            selector.register(proc.stderr, selectors.EVENT_READ, output.feed)
+
+        try:
+            while selector.get_map():
+                for key, _ in selector.select():
+                    data = os.read(key.fd, 64 * 1024)
+                    if data:
+                        key.data(data)
+                    else:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            exit_code = proc.wait()
+
+    result = Result(argv, exit_code, time.perf_counter() - start, b"".join(stdout).decode("utf-8", errors="replace"),
+                    list(output.tail), output.log_path, task)
+    output.close(result)
+    return result
+
+
+def _run_interactive(argv: list[str], cwd, env, task: str | None) -> Result:
+    start = time.perf_counter()
+    try:
+        proc = subprocess.Popen(argv, cwd=cwd, env=env)
+    except OSError as err:
+        return Result(argv, 127, 0.0, tail=[str(err)], task=task)
+
+    try:
+        exit_code = proc.wait()
+    except KeyboardInterrupt:
+        # The program got the interrupt too; let it finish shutting down
+        exit_code = proc.wait()
+
+    return Result(argv, exit_code, time.perf_counter() - start, task=task)
+
+
+def _feed(pipe, data: bytes):
+    try:
+        pipe.write(data)
+        pipe.close()
+    except OSError:
+        pass
+
+
+def _open_log(task: str | None, argv: list[str]):
+    """Open the task's log file, starting it afresh the first time the task
+    runs a command in this run."""
+    name = (task or "wright").replace(os.sep, "_")
+    path = state_dir() / "logs" / f"{name}.log"
+
+    with _logs_lock:
+        mode = "ab" if name in _logs else "wb"
+        _logs.add(name)
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        log = open(path, mode)
+        log.write(f"# {' '.join(argv)}\n".encode("utf-8"))
+        return path, log
+    except OSError:
+        return None, None
+
+
+def _write(text: str):
+    with _terminal:
+        sys.stdout.write(text)
+        sys.stdout.flush()
@@ -2,7 +2,8 @@ from types import ModuleType
 from pathlib import Path
 import os
 
-from .support import check_dependencies
+from . import trace
+from .support import check_dependencies, is_env
 
 
 class Proojekt:
@@ -10,10 +11,14 @@ class Proojekt:
 
     def __init__(self, working_dir: Path):
         self.sources: list[str] = ["BUILD.py"]
+        self.excludes: list[str] = []
         self.target: str | None = None
         self.working_dir: Path = working_dir
         self._modules: dict[str, ModuleType] = {}
         self.force = os.getenv("FORCE", False)
+        self.fingerprints: bool = not is_env("WRIGHT_MTIME")
+        self._fingerprint: str | None = None
+        self._target_mtime: int | None = None
 
     def __setitem__(self, module_name: str, module: ModuleType):
         """Set a module reference on the project."""
@@ -34,6 +39,17 @@ class Proojekt:
         """Has the module been loaded into the project?"""
         return module_name in self._modules
 
+    def fork(self) -> Proojekt:
+        """Create a fresh context for a dependent task.  The new context shares
+        the loaded modules and settings, but watches its own sources and builds
+        its own target."""
+        child = Proojekt(self.working_dir)
+        child._modules = self._modules
+        child.excludes = list(self.excludes)
+        child.force = self.force
+        child.fingerprints = self.fingerprints
+        return child
+
     def watch(self, glob: str):
         """Append a glob to watch for changes.  The files included by the glob
         will inform Wright whether or not to rebuild the binary."""
@@ -44,6 +60,65 @@ class Proojekt:
         to completely replace them."""
         self.sources = [glob]
 
+    def exclude(self, pattern: str):
+        """Skip files matching the pattern when looking for watched files.  Uses
+        .gitignore syntax:  a name like "vendor" matches at any depth, while a
+        relative path is relative to the working directory.  Files ignored by
+        .gitignore are always skipped."""
+        if "/" in pattern.rstrip("/") and not Path(pattern).is_absolute():
+            pattern = str(self.working_dir / pattern)
+
+        self.excludes.append(pattern)
+
     def should_run(self):
-        """Returns true if the watchable dependencies change."""
-        return check_dependencies(self.sources, self.target)
+        """Returns true if the watchable dependencies change.  By default
+        compares the contents of the watched files with those the target was
+        last built from; set WRIGHT_MTIME=true to compare timestamps instead.
+        The new fingerprint is recorded once the task rebuilds the target."""
+        if not self.fingerprints:
+            return check_dependencies(self.sources, self.target, self.excludes)
+
+        # The fingerprint engine pulls in sqlite3 and hashlib, so only import it
+        # when a task actually checks for changes.
+        from . import fingerprint
+
+        with trace.span("fingerprint", "check", target=str(self.target)):
+            changed, self._fingerprint = fingerprint.changed(self.sources, self.target, excludes=self.excludes)
+        self._target_mtime = _mtime(self.target)
+        return changed
+
+    def digest(self, *globs: str, excludes: list[str] | None = None) -> str:
+        """A digest of the contents of the watched files, plus any extra globs
+        relative to the working directory.  Identifies the inputs of a build
+        step for the action cache, so the step's own outputs should be left
+        out with the excludes, relative to the working directory."""
+        from . import fingerprint
+
+        extra = [str(self.working_dir / glob) for glob in globs]
+        skip = [str(self.working_dir / exclude) for exclude in excludes or []]
+        return fingerprint.fingerprint(self.sources + extra, root=self.working_dir, excludes=self.excludes + skip)
+
+    def built(self):
+        """Call once the target has been built successfully, so the next call to
+        should_run compares against the files it was built from."""
+        if self.fingerprints and self.target and self._fingerprint:
+            from . import fingerprint
+
+            fingerprint.record(self.target, self._fingerprint)
+            self._fingerprint = None
+
+    def finished(self):
+        """Called by @task when the task returns.  Records the fingerprint if
+        the task rebuilt the target since checking should_run, for tasks that
+        don't call built themselves."""
+        if self._fingerprint and self.target:
+            modified = _mtime(self.target)
+            if modified is not None and modified != self._target_mtime:
+                self.built()
+
+
+def _mtime(path: str | Path | None) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns if path else None
+    except OSError:
+        return None
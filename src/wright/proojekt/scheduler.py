@@ -0,0 +1,211 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+_in_worker: contextvars.ContextVar[bool] = contextvars.ContextVar("wright_in_worker", default=False)
+
+
+class CyclicDependencyError(Exception):
+    """Raised when tasks depend on each other in a loop."""
+    pass
+
+
+class Scheduler:
+    """
+    Runs the graph of tasks declared with @depends.  Each task runs at most
+    once per scheduler, no matter how many other tasks depend on it, and tasks
+    whose dependencies have finished run concurrently on a pool of `jobs`
+    worker threads.
+    """
+
+    def __init__(self, jobs: int = 1):
+        self.jobs = max(1, jobs)
+        self._lock = threading.Lock()
+        self._futures: dict[Callable, Future] = {}
+        self._pool: ThreadPoolExecutor | None = None
+        self.sources: dict[Callable, tuple[list[str], list[str]]] = {}
+
+    def run(self, tasks: list[Callable], invoke: Callable[[Callable], Any]):
+        """
+        Run the tasks, and everything they depend on, in dependency order.
+        `invoke` is called with each task function to actually run it.  Raises
+        the first error any of the tasks raised.
+        """
+        order = graph(tasks)
+
+        # A task running on a worker already has its dependencies satisfied;
+        # anything left over it runs itself rather than waiting on the pool.
+        if self.jobs == 1 or _in_worker.get():
+            for task_func, _ in order:
+                self._run_inline(task_func, invoke)
+        else:
+            self._run_parallel(order, invoke)
+
+    def done(self, task_func: Callable, result: Any = None):
+        """Mark the task as having already run, so the scheduler skips it."""
+        with self._lock:
+            future = self._futures.setdefault(task_func, Future())
+
+        if not future.done():
+            future.set_result(result)
+
+    def watched(self, task_func: Callable, sources: list[str], excludes: list[str]):
+        """Remember the files the task watched, so `wright watch` knows which
+        tasks to run again when files change."""
+        with self._lock:
+            self.sources[task_func] = (list(sources), list(excludes))
+
+    def shutdown(self):
+        if self._pool:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _claim(self, task_func: Callable) -> tuple[bool, Future]:
+        """Returns true and a new future if this caller should run the task,
+        or false and the existing future if someone else already is."""
+        with self._lock:
+            future = self._futures.get(task_func)
+            if future is not None:
+                return False, future
+
+            future = Future()
+            self._futures[task_func] = future
+            return True, future
+
+    def _run_inline(self, task_func: Callable, invoke: Callable[[Callable], Any]):
+        claimed, future = self._claim(task_func)
+        if claimed:
+            _execute(future, task_func, invoke)
+
+        future.result()
+
+    def _run_parallel(self, order: list[tuple[Callable, list[Callable]]], invoke: Callable[[Callable], Any]):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="wright")
+
+        remaining = list(order)
+        waiting: set[Future] = set()
+        failure: BaseException | None = None
+
+        while remaining or waiting:
+            if failure is None:
+                for item in list(remaining):
+                    task_func, deps = item
+                    dep_futures = [self._futures.get(dep) for dep in deps]
+                    if not all(f is not None and f.done() for f in dep_futures):
+                        # Wait on dependencies another thread is running, too
+                        waiting.update(f for f in dep_futures if f is not None and not f.done())
+                        continue
+
+                    remaining.remove(item)
+                    claimed, future = self._claim(task_func)
+                    if claimed:
+                        ctx = contextvars.copy_context()
+                        self._pool.submit(ctx.run, _work, future, task_func, invoke)
+
+                    waiting.add(future)
+            else:
+                remaining.clear()
+
+            if not waiting:
+                if remaining:
+                    raise CyclicDependencyError(f"Unable to schedule {remaining[0][0].__name__}")
+                break
+
+            finished, _ = wait(waiting, return_when=FIRST_COMPLETED)
+            for future in finished:
+                waiting.discard(future)
+                if failure is None and future.exception() is not None:
+                    failure = future.exception()
+
+        if failure is not None:
+            raise failure
+
+
+_session: contextvars.ContextVar[Scheduler | None] = contextvars.ContextVar("wright_scheduler", default=None)
+
+
+def graph(tasks: list[Callable]) -> list[tuple[Callable, list[Callable]]]:
+    """
+    Walk the @depends declarations reachable from the tasks and return each
+    task with its direct dependencies, ordered so every task comes after the
+    tasks it depends on.  Ties keep the order the dependencies were declared.
+    """
+    order: list[tuple[Callable, list[Callable]]] = []
+    visited: set[Callable] = set()
+    visiting: list[Callable] = []
+
+    def visit(task_func: Callable):
+        if task_func in visited:
+            return
+
+        if task_func in visiting:
+            names = " -> ".join(t.__name__ for t in visiting + [task_func])
+            raise CyclicDependencyError(f"Tasks depend on each other: {names}")
+
+        visiting.append(task_func)
+        deps = dependencies(task_func)
+        for dep in deps:
+            visit(dep)
+        visiting.pop()
+
+        visited.add(task_func)
+        order.append((task_func, deps))
+
+    for task_func in tasks:
+        visit(task_func)
+
+    return order
+
+
+def dependencies(task_func: Callable) -> list[Callable]:
+    """The tasks declared with @depends on the given task, in declaration order."""
+    return list(getattr(task_func, "__wright_depends__", []))
+
+
+def current() -> Scheduler | None:
+    """The scheduler for the tasks running right now, if any."""
+    return _session.get()
+
+
+@contextmanager
+def session(jobs: int | None = None) -> Iterator[Scheduler]:
+    """
+    Run tasks with a scheduler.  Inside an existing session, reuses that
+    session's scheduler so each task still only runs once; otherwise starts a
+    new scheduler with `jobs` workers (defaulting to WRIGHT_JOBS, or 1).
+    """
+    active = _session.get()
+    if active is not None and jobs is None:
+        yield active
+        return
+
+    scheduler = Scheduler(jobs or default_jobs())
+    token = _session.set(scheduler)
+    try:
+        yield scheduler
+    finally:
+        _session.reset(token)
+        scheduler.shutdown()
+
+
+def default_jobs() -> int:
+    try:
+        return int(os.getenv("WRIGHT_JOBS", "1"))
+    except ValueError:
+        return 1
+
+
+def _work(future: Future, task_func: Callable, invoke: Callable[[Callable], Any]):
+    _in_worker.set(True)
+    _execute(future, task_func, invoke)
+
+
+def _execute(future: Future, task_func: Callable, invoke: Callable[[Callable], Any]):
+    try:
+        future.set_result(invoke(task_func))
+    except BaseException as err:
+        future.set_exception(err)
@@ -1,19 +1,78 @@
+import hashlib
+import importlib
+import importlib.machinery
 import importlib.util
 import logging
+import marshal
 import os
 import re
 import sys
+import threading
 from enum import Enum
 from pathlib import Path
 from types import ModuleType
 from typing import Any
 
+from . import trace
+from .walker import match_files
+
+
+# When true, load_file keeps each build module it loads and hands it back on
+# later calls until the file changes.  Set by the daemon, which serves many
+# commands from one process.
+reuse_modules = False
+
+_loaded: dict[tuple[str, str, bool], tuple[tuple[int, int], ModuleType]] = {}
+
+# Build files loaded through @include, by resolved path and module name, so
+# each is executed once per process however many tasks include it.
+_included: dict[tuple[str, str], tuple[tuple[int, int], ModuleType]] = {}
+_included_lock = threading.RLock()
+
 
 class InvalidVersionError(Exception):
     """The version defined in the BUILD.py does not match semantic versioning."""
     pass
 
 
+class CachedSourceLoader(importlib.machinery.SourceFileLoader):
+    """
+    Loads build files, keeping their compiled code in .wright/cache/code
+    instead of writing __pycache__ directories next to every BUILD.py.  Each
+    build file has one entry, named for its path and headed by a hash of its
+    contents, so an unchanged build file loads from the cache without being
+    compiled again and an edited one replaces its old entry.
+    """
+
+    def get_code(self, fullname: str):
+        path = self.get_filename(fullname)
+        source = self.get_data(path)
+
+        name = hashlib.blake2b(importlib.util.MAGIC_NUMBER + os.fsencode(path), digest_size=20).hexdigest()
+        digest = hashlib.blake2b(importlib.util.MAGIC_NUMBER + os.fsencode(path) + b"\0" + source,
+                                 digest_size=20).digest()
+        cached = state_dir() / "cache" / "code" / f"{name}.pyc"
+
+        try:
+            data = cached.read_bytes()
+            if data[:len(digest)] == digest:
+                return marshal.loads(data[len(digest):])
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+        code = self.source_to_code(source, path)
+
+        try:
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            partial = cached.with_suffix(f".{os.getpid()}.tmp")
+            partial.write_bytes(digest + marshal.dumps(code))
+            os.replace(partial, cached)
+        except OSError as err:
+            logging.debug(f"Unable to cache compiled {path}: {err}")
+
+        return code
+
+
 def load_file(path: Path, fn: str = None, module_name: str = "buildfile", skip_sys_modules: bool = False) -> tuple[                                                                                                             ModuleType, Any | None] | None:
     """
     Treats BUILD.py like a custom script for the wright tool.  Load the BUILD.py
@@ -31,7 +90,9 @@ def load_file(path: Path, fn: str = None, module_name: str = "buildfile", skip_s
     :param args: the arguments from the command line, after the task
     :return: the results of calling the function in the BUILD.py file
     """
-    sys.dont_write_bytecode = True
+    module = _reuse_module(path, module_name, skip_sys_modules)
+    if module:
+        return module, getattr(module, fn)() if fn else None
 
     try:
         spec = importlib.util.spec_from_file_location(module_name, path)
@@ -39,13 +100,18 @@ def load_file(path: Path, fn: str = None, module_name: str = "buildfile", skip_s
         logging.warning(f"No build file found at {path}")
         return None
 
+    if spec and type(spec.loader) is importlib.machinery.SourceFileLoader:
+        spec.loader = CachedSourceLoader(spec.name, spec.origin)
+
     if spec and spec.loader:
         module = importlib.util.module_from_spec(spec)
 
         if not skip_sys_modules:
             sys.modules[module_name] = module
 
-        spec.loader.exec_module(module)
+        with trace.span(f"load {path}", "load"):
+            spec.loader.exec_module(module)
+        _keep_module(path, module_name, skip_sys_modules, module)
 
         # Simply load the module if the function is not defined
         if not fn:
@@ -65,14 +131,90 @@ def load_file(path: Path, fn: str = None, module_name: str = "buildfile", skip_s
     return None
 
 
-def check_dependencies(globs: list[str], reference_file: str) -> bool:
+class IncludedModule:
+    """
+    Stands in for a build file included with @include.  The file isn't loaded
+    until one of the module's attributes is first used, so a task that never
+    calls into an included project doesn't pay to load it.
+    """
+
+    def __init__(self, build_file: Path, module_name: str):
+        self._build_file = Path(build_file)
+        self._module_name = module_name
+
+    def __getattr__(self, attr: str):
+        return getattr(include_file(self._build_file, self._module_name), attr)
+
+    def __repr__(self) -> str:
+        return f"<included build {self._module_name!r} from {str(self._build_file)!r}>"
+
+
+def include_file(path: Path, module_name: str) -> ModuleType:
+    """Load an included build file, or return the module already loaded from
+    the same file, so long as the file hasn't changed since."""
+    key = (os.path.realpath(path), module_name)
+
+    with _included_lock:
+        try:
+            st = os.stat(key[0])
+            signature = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            signature = None
+
+        kept = _included.get(key)
+        if kept and signature and kept[0] == signature:
+            return kept[1]
+
+        result = load_file(Path(path), module_name=module_name, skip_sys_modules=True)
+        if result is None:
+            raise AttributeError(f"Unable to load the build file {path} for {module_name}")
+
+        module, _ = result
+        if signature:
+            _included[key] = (signature, module)
+
+        return module
+
+
+def _reuse_module(path: Path, module_name: str, skip_sys_modules: bool) -> ModuleType | None:
+    """Return the module loaded earlier from the path, if reuse_modules is on
+    and the file hasn't changed since."""
+    if not reuse_modules:
+        return None
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    key = (os.path.realpath(path), module_name, skip_sys_modules)
+    kept = _loaded.get(key)
+    if not kept or kept[0] != (st.st_mtime_ns, st.st_size):
+        return None
+
+    if not skip_sys_modules:
+        sys.modules[module_name] = kept[1]
+
+    return kept[1]
+
+
+def _keep_module(path: Path, module_name: str, skip_sys_modules: bool, module: ModuleType):
+    if not reuse_modules:
+        return
+
+    st = os.stat(path)
+    _loaded[(os.path.realpath(path), module_name, skip_sys_modules)] = ((st.st_mtime_ns, st.st_size), module)
+
+
+def check_dependencies(globs: list[str], reference_file: str, excludes: list[str] | None = None) -> bool:
     """Compare the timestamp of the files matching the pattern with the
     timestamp of the reference file to determine if the files have changed since
     the reference file.  Returns true if the reference file doesn't exist or the
     files have changed.
 
     :param globs: an array of files to check
-    :param reference_file: the file to compare the other files against"""
+    :param reference_file: the file to compare the other files against
+    :param excludes: patterns, in .gitignore syntax, of files to skip"""
 
     reference = Path(reference_file)
     if not reference.exists():
@@ -80,9 +222,12 @@ def check_dependencies(globs: list[str], reference_file: str) -> bool:
 
     ref_mtime = reference.stat().st_mtime
 
-    for glob in globs:
-        for file in _parse_glob(glob):
-            file_mtime = file.stat().st_mtime
+    with trace.span("check_dependencies", "check", target=str(reference_file)):
+        for file in match_files(globs, excludes):
+            try:
+                file_mtime = file.stat().st_mtime
+            except FileNotFoundError:
+                continue
 
             if file_mtime >= ref_mtime:
                 return True
@@ -103,29 +248,6 @@ def check_dependencies(globs: list[str], reference_file: str) -> bool:
 #     return shlex.split(commas_or_spaces)
 
 
-def _parse_glob(glob: str):
-    """If the glob is an absolute path, parse into the root path and the glob.
-    If it's a relative glob or path, just return the current path and the glob."""
-    path = Path(glob)
-
-    if path.is_absolute():
-        root_parts = []
-        glob_parts = []
-        found_glob = False
-
-        for part in path.parts:
-            if "*" in part or found_glob:
-                glob_parts.append(part)
-                found_glob = True
-            else:
-                root_parts.append(part)
-
-        yield from Path(*root_parts).glob("/".join(glob_parts))
-
-    else:
-        yield from Path(os.getcwd()).glob(glob)
-
-
 def is_env(var: str, value: str = "true") -> bool:
     """Returns true if the var environment variable exists and is set to the
     given value.  If the value is not supplied, assumes a true or false value."""
@@ -192,3 +314,25 @@ def _get_version(line: str) -> tuple[str, int, int, int] | None:
 def current_path(file) -> Path:
     """Return the path of the given file."""
     return Path(file).parent
+
+
+def parse_size(value: str | int) -> int:
+    """Parse a size in bytes, like "512M" or "10GB".  Raises a ValueError if
+    it isn't one."""
+    if isinstance(value, int):
+        return value
+
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    value = value.strip().upper().removesuffix("B").removesuffix("I")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+
+    return int(value)
+
+
+def state_dir() -> Path:
+    """Where Wright keeps its state between runs, such as file fingerprints.
+    Defaults to .wright in the current directory, but may be overridden with
+    the WRIGHT_STATE_DIR environment variable."""
+    return Path(os.getenv("WRIGHT_STATE_DIR", ".wright")).absolute()
+
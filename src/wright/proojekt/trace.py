@@ -0,0 +1,154 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any
+
+# The task a span belongs to, for the per-task summary
+_task: contextvars.ContextVar[str | None] = contextvars.ContextVar("wright_trace_task", default=None)
+
+# The categories of the spans open in this context, with their tasks, so a
+# span nested inside another of the same category isn't counted twice
+_open: contextvars.ContextVar[tuple[tuple[str, str | None], ...]] = contextvars.ContextVar("wright_trace_open", default=())
+
+_tracer: Tracer | None = None
+_NULL = nullcontext()
+
+
+class Tracer:
+    """Collects timing spans, in the Chrome trace-event format."""
+
+    def __init__(self):
+        self.events: list[dict] = []
+        self._start = time.perf_counter_ns()
+        self._threads: dict[int, str] = {}
+
+    def record(self, name: str, category: str, start: int, end: int, args: dict | None = None):
+        """Record a span from perf_counter_ns timestamps."""
+        thread = threading.current_thread()
+        self._threads.setdefault(thread.ident, thread.name)
+
+        self.events.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self._start) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args or {},
+        })
+
+    def write(self, path: Path | str):
+        """Save the spans as JSON, for chrome://tracing or ui.perfetto.dev."""
+        import json
+
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+            for tid, name in self._threads.items()
+        ]
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Total the time, in seconds, each task spent overall, waiting on its
+        dependencies, running subprocesses and checking for changes."""
+        totals: dict[str, dict[str, float]] = {}
+        columns = {"task": "wall", "depends": "depends", "process": "process", "check": "check"}
+
+        for event in self.events:
+            column = columns.get(event["cat"])
+            task = event["args"].get("task")
+            if column is None or task is None or event["args"].get("nested"):
+                continue
+
+            row = totals.setdefault(task, dict.fromkeys(columns.values(), 0.0))
+            row[column] += event["dur"] / 1_000_000
+
+        return totals
+
+    def print_summary(self):
+        totals = self.summary()
+        if not totals:
+            print("[WRIGHT]: no tasks ran")
+            return
+
+        width = max(len(task) for task in totals)
+        print(f"{'task'.ljust(width)}  {'wall':>8}  {'self':>8}  {'process':>8}  {'checks':>8}")
+        for task, row in sorted(totals.items(), key=lambda item: item[1]["wall"], reverse=True):
+            own = row["wall"] - row["depends"]
+            print(f"{task.ljust(width)}  {row['wall']:8.3f}  {own:8.3f}  {row['process']:8.3f}  {row['check']:8.3f}")
+
+
+class _Span:
+    def __init__(self, tracer: Tracer, name: str, category: str, args: dict, task: str | None):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.task = task
+
+    def __enter__(self):
+        if self.task is not None:
+            self._task_token = _task.set(self.task)
+
+        opened = _open.get()
+        key = (self.category, _task.get())
+        self.args["task"] = key[1]
+        if key in opened:
+            self.args["nested"] = True
+
+        self._open_token = _open.set(opened + (key,))
+        self._begin = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = time.perf_counter_ns()
+        _open.reset(self._open_token)
+        if self.task is not None:
+            _task.reset(self._task_token)
+
+        if exc_type is not None:
+            self.args["error"] = str(exc_val) or exc_type.__name__
+
+        self.tracer.record(self.name, self.category, self._begin, end, self.args)
+        return False
+
+
+def start() -> Tracer:
+    """Start collecting spans for this process."""
+    global _tracer
+
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop() -> Tracer | None:
+    """Stop collecting spans, returning what was collected."""
+    global _tracer
+
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def active() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, category: str = "wright", **args: Any):
+    """Time the block as a span, if tracing.  Costs next to nothing when not."""
+    if _tracer is None:
+        return _NULL
+
+    return _Span(_tracer, name, category, args, None)
+
+
+def task(name: str):
+    """Time a task; spans opened inside it are attributed to the task."""
+    if _tracer is None:
+        return _NULL
+
+    return _Span(_tracer, name, "task", {}, name)
@@ -0,0 +1,374 @@
+import fnmatch
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator
+
+# Directories no watched glob should ever descend into
+DEFAULT_EXCLUDES = (".git", ".wright")
+
+_WILDCARDS = re.compile(r"[*?\[]")
+
+
+class Rule:
+    """A single exclude pattern, in .gitignore syntax, relative to a base
+    directory."""
+
+    def __init__(self, base: str, pattern: str):
+        self.base = base.rstrip("/") or "/"
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+
+        # Patterns without a slash match a name at any depth
+        if "/" not in pattern:
+            pattern = "**/" + pattern
+
+        self.regex = re.compile(translate(pattern.lstrip("/")))
+
+    def matches(self, path: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+
+        if self.base == "/":
+            rel = path.lstrip("/")
+        elif path.startswith(self.base + "/"):
+            rel = path[len(self.base) + 1:]
+        else:
+            return False
+
+        return self.regex.fullmatch(rel) is not None
+
+
+class Pattern:
+    """A glob compiled into the directory it starts from and the segments
+    left to match below it."""
+
+    def __init__(self, glob: str):
+        path = Path(glob)
+        if not path.is_absolute():
+            path = Path(os.getcwd()) / path
+
+        root_parts: list[str] = []
+        segments: list[str] = []
+        for part in path.parts:
+            if segments or _WILDCARDS.search(part):
+                segments.append(part)
+            else:
+                root_parts.append(part)
+
+        self.root = str(Path(*root_parts))
+        self.literal = not segments
+        self.segments = [seg if seg == "**" else re.compile(fnmatch.translate(seg)) for seg in segments]
+
+    def closure(self, states: set[int]) -> set[int]:
+        """Add the states reachable by letting `**` match no directories."""
+        result = set(states)
+        pending = list(states)
+        while pending:
+            state = pending.pop()
+            if state < len(self.segments) and self.segments[state] == "**" and state + 1 not in result:
+                result.add(state + 1)
+                pending.append(state + 1)
+
+        return result
+
+    def step(self, states: set[int], name: str, follow: bool = True) -> set[int]:
+        """Match an entry name against the states, returning the next states.
+        When not following, `**` won't descend (into a symlinked directory)."""
+        result = set()
+        for state in states:
+            if state >= len(self.segments):
+                continue
+
+            segment = self.segments[state]
+            if segment == "**":
+                if follow:
+                    result.add(state)
+            elif segment.match(name):
+                result.add(state + 1)
+
+        return self.closure(result)
+
+
+# Parsed .gitignore files, by path, along with their mtime when parsed
+_gitignores: dict[str, tuple[int, list[Rule]]] = {}
+
+
+def match_files(globs: list[str],
+                excludes: list[str] | None = None,
+                gitignore: bool = True,
+                directories: list[str] | None = None) -> Iterator[Path]:
+    """
+    Yield every file matching any of the globs, in a single pass over the
+    directory tree.  Each directory is read once with os.scandir, however many
+    globs apply to it, and directories no glob can match below are never
+    entered.  Files matching the excludes, or ignored by .gitignore, are
+    skipped; paths given literally, without wildcards, are always included
+    when they exist.
+
+    Relative globs and excludes are relative to the current directory.  If
+    `directories` is given, every directory the walk reads is appended to it,
+    along with the directories holding the literal paths.
+    """
+    patterns = _compile(tuple(globs), os.getcwd())
+    rules = _exclude_rules(tuple(excludes or ()))
+
+    seen: set[str] = set()
+    walks: dict[str, list[tuple[Pattern, set[int]]]] = {}
+
+    for pattern in patterns:
+        if pattern.literal:
+            if directories is not None:
+                directories.append(os.path.dirname(pattern.root))
+
+            if pattern.root not in seen and os.path.isfile(pattern.root):
+                seen.add(pattern.root)
+                yield Path(pattern.root)
+            continue
+
+        walks.setdefault(pattern.root, []).append((pattern, pattern.closure({0})))
+
+    # Globs rooted below another glob's root join that walk, matching their
+    # root directories literally until they reach them.
+    for root in sorted(walks, key=len):
+        for parent in list(walks):
+            if parent != root and root in walks and root.startswith(parent.rstrip("/") + "/"):
+                for pattern, _ in walks.pop(root):
+                    rooted = _Rooted(pattern, parent)
+                    walks[parent].append((rooted, rooted.closure({0})))
+                break
+
+    for root, active in walks.items():
+        root_rules = list(rules)
+        if gitignore:
+            root_rules.extend(_ancestor_gitignores(root))
+
+        for path in _walk(root, active, root_rules, gitignore, directories):
+            if path not in seen:
+                seen.add(path)
+                yield Path(path)
+
+
+def matches(globs: list[str], path: str | Path, excludes: list[str] | None = None) -> bool:
+    """
+    Would the file at the path match any of the globs?  Checks the path itself
+    rather than walking the directory tree, so it works for files that have
+    just been deleted.  Honours the excludes, but not .gitignore.
+    """
+    path = os.path.abspath(path)
+    rules = _exclude_rules(tuple(excludes or ()))
+
+    parent = os.path.dirname(path)
+    while parent and parent != "/":
+        if _ignored(rules, parent, True):
+            return False
+        parent = os.path.dirname(parent)
+
+    if _ignored(rules, path, False):
+        return False
+
+    for pattern in _compile(tuple(globs), os.getcwd()):
+        if pattern.literal:
+            if path == pattern.root:
+                return True
+            continue
+
+        if not path.startswith(pattern.root.rstrip("/") + "/"):
+            continue
+
+        *dirs, name = Path(path).relative_to(pattern.root).parts
+        states = pattern.closure({0})
+        for part in dirs:
+            states = pattern.step(states, part)
+
+        if len(pattern.segments) in pattern.step(states, name):
+            return True
+
+    return False
+
+
+def _walk(root: str,
+          active: list[tuple[Pattern, set[int]]],
+          rules: list[Rule],
+          gitignore: bool,
+          directories: list[str] | None) -> Iterator[str]:
+    stack = [(root, active, rules)]
+
+    while stack:
+        directory, active, rules = stack.pop()
+
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+
+        if directories is not None:
+            directories.append(directory)
+
+        if gitignore:
+            for entry in entries:
+                if entry.name == ".gitignore":
+                    rules = rules + _gitignore(entry.path, directory)
+                    break
+
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+
+            if _ignored(rules, entry.path, is_dir):
+                continue
+
+            if is_dir:
+                follow = not entry.is_symlink()
+                descend = []
+                for pattern, states in active:
+                    following = pattern.step(states, entry.name, follow)
+                    if any(state < len(pattern.segments) for state in following):
+                        descend.append((pattern, following))
+
+                if descend:
+                    subdirs.append((entry.path, descend, rules))
+            else:
+                for pattern, states in active:
+                    if len(pattern.segments) in pattern.step(states, entry.name):
+                        yield entry.path
+                        break
+
+        stack.extend(reversed(subdirs))
+
+
+class _Rooted(Pattern):
+    """A pattern whose root lies below the directory the walk starts from."""
+
+    def __init__(self, pattern: Pattern, parent: str):
+        rel = Path(pattern.root).relative_to(parent).parts
+        self.root = parent
+        self.literal = False
+        self.segments = [re.compile(re.escape(part) + r"\Z") for part in rel] + pattern.segments
+
+
+def _ignored(rules: list[Rule], path: str, is_dir: bool) -> bool:
+    ignored = False
+    for rule in rules:
+        if rule.negate == ignored and rule.matches(path, is_dir):
+            ignored = not rule.negate
+
+    return ignored
+
+
+@lru_cache(maxsize=64)
+def _compile(globs: tuple[str, ...], cwd: str) -> list[Pattern]:
+    """Compile the globs, once per set of globs and working directory."""
+    return [Pattern(glob) for glob in globs]
+
+
+def _exclude_rules(excludes: tuple[str, ...]) -> list[Rule]:
+    rules = [Rule("/", name + "/") for name in DEFAULT_EXCLUDES]
+    for exclude in excludes:
+        if Path(exclude).is_absolute():
+            rules.append(Rule("/", exclude))
+        else:
+            rules.append(Rule(os.getcwd(), exclude))
+
+    return rules
+
+
+def _ancestor_gitignores(root: str) -> list[Rule]:
+    """Load the .gitignore files between the top of the repository and the
+    root of the walk, outermost first; the walk picks up the rest."""
+    path = Path(root)
+    chain = [path, *path.parents]
+
+    top = None
+    for directory in chain:
+        if (directory / ".git").exists():
+            top = directory
+            break
+
+    if top is None:
+        return []
+
+    rules = _gitignore(str(top / ".git" / "info" / "exclude"), str(top))
+    for directory in reversed(chain[1:chain.index(top) + 1]):
+        rules.extend(_gitignore(str(directory / ".gitignore"), str(directory)))
+
+    return rules
+
+
+def _gitignore(path: str, base: str) -> list[Rule]:
+    """Parse a .gitignore file, remembering the rules until it changes."""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return []
+
+    cached = _gitignores.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    rules = []
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line.endswith("\\ "):
+                    line = line.rstrip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("\\#") or line.startswith("\\!"):
+                    line = line[1:]
+                rules.append(Rule(base, line))
+    except OSError:
+        return []
+
+    _gitignores[path] = (mtime, rules)
+    return rules
+
+
+def translate(pattern: str) -> str:
+    """Translate a .gitignore-style pattern into a regular expression matched
+    against a slash-separated relative path.  Also suits .dockerignore."""
+    result = []
+    i = 0
+    n = len(pattern)
+
+    while i < n:
+        if pattern.startswith("**/", i):
+            result.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i) and i + 2 == n:
+            result.append(".*")
+            i += 2
+        else:
+            c = pattern[i]
+            i += 1
+            if c == "*":
+                result.append("[^/]*")
+            elif c == "?":
+                result.append("[^/]")
+            elif c == "\\" and i < n:
+                result.append(re.escape(pattern[i]))
+                i += 1
+            elif c == "[":
+                end = pattern.find("]", i + 1 if i < n and pattern[i] in "!^" else i)
+                if end == -1:
+                    result.append(re.escape(c))
+                else:
+                    chars = pattern[i:end].replace("\\", "\\\\")
+                    if chars[:1] in ("!", "^"):
+                        chars = "^" + chars[1:]
+                    result.append(f"[{chars}]")
+                    i = end + 1
+            else:
+                result.append(re.escape(c))
+
+    return "".join(result)
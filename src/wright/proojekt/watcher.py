@@ -0,0 +1,301 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+from . import process, scheduler
+from .support import load_file
+from .walker import match_files, matches
+
+# How long the files must be quiet before the tasks are run again, so a burst
+# of saves (or a git checkout) triggers a single run.
+DEBOUNCE = 0.2
+
+# How often to scan for changes when inotify isn't available
+POLL_INTERVAL = 0.5
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+               _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """Watches directories for changes using Linux's inotify, through libc."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._dirs: dict[int, str] = {}
+        self._wds: dict[str, int] = {}
+
+    def watch(self, directories: list[str]):
+        """Make sure each directory is watched.  Directories that no longer
+        exist are quietly skipped."""
+        for directory in directories:
+            if directory in self._wds:
+                continue
+
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+            if wd < 0:
+                continue
+
+            self._dirs[wd] = directory
+            self._wds[directory] = wd
+
+    def read(self, timeout: float | None) -> tuple[set[str], bool] | None:
+        """Wait for events, returning the changed paths and whether the set of
+        directories changed.  Returns None if nothing happened before the
+        timeout."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return None
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set(), False
+
+        paths: set[str] = set()
+        rescan = False
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                return paths, True
+
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+
+            if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+                self._forget(wd)
+                rescan = True
+                continue
+
+            if mask & _IN_ISDIR:
+                rescan = True
+
+            paths.add(os.path.join(directory, name) if name else directory)
+
+        return paths, rescan
+
+    def close(self):
+        os.close(self._fd)
+
+    def _forget(self, wd: int):
+        directory = self._dirs.pop(wd, None)
+        if directory is not None:
+            self._wds.pop(directory, None)
+
+
+class Watcher:
+    """
+    Waits for changes to the files matching a set of globs, using inotify
+    where it's available and falling back to polling the files' timestamps.
+    """
+
+    def __init__(self, globs: list[str], excludes: list[str] | None = None, debounce: float = DEBOUNCE):
+        self.globs = globs
+        self.excludes = excludes or []
+        self.debounce = debounce
+        self._snapshot: dict[str, tuple[int, int]] = {}
+
+        try:
+            self._inotify = Inotify() if sys.platform.startswith("linux") else None
+        except (OSError, AttributeError) as err:
+            logging.info(f"inotify unavailable, polling for changes: {err}")
+            self._inotify = None
+
+        self._scan()
+
+    def wait(self) -> set[str]:
+        """Block until one or more matching files change, then return their
+        paths once the changes have settled."""
+        while True:
+            changed = self._wait_inotify() if self._inotify else self._wait_poll()
+            changed = {path for path in changed if matches(self.globs, path, self.excludes)}
+            if changed:
+                return changed
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        directories: list[str] = []
+        snapshot = {}
+        for file in match_files(self.globs, self.excludes, directories=directories):
+            try:
+                st = file.stat()
+            except FileNotFoundError:
+                continue
+            snapshot[str(file)] = (st.st_mtime_ns, st.st_size)
+
+        if self._inotify:
+            self._inotify.watch(directories)
+
+        previous, self._snapshot = self._snapshot, snapshot
+        return previous
+
+    def _wait_inotify(self) -> set[str]:
+        result = self._inotify.read(None)
+        changed, rescan = result if result else (set(), False)
+
+        # Keep collecting until things quiet down
+        while True:
+            result = self._inotify.read(self.debounce)
+            if result is None:
+                break
+            paths, more = result
+            changed |= paths
+            rescan = rescan or more
+
+        if rescan:
+            # New directories need watching, and files may have arrived in
+            # them before the watch did; compare against the last scan.
+            previous = self._scan()
+            changed |= _differences(previous, self._snapshot)
+        else:
+            for path in changed:
+                try:
+                    st = os.stat(path)
+                    self._snapshot[path] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    self._snapshot.pop(path, None)
+
+        return changed
+
+    def _wait_poll(self) -> set[str]:
+        while True:
+            time.sleep(POLL_INTERVAL)
+            changed = _differences(self._scan(), self._snapshot)
+            if not changed:
+                continue
+
+            # Wait for a quiet scan before reporting
+            while True:
+                time.sleep(self.debounce)
+                more = _differences(self._scan(), self._snapshot)
+                if not more:
+                    return changed
+                changed |= more
+
+
+def watch(script: Path, command: str = "build", jobs: int | None = None, debounce: float = DEBOUNCE):
+    """
+    Run the task, then keep running it whenever the files its tasks watch
+    change.  The build file stays loaded between runs, and only the tasks
+    whose sources changed, and the tasks depending on them, run again.  If the
+    build file itself changes it is loaded again and every task runs.
+    """
+    script = Path(script).absolute()
+    module = _load(script)
+    if module is None:
+        return
+
+    sources: dict[Callable, tuple[list[str], list[str]]] = {}
+    _run(module, command, jobs, sources, None)
+
+    watcher = None
+    try:
+        while True:
+            globs = list(dict.fromkeys([str(script)] + [g for watched, _ in sources.values() for g in watched]))
+            excludes = list(dict.fromkeys([e for _, excluded in sources.values() for e in excluded]))
+
+            if watcher is None or watcher.globs != globs or watcher.excludes != excludes:
+                if watcher:
+                    watcher.close()
+                watcher = Watcher(globs, excludes, debounce)
+
+            changed = watcher.wait()
+            print(f"[WRIGHT]: {len(changed)} file(s) changed")
+
+            if str(script) in changed:
+                module = _load(script) or module
+                sources.clear()
+                _run(module, command, jobs, sources, None)
+                continue
+
+            affected = {
+                task_func for task_func, (watched, excluded) in sources.items()
+                if any(matches(watched, path, excluded) for path in changed)
+            }
+            _run(module, command, jobs, sources, affected)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher:
+            watcher.close()
+
+
+def _load(script: Path):
+    result = load_file(script)
+    if result is None:
+        return None
+
+    module, _ = result
+    return module
+
+
+def _run(module, command: str, jobs: int | None, sources: dict, affected: set[Callable] | None):
+    """Run the command's task, skipping the tasks that aren't affected by the
+    changes.  Runs everything when affected is None."""
+    root = getattr(module, command, None)
+    if root is None:
+        logging.error(f"No task named {command} in the build file")
+        return
+
+    process.reset_logs()
+
+    with scheduler.session(jobs) as tasks:
+        if affected is not None:
+            stale = set()
+            for task_func, deps in scheduler.graph([root]):
+                if task_func in affected or any(dep in stale for dep in deps):
+                    stale.add(task_func)
+                elif task_func is not root:
+                    tasks.done(task_func)
+
+            if root not in stale:
+                return
+
+        try:
+            root()
+        except KeyboardInterrupt:
+            raise
+        except BaseException as err:
+            logging.error(f"{command} failed: {err}")
+        finally:
+            sources.update(tasks.sources)
+
+
+def _differences(before: dict[str, tuple[int, int]], after: dict[str, tuple[int, int]]) -> set[str]:
+    """The files added, removed or modified between two scans."""
+    return {path for path in before.keys() | after.keys() if before.get(path) != after.get(path)}
@@ -0,0 +1,232 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from wright.proojekt import actions
+
+
+class Action:
+    """Writes its outputs, counting how often it had to run."""
+
+    def __init__(self, *outputs: Path, content: bytes = b"built"):
+        self.outputs = outputs
+        self.content = content
+        self.runs = 0
+
+    def __call__(self):
+        self.runs += 1
+        for output in self.outputs:
+            output.write_bytes(self.content)
+            os.chmod(output, 0o755)
+
+
+def blobs(root: Path) -> list[Path]:
+    return sorted(path for path in (root / "cas").rglob("*") if path.is_file())
+
+
+def test_restores_outputs(tmp_path):
+    cache = actions.ActionCache(actions.LocalBackend(tmp_path / "cache"))
+    output = tmp_path / "out" / "app"
+    output.parent.mkdir()
+    action = Action(output)
+
+    assert not cache.run("key", ["out/app"], action, root=tmp_path)
+    output.unlink()
+    assert cache.run("key", ["out/app"], action, root=tmp_path)
+
+    assert action.runs == 1
+    assert output.read_bytes() == b"built"
+    assert os.stat(output).st_mode & 0o777 == 0o755
+
+
+def test_restores_to_another_checkout(tmp_path):
+    cache = actions.ActionCache(actions.LocalBackend(tmp_path / "cache"))
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+
+    cache.run("key", ["app"], Action(first / "app"), root=first)
+    action = Action(second / "app")
+    assert cache.run("key", ["app"], action, root=second)
+    assert action.runs == 0
+    assert (second / "app").read_bytes() == b"built"
+
+
+def test_different_outputs_miss(tmp_path):
+    cache = actions.ActionCache(actions.LocalBackend(tmp_path / "cache"))
+    cache.run("key", ["a"], Action(tmp_path / "a"), root=tmp_path)
+
+    action = Action(tmp_path / "a", tmp_path / "b")
+    assert not cache.run("key", ["a", "b"], action, root=tmp_path)
+    assert action.runs == 1
+
+
+@pytest.mark.parametrize("reflink", [True, False])
+def test_restored_output_is_independent_of_the_cache(tmp_path, monkeypatch, reflink):
+    if not reflink:
+        def unsupported(*args):
+            raise OSError("reflinks unsupported")
+
+        monkeypatch.setattr(actions.fcntl, "ioctl", unsupported)
+
+    cache = actions.ActionCache(actions.LocalBackend(tmp_path / "cache"))
+    output = tmp_path / "app"
+    cache.run("key", ["app"], Action(output), root=tmp_path)
+    output.unlink()
+    assert cache.run("key", ["app"], Action(output), root=tmp_path)
+
+    # Whether reflinked or copied, writing to the output in place leaves the
+    # cached copy alone
+    [blob] = blobs(tmp_path / "cache")
+    assert not os.path.samefile(blob, output)
+    with open(output, "r+b") as f:
+        f.write(b"BUILT")
+
+    assert blob.read_bytes() == b"built"
+    assert os.stat(blob).st_mode & 0o222 == 0
+
+
+def test_evicts_least_recently_used(tmp_path):
+    backend = actions.LocalBackend(tmp_path / "cache")
+    sources = {}
+    for name in "abcd":
+        sources[name] = tmp_path / name
+        sources[name].write_bytes(name.encode() * 10000)
+
+    backend.put_blob("a" * 40, sources["a"])
+    unit = os.stat(backend._blob("a" * 40)).st_blocks * 512
+
+    # Room for three and a half blobs
+    backend.max_bytes = int(unit * 3.5)
+    for age, name in enumerate("abc"):
+        backend.put_blob(name * 40, sources[name])
+        os.utime(backend._blob(name * 40), ns=(10 ** 9 * (age + 1),) * 2)
+
+    # Using a makes b the least recently used
+    assert backend.restore_blob("a" * 40, tmp_path / "restored", 0o644)
+    backend.put_blob("d" * 40, sources["d"])
+
+    assert not backend.has_blob("b" * 40)
+    assert all(backend.has_blob(name * 40) for name in "acd")
+
+
+def test_evicts_manifests(tmp_path):
+    backend = actions.LocalBackend(tmp_path / "cache", max_bytes=0)
+    backend.put_manifest("key", {"outputs": []})
+    assert backend.get_manifest("key") is None
+
+
+@pytest.mark.skipif(actions.zstd is None, reason="needs compression.zstd")
+def test_compressed_round_trip(tmp_path):
+    backend = actions.LocalBackend(tmp_path / "cache", compress=True)
+    cache = actions.ActionCache(backend)
+    output = tmp_path / "app"
+    content = b"compressible " * 1000
+
+    cache.run("key", ["app"], Action(output, content=content), root=tmp_path)
+    [blob] = blobs(tmp_path / "cache")
+    assert blob.suffix == ".zst"
+    assert blob.stat().st_size < len(content)
+
+    output.unlink()
+    assert cache.run("key", ["app"], Action(output), root=tmp_path)
+    assert output.read_bytes() == content
+
+
+class StandIn:
+    """An HTTP cache server, keeping what's PUT in memory."""
+
+    def __init__(self):
+        self.entries: dict[str, tuple[bytes, str | None]] = {}
+
+        entries = self.entries
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                entries[self.path] = (body, self.headers.get("Content-Encoding"))
+                self.reply(201)
+
+            def do_GET(self):
+                self.reply(*self.entry())
+
+            def do_HEAD(self):
+                status, _, _ = self.entry()
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def entry(self):
+                if self.path not in entries:
+                    return 404, b"", None
+                return 200, *entries[self.path]
+
+            def reply(self, status, body=b"", encoding=None):
+                self.send_response(status)
+                if encoding:
+                    self.send_header("Content-Encoding", encoding)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/cache"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_http_backend(tmp_path):
+    server = StandIn()
+    try:
+        cache = actions.ActionCache(actions.HttpBackend(server.url))
+        output = tmp_path / "app"
+        action = Action(output)
+
+        assert not cache.run("key", ["app"], action, root=tmp_path)
+        output.unlink()
+        assert cache.run("key", ["app"], action, root=tmp_path)
+
+        assert action.runs == 1
+        assert output.read_bytes() == b"built"
+        assert os.stat(output).st_mode & 0o777 == 0o755
+        assert "/cache/ac/key" in server.entries
+    finally:
+        server.close()
+
+
+def test_http_backend_discards_corrupt_outputs(tmp_path):
+    server = StandIn()
+    try:
+        cache = actions.ActionCache(actions.HttpBackend(server.url))
+        cache.run("key", ["app"], Action(tmp_path / "app"), root=tmp_path)
+        for path in list(server.entries):
+            if path.startswith("/cache/cas/"):
+                server.entries[path] = (b"corrupt", None)
+
+        action = Action(tmp_path / "app")
+        assert not cache.run("key", ["app"], action, root=tmp_path)
+        assert action.runs == 1
+    finally:
+        server.close()
+
+
+def test_http_backend_unavailable(tmp_path):
+    server = StandIn()
+    url = server.url
+    server.close()
+
+    cache = actions.ActionCache(actions.HttpBackend(url, timeout=5))
+    action = Action(tmp_path / "app")
+    assert not cache.run("key", ["app"], action, root=tmp_path)
+    assert action.runs == 1
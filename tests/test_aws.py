@@ -0,0 +1,301 @@
+import base64
+import datetime
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from wright.aws import ecr, sigv4
+
+# The credentials, time and host of the AWS Signature Version 4 test suite
+EXAMPLE = sigv4.Credentials("AKIDEXAMPLE", "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY")
+EXAMPLE_TIME = datetime.datetime(2015, 8, 30, 12, 36, 0, tzinfo=datetime.timezone.utc)
+SCOPE = "Credential=AKIDEXAMPLE/20150830/us-east-1/service/aws4_request"
+
+
+def example(method: str, headers: dict[str, str], body: bytes = b"") -> str:
+    return sigv4.sign(method, "example.amazonaws.com", "/", headers, body, "us-east-1", "service",
+                      EXAMPLE, EXAMPLE_TIME)["Authorization"]
+
+
+def test_sign_get_vanilla():
+    assert example("GET", {}) == (
+        f"AWS4-HMAC-SHA256 {SCOPE}, SignedHeaders=host;x-amz-date, "
+        "Signature=5fa00fa31553b73ebf1942676e86291e8372ff2a2260956d9b8aae1d763fbf31")
+
+
+def test_sign_post_vanilla():
+    assert example("POST", {}) == (
+        f"AWS4-HMAC-SHA256 {SCOPE}, SignedHeaders=host;x-amz-date, "
+        "Signature=5da7c1a2acd57cee7505fc6676e4e544621c30862966e37dddb68e92efbe5d6b")
+
+
+def test_sign_post_form_body():
+    assert example("POST", {"Content-Type": "application/x-www-form-urlencoded"}, b"Param1=value1") == (
+        f"AWS4-HMAC-SHA256 {SCOPE}, SignedHeaders=content-type;host;x-amz-date, "
+        "Signature=ff11897932ad3f4e8b18135d722051e5ac45fc38421b1da7b9d196a0fe09473a")
+
+
+def test_sign_header_value_trim():
+    assert example("GET", {"My-Header1": " value1", "My-Header2": ' "a   b   c"'}) == (
+        f"AWS4-HMAC-SHA256 {SCOPE}, SignedHeaders=host;my-header1;my-header2;x-amz-date, "
+        "Signature=acc3ed3afb60bb290fc8d2dd0098b9911fcaa05412b367055dee359757a9c736")
+
+
+def test_sign_session_token():
+    headers = sigv4.sign("POST", "example.amazonaws.com", "/", {}, b"", "us-east-1", "service",
+                         sigv4.Credentials(EXAMPLE.access_key, EXAMPLE.secret_key, "TOKEN"), EXAMPLE_TIME)
+    assert headers["X-Amz-Security-Token"] == "TOKEN"
+    assert "SignedHeaders=host;x-amz-date;x-amz-security-token" in headers["Authorization"]
+
+
+class FakeECR:
+    """Answers STS's GetCallerIdentity and ECR's GetAuthorizationToken,
+    CreateRepository, DescribeImages and BatchGetImage, counting the calls
+    and remembering which access keys made them.  Repositories map to their
+    image tags, and DescribeImages returns them page_size at a time."""
+
+    def __init__(self, expires_in: float = 12 * 3600, page_size: int = 100):
+        self.expires_in = expires_in
+        self.page_size = page_size
+        self.repositories: dict[str, list[str]] = {}
+        self.calls: list[str] = []
+        self.params: list[dict] = []
+        self.access_keys: list[str] = []
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                fake.access_keys.append(self.headers["Authorization"].split("Credential=")[1].split("/")[0])
+
+                target = self.headers.get("X-Amz-Target")
+                if target is None:
+                    fake.calls.append("GetCallerIdentity")
+                    self.reply(200, b"<GetCallerIdentityResponse><GetCallerIdentityResult>"
+                                    b"<Account>123456789012</Account></GetCallerIdentityResult>"
+                                    b"</GetCallerIdentityResponse>")
+                    return
+
+                operation = target.split(".")[1]
+                params = json.loads(body)
+                fake.calls.append(operation)
+                fake.params.append(params)
+
+                try:
+                    result = getattr(fake, operation)(params)
+                except LookupError as err:
+                    self.reply(400, json.dumps({"__type": f"com.amazonaws.ecr#{err.args[0]}",
+                                                "message": err.args[0]}).encode("utf-8"))
+                    return
+
+                self.reply(200, json.dumps(result).encode("utf-8"))
+
+            def reply(self, status, body):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def GetAuthorizationToken(self, params):
+        return {"authorizationData": [{
+            "authorizationToken": base64.b64encode(b"AWS:secret").decode("ascii"),
+            "proxyEndpoint": "https://123456789012.dkr.ecr.us-east-1.amazonaws.com",
+            "expiresAt": time.time() + self.expires_in,
+        }]}
+
+    def CreateRepository(self, params):
+        if params["repositoryName"] in self.repositories:
+            raise LookupError("RepositoryAlreadyExistsException")
+        self.repositories[params["repositoryName"]] = []
+        return {"repository": {"repositoryName": params["repositoryName"]}}
+
+    def DescribeImages(self, params):
+        tags = self.tags(params["repositoryName"])
+        start = int(params.get("nextToken", 0))
+        page = tags[start:start + self.page_size]
+
+        result: dict = {"imageDetails": [{"imageTags": [tag]} for tag in page]}
+        if start + self.page_size < len(tags):
+            result["nextToken"] = str(start + self.page_size)
+        return result
+
+    def BatchGetImage(self, params):
+        tags = self.tags(params["repositoryName"])
+        wanted = [image["imageTag"] for image in params["imageIds"]]
+        if len(wanted) > 100:
+            raise LookupError("InvalidParameterException")
+
+        return {
+            "images": [{"imageId": {"imageTag": tag}} for tag in wanted if tag in tags],
+            "failures": [{"imageId": {"imageTag": tag}, "failureCode": "ImageNotFound"}
+                         for tag in wanted if tag not in tags],
+        }
+
+    def tags(self, repository: str) -> list[str]:
+        if repository not in self.repositories:
+            raise LookupError("RepositoryNotFoundException")
+        return self.repositories[repository]
+
+
+def fake_ecr(monkeypatch, tmp_path, expires_in: float = 12 * 3600, page_size: int = 100) -> FakeECR:
+    fake = FakeECR(expires_in, page_size)
+    monkeypatch.setenv("AWS_ENDPOINT_URL", fake.url)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "AKIDFIRST")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+    monkeypatch.delenv("AWS_ACCOUNT_ID", raising=False)
+    monkeypatch.setenv("WRIGHT_STATE_DIR", str(tmp_path / ".wright"))
+    ecr._accounts.clear()
+    return fake
+
+
+def test_token_cached(monkeypatch, tmp_path):
+    fake = fake_ecr(monkeypatch, tmp_path)
+    try:
+        first = ecr.Client("us-east-1").authorization()
+        assert ecr.Client("us-east-1").authorization() == first
+        assert fake.calls == ["GetCallerIdentity", "GetAuthorizationToken"]
+        assert first["password"] == "secret"
+        assert first["host"] == "123456789012.dkr.ecr.us-east-1.amazonaws.com"
+
+        cached = list((tmp_path / ".wright" / "aws").glob("ecr-*.json"))
+        assert len(cached) == 1
+        assert cached[0].stat().st_mode & 0o777 == 0o600
+    finally:
+        fake.close()
+
+
+def test_token_renewed_before_expiry(monkeypatch, tmp_path):
+    fake = fake_ecr(monkeypatch, tmp_path, expires_in=ecr.TOKEN_MARGIN - 60)
+    try:
+        client = ecr.Client("us-east-1")
+        client.authorization()
+        client.authorization()
+        assert fake.calls.count("GetAuthorizationToken") == 2
+    finally:
+        fake.close()
+
+
+def test_token_per_credentials(monkeypatch, tmp_path):
+    fake = fake_ecr(monkeypatch, tmp_path)
+    try:
+        client = ecr.Client("us-east-1")
+        client.authorization()
+
+        # Rotated or different credentials are used at once, with a token of their own
+        monkeypatch.setenv("AWS_ACCESS_KEY_ID", "AKIDSECOND")
+        monkeypatch.setenv("AWS_ACCOUNT_ID", "210987654321")
+        client.authorization()
+
+        assert fake.calls.count("GetAuthorizationToken") == 2
+        assert fake.access_keys[-1] == "AKIDSECOND"
+    finally:
+        fake.close()
+
+
+def test_login_skipped_only_while_docker_has_it(monkeypatch, tmp_path):
+    fake = fake_ecr(monkeypatch, tmp_path)
+    log = tmp_path / "docker.log"
+    config = tmp_path / "docker-config"
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+
+    # Stands in for docker login, recording the registry the way Docker does
+    docker = bin_dir / "docker"
+    docker.write_text(f"#!/bin/sh\necho \"$@\" >> {log}\nmkdir -p {config}\n"
+                      f"echo '{{\"auths\": {{\"'\"$5\"'\": {{}}}}}}' > {config}/config.json\n")
+    docker.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("DOCKER_CONFIG", str(config))
+    monkeypatch.setenv("WRIGHT_OUTPUT", "quiet")
+    monkeypatch.setattr(ecr, "_clients", {})
+
+    try:
+        ecr.authenticate_ecr("us-east-1")
+        ecr.authenticate_ecr("us-east-1")
+        assert len(log.read_text().splitlines()) == 1
+
+        # After docker logout, log in again
+        (config / "config.json").write_text('{"auths": {}}')
+        ecr.authenticate_ecr("us-east-1")
+        assert len(log.read_text().splitlines()) == 2
+    finally:
+        fake.close()
+
+
+def test_describe_images_follows_pages(monkeypatch, tmp_path):
+    fake = fake_ecr(monkeypatch, tmp_path, page_size=2)
+    fake.repositories["app"] = ["1", "2", "3", "4", "5"]
+    try:
+        images = ecr.Client("us-east-1").describe_images("app")
+        assert [image["imageTags"] for image in images] == [["1"], ["2"], ["3"], ["4"], ["5"]]
+        assert [params.get("nextToken") for params in fake.params] == [None, "2", "4"]
+    finally:
+        fake.close()
+
+
+def test_describe_many(monkeypatch, tmp_path):
+    fake = fake_ecr(monkeypatch, tmp_path, page_size=2)
+    fake.repositories.update({"api": ["1", "2", "3"], "web": ["1"]})
+    try:
+        described = ecr.Client("us-east-1").describe_many(["api", "missing", "web"])
+        assert list(described) == ["api", "missing", "web"]
+        assert [image["imageTags"] for image in described["api"]] == [["1"], ["2"], ["3"]]
+        assert described["missing"] == []
+        assert [image["imageTags"] for image in described["web"]] == [["1"]]
+    finally:
+        fake.close()
+
+
+def test_describe_many_raises_other_errors(monkeypatch, tmp_path):
+    fake = fake_ecr(monkeypatch, tmp_path)
+
+    def denied(repository):
+        raise LookupError("AccessDeniedException")
+
+    monkeypatch.setattr(fake, "tags", denied)
+    try:
+        with pytest.raises(ecr.ECRError, match="AccessDeniedException"):
+            ecr.Client("us-east-1").describe_many(["app"])
+    finally:
+        fake.close()
+
+
+def test_batch_get_image_in_chunks(monkeypatch, tmp_path):
+    fake = fake_ecr(monkeypatch, tmp_path)
+    fake.repositories["app"] = [str(n) for n in range(250)]
+    try:
+        images, failures = ecr.Client("us-east-1").batch_get_image("app", [str(n) for n in range(251)])
+        assert [len(params["imageIds"]) for params in fake.params] == [100, 100, 51]
+        assert [image["imageId"]["imageTag"] for image in images] == [str(n) for n in range(250)]
+        assert [failure["imageId"]["imageTag"] for failure in failures] == ["250"]
+    finally:
+        fake.close()
+
+
+def test_create_repository(monkeypatch, tmp_path):
+    fake = fake_ecr(monkeypatch, tmp_path)
+    try:
+        client = ecr.Client("us-east-1")
+        assert client.create_repository("app")
+        assert not client.create_repository("app")
+        assert fake.calls.count("CreateRepository") == 2
+    finally:
+        fake.close()
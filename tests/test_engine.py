@@ -0,0 +1,338 @@
+import json
+import os
+import socketserver
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+import pytest
+
+from wright import docker
+from wright.docker import compose, engine
+
+
+class FakeEngine:
+    """
+    Answers the Docker Engine API calls Wright makes, over a Unix socket.
+    Inspecting a container returns what's in `containers`; the events
+    stream plays `events`, a list of (seconds to wait, changes to the
+    containers, event), then ends.  Paths in `broken` answer with a 500.
+    """
+
+    def __init__(self, path: Path):
+        self.path = str(path)
+        self.images: list[dict] = []
+        self.containers: dict[str, dict] = {}
+        self.events: list[tuple[float, dict, dict]] = []
+        self.broken: set[str] = set()
+        self.requests: list[str] = []
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                fake.requests.append(url.path)
+
+                if url.path in fake.broken:
+                    return self.reply(500, {"message": "broken"})
+
+                match url.path.strip("/").split("/"):
+                    case ["_ping"]:
+                        self.reply(200, "OK")
+                    case ["images", "json"]:
+                        self.reply(200, fake.images)
+                    case ["images", *reference, "json"]:
+                        image = fake.image("/".join(reference))
+                        self.reply(200, image) if image else self.reply(404, {"message": "No such image"})
+                    case ["containers", "json"]:
+                        self.reply(200, fake.list(json.loads(query.get("filters", "{}")), query.get("all") == "1"))
+                    case ["containers", container_id, "json"]:
+                        container = fake.containers.get(container_id)
+                        self.reply(200, container) if container else self.reply(404, {"message": "No such container"})
+                    case ["events"]:
+                        self.stream()
+                    case _:
+                        self.reply(404, {"message": "Not found"})
+
+            def do_POST(self):
+                fake.requests.append(self.path)
+                self.reply(204)
+
+            def reply(self, status: int, body=None):
+                data = b"" if body is None else json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def stream(self):
+                # Like Docker, one chunk per event
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                self.wfile.flush()
+
+                for delay, changes, event in fake.events:
+                    time.sleep(delay)
+                    fake.containers.update(changes)
+                    data = json.dumps(event).encode("utf-8") + b"\n"
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    self.wfile.flush()
+
+                self.wfile.write(b"0\r\n\r\n")
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # Clients hang up on the events stream once they've seen enough
+                pass
+
+        self.server = Server(self.path, Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def image(self, reference: str) -> dict | None:
+        return next((image for image in self.images if reference in image.get("RepoTags", [])), None)
+
+    def list(self, filters: dict, all: bool) -> list[dict]:
+        found = []
+        for container_id, container in self.containers.items():
+            labels = container["Config"].get("Labels") or {}
+            if not all and container["State"]["Status"] != "running":
+                continue
+            wanted = [label.partition("=") for label in filters.get("label", [])]
+            if any(labels.get(key) != value for key, _, value in wanted):
+                continue
+            found.append({"Id": container_id, "Image": container["Config"]["Image"], "ImageID": container["Image"],
+                          "State": container["State"]["Status"], "Labels": labels})
+
+        return found
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def container(status: str = "running", health: str | None = None, exit_code: int = 0,
+              image: str = "app:latest", image_id: str = "sha256:0", labels: dict | None = None) -> dict:
+    state = {"Status": status, "ExitCode": exit_code}
+    if health:
+        state["Health"] = {"Status": health, "Log": [{"Output": f"{health}\n"}]}
+
+    return {"Name": "/app", "Image": image_id, "State": state, "Config": {"Image": image, "Labels": labels or {}}}
+
+
+def die(container_id: str, exit_code: int) -> dict:
+    return {"Type": "container", "Action": "die", "id": container_id,
+            "Actor": {"ID": container_id, "Attributes": {"exitCode": str(exit_code)}}}
+
+
+def event(container_id: str, action: str) -> dict:
+    return {"Type": "container", "Action": action, "id": container_id, "Actor": {"ID": container_id}}
+
+
+@pytest.fixture
+def fake(tmp_path, monkeypatch):
+    fake = FakeEngine(tmp_path / "docker.sock")
+    monkeypatch.setenv("DOCKER_HOST", f"unix://{fake.path}")
+    monkeypatch.delenv("WRIGHT_DOCKER_API", raising=False)
+    monkeypatch.setattr(engine, "_checked", None)
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def docker_cli(tmp_path, monkeypatch):
+    """A docker command that records how it was called, printing whatever
+    tmp_path/docker.out holds."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "docker"
+    script.write_text(f"#!/bin/sh\necho \"$@\" >> {tmp_path}/docker.log\ncat {tmp_path}/docker.out 2>/dev/null\n")
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("WRIGHT_OUTPUT", "quiet")
+
+    def calls() -> list[str]:
+        log = tmp_path / "docker.log"
+        return log.read_text().splitlines() if log.exists() else []
+
+    return calls
+
+
+def test_client(fake):
+    assert engine.client() is not None
+    assert engine.client().path == fake.path
+
+
+def test_no_client_without_the_socket(tmp_path, monkeypatch):
+    monkeypatch.setenv("DOCKER_HOST", f"unix://{tmp_path}/missing.sock")
+    monkeypatch.setattr(engine, "_checked", None)
+    assert engine.client() is None
+
+
+def test_images(fake, docker_cli):
+    fake.images = [{"Id": "sha256:1", "RepoTags": ["app:latest"], "Config": {"Labels": {"wright.inputs": "abc"}}}]
+    client = engine.client()
+
+    assert client.image_exists("app:latest")
+    assert not client.image_exists("app:old")
+    assert client.image_labels("app:latest") == {"wright.inputs": "abc"}
+    assert client.image_labels("app:old") is None
+
+    assert docker.exists("app")
+    assert not docker.exists("app", "old")
+    assert docker_cli() == []
+
+
+def test_containers(fake, docker_cli):
+    fake.containers = {
+        "web1": container(labels={"com.wsp.conduit.coupling": "web"}),
+        "done1": container("exited"),
+    }
+    client = engine.client()
+
+    assert [c["Id"] for c in client.containers()] == ["web1"]
+    assert sorted(c["Id"] for c in client.containers(all=True)) == ["done1", "web1"]
+    assert [c["Id"] for c in client.containers({"label": ["com.wsp.conduit.coupling=web"]})] == ["web1"]
+    assert client.containers({"label": ["com.wsp.conduit.coupling=db"]}) == []
+
+    assert docker.running(coupling="web")
+    assert not docker.running(coupling="db")
+    assert docker_cli() == []
+
+
+def test_snapshot(fake, docker_cli):
+    fake.images = [{"Id": "sha256:1", "RepoTags": ["app:latest", "app:v2"]},
+                   {"Id": "sha256:2", "RepoTags": ["db:latest"]}]
+    fake.containers = {
+        "app1": container(image="sha256:1", image_id="sha256:1"),
+        "web1": container(image="web:latest", labels={"com.wsp.conduit.coupling": "web"}),
+        "db1": container("exited", image="db:latest"),
+    }
+
+    snapshot = engine.snapshot()
+    assert snapshot.has_image("app")
+    assert snapshot.has_image("app", "v2")
+    assert not snapshot.has_image("web")
+
+    # Started from the image by ID, under either of its tags
+    assert snapshot.running(container_name="app") == ["app1"]
+    assert snapshot.running(container_name="app", version="v2") == ["app1"]
+    assert snapshot.running(coupling="web") == ["web1"]
+    assert snapshot.running(container_name="db") == []
+
+    assert docker.exists("app", "v2", snapshot=snapshot)
+    assert docker.running(container_name="web", version="latest", snapshot=snapshot)
+    assert fake.requests.count("/images/json") == 1
+    assert docker_cli() == []
+
+
+def test_compose(fake, docker_cli, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("COMPOSE_PROJECT_NAME", raising=False)
+    monkeypatch.delenv("COMPOSE_FILE", raising=False)
+    (tmp_path / "compose.yaml").write_text("name: shop\nservices:\n  web:\n    image: web\n")
+    labels = {"com.docker.compose.project": "shop",
+              "com.docker.compose.project.config_files": str(tmp_path / "compose.yaml")}
+    fake.containers = {"web1": container(labels=labels)}
+
+    assert compose.running()
+    assert compose.running(snapshot=engine.snapshot())
+
+    monkeypatch.setenv("COMPOSE_PROJECT_NAME", "other")
+    assert not compose.running()
+    assert not compose.running(snapshot=engine.snapshot())
+    assert docker_cli() == []
+
+
+def test_compose_snapshot_without_a_name(fake, docker_cli, tmp_path, monkeypatch):
+    (tmp_path / "shop" / "sub").mkdir(parents=True)
+    (tmp_path / "shop" / "compose.yaml").write_text("services:\n  web:\n    image: web\n")
+    monkeypatch.chdir(tmp_path / "shop" / "sub")
+    monkeypatch.delenv("COMPOSE_PROJECT_NAME", raising=False)
+    monkeypatch.delenv("COMPOSE_FILE", raising=False)
+    fake.containers = {"web1": container(labels={
+        "com.docker.compose.project": "shop",
+        "com.docker.compose.project.config_files": str(tmp_path / "shop" / "compose.yaml")})}
+
+    # Matched by the compose file found in a parent directory, without
+    # asking compose
+    assert compose.running(snapshot=engine.snapshot())
+    assert docker_cli() == []
+
+
+def test_falls_back_to_the_docker_command(fake, docker_cli, tmp_path):
+    fake.broken = {"/images/app:latest/json", "/containers/json", "/images/json"}
+
+    (tmp_path / "docker.out").write_text("[{\"Id\": \"sha256:1\"}]\n")
+    assert docker.exists("app")
+    assert "inspect app:latest" in docker_cli()
+
+    (tmp_path / "docker.out").write_text("web1\n")
+    assert docker.running(coupling="web")
+    assert "ps -q --filter label=com.wsp.conduit.coupling=web" in docker_cli()
+
+    (tmp_path / "docker.out").write_text(json.dumps({"ID": "sha256:1", "Repository": "app", "Tag": "latest"}) + "\n")
+    assert engine.snapshot().has_image("app")
+    assert any(call.startswith("image ls") for call in docker_cli())
+
+
+def test_wait_healthy_follows_health_checks(fake):
+    fake.containers = {"app1": container(health="starting")}
+    fake.events = [(0.1, {"app1": container(health="healthy")}, event("app1", "health_status: healthy"))]
+
+    started = time.monotonic()
+    engine.wait_healthy(["app1"], timeout=10)
+    assert time.monotonic() - started < 5
+
+
+def test_wait_healthy_unhealthy(fake):
+    fake.containers = {"app1": container(health="starting")}
+    fake.events = [(0.1, {"app1": container(health="unhealthy")}, event("app1", "health_status: unhealthy"))]
+
+    with pytest.raises(engine.UnhealthyError, match="unhealthy"):
+        engine.wait_healthy(["app1"], timeout=10)
+
+
+@pytest.mark.parametrize("exit_code", [0, 3])
+def test_wait_healthy_exit(fake, exit_code):
+    fake.containers = {"job1": container("created")}
+    fake.events = [(0.1, {"job1": container("exited", exit_code=exit_code)}, die("job1", exit_code))]
+
+    if exit_code:
+        with pytest.raises(engine.UnhealthyError, match="exited with status 3"):
+            engine.wait_healthy(["job1"], timeout=10)
+    else:
+        engine.wait_healthy(["job1"], timeout=10)
+
+
+@pytest.mark.parametrize("exit_code", [0, 3])
+def test_wait_healthy_removed_container(fake, exit_code):
+    # A docker run --rm container that finished before anyone looked:  only
+    # the replayed events tell how it went
+    fake.events = [(0, {}, event("job1", "start")), (0, {}, die("job1", exit_code)), (0, {}, event("job1", "destroy"))]
+
+    if exit_code:
+        with pytest.raises(engine.UnhealthyError, match="exited with status 3"):
+            engine.wait_healthy(["job1"], timeout=10, since=time.time())
+    else:
+        engine.wait_healthy(["job1"], timeout=10, since=time.time())
+
+
+def test_wait_healthy_times_out(fake):
+    fake.containers = {"app1": container(health="starting")}
+
+    with pytest.raises(engine.UnhealthyError, match="Timed out"):
+        engine.wait_healthy(["app1"], timeout=0.5)
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+# Heavy parts of Wright that importing the package or forwarding a command to
+# the daemon must not pull in
+DEFERRED = ("wright.docker", "wright.aws", "wright.golang", "wright.openapi", "wright.pandoc", "click", "sqlite3")
+
+# Microseconds importing Wright may take, everything it imports included.
+# Hooks run wright dozens of times per commit; today it takes a few
+# milliseconds, so this leaves room for slow machines but not for an eager
+# import of click or the tool helpers.
+BUDGET = 50_000
+
+
+def importtime(code: str) -> tuple[set[str], int]:
+    """The modules Python imports running the code, and the microseconds
+    spent importing Wright's own modules, from -X importtime."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(SRC), env.get("PYTHONPATH")]))
+    env["WRIGHT_DAEMON"] = "0"
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, env=env, check=True)
+
+    modules = set()
+    elapsed = 0
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            modules.add(name.strip())
+
+            # Top-level entries include the time of everything they import
+            if name.startswith(" wright") and cumulative.strip().isdigit():
+                elapsed += int(cumulative)
+
+    return modules, elapsed
+
+
+def imported(code: str) -> set[str]:
+    return importtime(code)[0]
+
+
+def elapsed(code: str) -> int:
+    """The quickest of a few runs, as a busy machine only ever adds time."""
+    return min(importtime(code)[1] for _ in range(3))
+
+
+def deferred(modules: set[str]) -> list[str]:
+    return sorted(name for name in modules if any(name == d or name.startswith(d + ".") for d in DEFERRED))
+
+
+def test_import_wright():
+    assert deferred(imported("import wright")) == []
+
+
+def test_import_task_api():
+    assert deferred(imported("from wright import task, sources, target, depends")) == []
+
+
+def test_daemon_client():
+    assert deferred(imported("from wright import daemon; daemon.forward(['build'])")) == []
+
+
+def test_import_budget():
+    assert elapsed("import wright") < BUDGET
+
+
+def test_daemon_client_budget():
+    assert elapsed("from wright import daemon; daemon.forward(['build'])") < BUDGET
@@ -0,0 +1,152 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from wright.proojekt import scheduler
+from wright.proojekt.decorators import depends
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+
+class Recorder:
+    """Builds tasks that note when they run and how many run at once."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs: list[str] = []
+        self.active = 0
+        self.most = 0
+
+    def task(self, name: str, pause: float = 0.0, error: Exception | None = None, barrier=None):
+        def run():
+            with self.lock:
+                self.runs.append(name)
+                self.active += 1
+                self.most = max(self.most, self.active)
+            try:
+                if barrier:
+                    barrier.wait()
+                time.sleep(pause)
+                if error:
+                    raise error
+            finally:
+                with self.lock:
+                    self.active -= 1
+
+        run.__name__ = name
+        return run
+
+
+def diamond(recorder: Recorder, **options):
+    """top depends on left and right, which both depend on base."""
+    base = recorder.task("base")
+    left = depends(base)(recorder.task("left", **options))
+    right = depends(base)(recorder.task("right", **options))
+    return depends(left)(depends(right)(recorder.task("top")))
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_diamond_runs_shared_task_once(jobs):
+    recorder = Recorder()
+    top = diamond(recorder)
+
+    with scheduler.session(jobs):
+        top()
+
+    assert sorted(recorder.runs) == ["base", "left", "right", "top"]
+    assert recorder.runs[0] == "base"
+    assert recorder.runs[-1] == "top"
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_failure_propagates(jobs):
+    recorder = Recorder()
+    broken = recorder.task("broken", error=ValueError("broken"))
+    middle = depends(broken)(recorder.task("middle"))
+    top = depends(middle)(recorder.task("top"))
+
+    with scheduler.session(jobs), pytest.raises(ValueError, match="broken"):
+        top()
+
+    assert recorder.runs == ["broken"]
+
+
+def test_jobs_run_independent_tasks_together():
+    recorder = Recorder()
+    # Only passes once both sides are waiting at the same time
+    top = diamond(recorder, barrier=threading.Barrier(2, timeout=5))
+
+    with scheduler.session(2):
+        top()
+
+    assert recorder.most == 2
+
+
+def test_one_job_runs_tasks_one_at_a_time():
+    recorder = Recorder()
+    top = diamond(recorder, pause=0.05)
+
+    with scheduler.session(1):
+        top()
+
+    assert recorder.most == 1
+
+
+def test_cycle():
+    def first():
+        pass
+
+    def second():
+        pass
+
+    first.__wright_depends__ = [second]
+    second.__wright_depends__ = [first]
+
+    with pytest.raises(scheduler.CyclicDependencyError):
+        scheduler.graph([first])
+
+
+@pytest.mark.parametrize("jobs, together", [("1", False), ("2", True)])
+def test_cli_jobs(tmp_path, jobs, together):
+    (tmp_path / "BUILD.py").write_text(
+        "import threading, time\n"
+        "from wright import depends, task\n"
+        "\n"
+        "lock = threading.Lock()\n"
+        "active = [0, 0]\n"
+        "\n"
+        "def work():\n"
+        "    with lock:\n"
+        "        active[0] += 1\n"
+        "        active[1] = max(active)\n"
+        "    time.sleep(0.2)\n"
+        "    with lock:\n"
+        "        active[0] -= 1\n"
+        "\n"
+        "@task\n"
+        "def left():\n"
+        "    work()\n"
+        "\n"
+        "@task\n"
+        "def right():\n"
+        "    work()\n"
+        "\n"
+        "@task\n"
+        "@depends(left)\n"
+        "@depends(right)\n"
+        "def build():\n"
+        "    print('most', active[1])\n")
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(SRC), env.get("PYTHONPATH")]))
+    env["WRIGHT_DAEMON"] = "0"
+    env["WRIGHT_STATE_DIR"] = str(tmp_path / ".wright")
+
+    result = subprocess.run([sys.executable, "-m", "wright.main", "-j", jobs, "build"],
+                            cwd=tmp_path, capture_output=True, text=True, env=env, check=True)
+    assert f"most {2 if together else 1}" in result.stdout
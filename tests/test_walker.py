@@ -0,0 +1,112 @@
+from pathlib import Path
+
+from wright.proojekt import walker
+
+
+def tree(root: Path, *files: str):
+    for name in files:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+
+    # .gitignore files above the walk are only read inside a repository
+    (root / ".git").mkdir(exist_ok=True)
+
+
+def walk(root: Path, globs: list[str], excludes: list[str] | None = None,
+         directories: list[str] | None = None) -> list[str]:
+    return sorted(str(path.relative_to(root)) for path in walker.match_files(globs, excludes,
+                                                                             directories=directories))
+
+
+def test_negation(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tree(tmp_path, ".gitignore", "app.log", "keep.log", "logs/debug.log", "logs/keep.log")
+    (tmp_path / ".gitignore").write_text("*.log\n!keep.log\n")
+
+    assert walk(tmp_path, ["**/*.log"]) == ["keep.log", "logs/keep.log"]
+
+
+def test_negation_needs_the_last_word(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tree(tmp_path, ".gitignore", "keep.log")
+    (tmp_path / ".gitignore").write_text("!keep.log\n*.log\n")
+
+    assert walk(tmp_path, ["*.log"]) == []
+
+
+def test_dir_only(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tree(tmp_path, ".gitignore", "build/out.txt", "docs/build", "docs/build.txt")
+    (tmp_path / ".gitignore").write_text("build/\n")
+
+    # A file named build stays; only directories named build are ignored
+    assert walk(tmp_path, ["**/*"]) == [".gitignore", "docs/build", "docs/build.txt"]
+
+
+def test_anchored_and_unanchored(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tree(tmp_path, ".gitignore", "top.txt", "sub/top.txt", "tmp/a.txt", "sub/tmp/b.txt",
+         "docs/a.md", "sub/docs/a.md")
+    (tmp_path / ".gitignore").write_text("/top.txt\ntmp\ndocs/*.md\n")
+
+    # A leading or middle slash anchors a pattern to its .gitignore; without
+    # one it matches at any depth
+    assert walk(tmp_path, ["**/*.txt", "**/*.md"]) == ["sub/docs/a.md", "sub/top.txt"]
+
+
+def test_nested_gitignore(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tree(tmp_path, "a/.gitignore", "a/gen.go", "a/main.go", "b/gen.go")
+    (tmp_path / "a" / ".gitignore").write_text("/gen.go\n")
+
+    assert walk(tmp_path, ["**/*.go"]) == ["a/main.go", "b/gen.go"]
+
+
+def test_gitignore_above_the_walk(tmp_path, monkeypatch):
+    tree(tmp_path, ".gitignore", "app/main.go", "app/vendor/lib.go")
+    (tmp_path / ".gitignore").write_text("vendor/\n")
+    monkeypatch.chdir(tmp_path / "app")
+
+    assert walk(tmp_path, ["**/*.go"]) == ["app/main.go"]
+
+
+def test_excludes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tree(tmp_path, "main.go", "main_test.go", "mocks/mock.go")
+
+    assert walk(tmp_path, ["**/*.go"], excludes=["*_test.go", "mocks/"]) == ["main.go"]
+    assert walker.matches(["**/*.go"], tmp_path / "main.go", excludes=["*_test.go"])
+    assert not walker.matches(["**/*.go"], tmp_path / "main_test.go", excludes=["*_test.go"])
+    assert not walker.matches(["**/*.go"], tmp_path / "mocks" / "mock.go", excludes=["mocks/"])
+
+
+def test_literal_paths_are_always_included(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tree(tmp_path, ".gitignore", "generated.go")
+    (tmp_path / ".gitignore").write_text("generated.go\n")
+
+    assert walk(tmp_path, ["generated.go"]) == ["generated.go"]
+    assert walk(tmp_path, ["*.go"]) == []
+
+
+def test_prunes_directories(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tree(tmp_path, ".gitignore", "src/app.py", "src/pkg/mod.py", "src/node_modules/dep/index.py",
+         "other/skip.py", ".wright/cache/x.py")
+    (tmp_path / ".gitignore").write_text("node_modules/\n")
+
+    read: list[str] = []
+    assert walk(tmp_path, ["src/**/*.py"], directories=read) == ["src/app.py", "src/pkg/mod.py"]
+
+    # Neither ignored directories nor ones no glob can match are read
+    assert sorted(str(Path(d).relative_to(tmp_path)) for d in read) == ["src", "src/pkg"]
+
+
+def test_globs_share_one_walk(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tree(tmp_path, "a/x.go", "a/b/y.go", "a/b/z.txt")
+
+    read: list[str] = []
+    assert walk(tmp_path, ["a/**/*.go", "a/b/*.txt"], directories=read) == ["a/b/y.go", "a/b/z.txt", "a/x.go"]
+    assert sorted(str(Path(d).relative_to(tmp_path)) for d in read) == ["a", "a/b"]